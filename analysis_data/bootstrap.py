@@ -0,0 +1,214 @@
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def cluster_bootstrap(data,
+                      value = 'screentime',
+                      cells = ('user_idx', 'course_num_sem'),
+                      n_replicates = 1000,
+                      seed = 0,
+                      workers = 1,
+                      block_size = 50,
+                      normal_threshold = None) :
+
+    """
+    Return bootstrap replicates of the mean of a value in each cell, resampling the rows (timebins) within each cell.
+
+    A replicate of a cell with n rows is the mean of n rows drawn with replacement from the cell, which is the same
+    as weighting the rows with multinomial weights. The draws of all cells are made at once as one array of row
+    indices: a uniform number per row is scaled to the size of the row's cell and shifted to the cell's first row,
+    and the drawn values are summed per cell with numpy.bincount.
+
+    Cells with at least normal_threshold rows are not resampled. Their replicate means are drawn from the normal
+    approximation of the bootstrap distribution of the mean, with the variance computed from the cell's sum and sum
+    of squares, so large cells cost the same as small cells.
+
+    The replicates are split into blocks of block_size replicates, which are spread over a process pool. Each block
+    gets its own random generator spawned from seed with numpy.random.SeedSequence, so the replicates only depend
+    on seed and block_size, not on the number of workers.
+
+    Parameters
+    ----------
+    data             : pandas.DataFrame
+
+                       The rows to resample, e.g. the in-class screen behaviour panel.
+
+    value            : str
+
+                       The variable to average.
+
+    cells            : list of str
+
+                       The variables defining the cells.
+
+    n_replicates     : int
+
+                       Number of bootstrap replicates.
+
+    seed             : int
+
+                       Seed of the random generators.
+
+    workers          : int
+
+                       Number of worker processes. With 1 worker, the replicates are drawn in this process.
+
+    block_size       : int
+
+                       Number of replicates drawn by a worker at a time.
+
+    normal_threshold : int
+
+                       Optional minimum number of rows of the cells, which use the normal approximation.
+
+    Output
+    ------
+    A tuple with:
+
+    * A pandas.DataFrame with the cells, their number of rows (n) and the mean of the value (mean).
+    * A (cells x replicates) numpy array with the replicate means.
+    """
+
+    data = data.dropna(subset = [value])
+
+    codes, groups = pd.MultiIndex.from_frame(data[list(cells)]).factorize(sort = True)
+
+    order = np.argsort(codes, kind = 'mergesort')
+    codes = codes[order]
+    values = data[value].to_numpy(dtype = float)[order]
+
+    counts = np.bincount(codes, minlength = len(groups))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    sums = np.bincount(codes, weights = values, minlength = len(groups))
+    sums_sq = np.bincount(codes, weights = values ** 2, minlength = len(groups))
+
+    normal = np.zeros(len(groups), dtype = bool) if normal_threshold is None else counts >= normal_threshold
+
+    state = {'values': values,
+             'codes': codes,
+             'counts': counts,
+             'starts': starts,
+             'sums': sums,
+             'sums_sq': sums_sq,
+             'normal': normal}
+
+    block_sizes = [min(block_size, n_replicates - i) for i in range(0, n_replicates, block_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(block_sizes))
+
+    tasks = list(zip(seeds, block_sizes))
+
+    if workers > 1 :
+        with Pool(workers, initializer = init_worker, initargs = (state, )) as pool :
+            blocks = pool.map(replicate_block, tasks)
+    else :
+        init_worker(state)
+        blocks = list(map(replicate_block, tasks))
+
+    replicates = np.concatenate(blocks, axis = 1) if blocks else np.zeros((len(groups), 0))
+
+    result = pd.DataFrame(list(groups), columns = list(cells))
+    result['n'] = counts
+    result['mean'] = sums / counts
+
+    return result, replicates
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def bootstrap_intervals(result, replicates, level = 0.95) :
+
+    """
+    Return the result of cluster_bootstrap with the bootstrap standard error (se) and the percentile confidence
+    interval (lower, upper) of the mean of each cell
+    """
+
+    alpha = (1 - level) / 2
+
+    result = result.copy()
+    result['se'] = replicates.std(axis = 1, ddof = 1)
+    result['lower'] = np.quantile(replicates, alpha, axis = 1)
+    result['upper'] = np.quantile(replicates, 1 - alpha, axis = 1)
+
+    return result
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+_worker = {}
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def init_worker(state) :
+
+    """
+    Helper function for cluster_bootstrap
+
+    Prepare the arrays used by replicate_block in a worker process
+    """
+
+    resampled = ~state['normal'][state['codes']]
+
+    _worker.update(state)
+
+    #The rows of the resampled cells with the first row and the size of their cell
+    _worker['row_codes'] = state['codes'][resampled]
+    _worker['row_starts'] = state['starts'][state['codes']][resampled]
+    _worker['row_counts'] = state['counts'][state['codes']][resampled]
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def replicate_block(task) :
+
+    """
+    Helper function for cluster_bootstrap
+
+    Return a (cells x replicates) array with the replicate means of a block of replicates
+    """
+
+    seed, n = task
+
+    rng = np.random.default_rng(seed)
+
+    counts = _worker['counts']
+    normal = _worker['normal']
+    n_cells = len(counts)
+
+    means = _worker['sums'] / counts
+    variances = np.maximum(_worker['sums_sq'] / counts - means ** 2, 0)
+    normal_se = np.sqrt(variances[normal] / counts[normal])
+
+    block = np.empty((n_cells, n))
+
+    row_starts = _worker['row_starts']
+    row_counts = _worker['row_counts']
+
+    for r in range(n) :
+
+        draws = row_starts + (rng.random(len(row_starts)) * row_counts).astype(np.int64)
+
+        sums = np.bincount(_worker['row_codes'], weights = _worker['values'][draws], minlength = n_cells)
+
+        block[:, r] = sums / counts
+        block[normal, r] = means[normal] + normal_se * rng.standard_normal(len(normal_se))
+
+    return block
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
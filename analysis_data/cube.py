@@ -0,0 +1,181 @@
+import numpy as np
+import pandas as pd
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+DIMENSIONS = ['user_idx', 'semester', 'inclass', 'daytime', 'course_num_sem', 'hour_of_week']
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+class MeasureCube :
+
+    """
+    Aggregate cube of the screen behaviour panel.
+
+    The cube stores the sum of each measure and the number of valid timebins (n_bins) in each cell of the grouping
+    dimensions. The mean of a measure for any roll-up of the dimensions is the sum of the sums over the cells divided
+    by the sum of the n_bins, so it is the same as the mean over the timebins of the panel, but it is computed from
+    the cells instead of the panel. New users or timebins are added by adding their sums to the cells.
+
+    Parameters
+    ----------
+    dimensions : list of str
+
+                 The grouping dimensions. hour_of_week (0 is Monday 00-01 UTC) is derived from the timebin, if the
+                 panel does not have it.
+
+    measures   : list of str
+
+                 The measures. Defaults to all the screentime and screencount variables of the first panel added.
+                 Every panel added must have all the measures.
+    """
+
+    def __init__(self, dimensions = None, measures = None) :
+
+        self.dimensions = list(DIMENSIONS if dimensions is None else dimensions)
+        self.measures = None if measures is None else list(measures)
+        self.cells = None
+
+
+    def add(self, panel, **constants) :
+
+        """
+        Add the timebins of a panel to the cube.
+
+        Parameters
+        ----------
+        panel     : pandas.DataFrame
+
+                    Rows of the screen behaviour panel with the measures and the dimensions (or a timebin variable
+                    for hour_of_week).
+
+        constants : Values of the dimensions, which are the same for all rows and not in the panel,
+                    e.g. inclass = False, course_num_sem = np.nan.
+        """
+
+        panel = panel.assign(**constants)
+
+        if 'hour_of_week' in self.dimensions and 'hour_of_week' not in panel.columns :
+            panel = panel.assign(hour_of_week = hour_of_week(panel['timebin']))
+
+        if self.measures is None :
+            self.measures = [c for c in panel.columns if c.startswith('screentime') or c.startswith('screencount')]
+
+        missing = [m for m in self.measures if m not in panel.columns]
+        if missing :
+            raise ValueError('The panel does not have the measures {} of the cube'.format(missing))
+
+        cells = panel[self.dimensions + self.measures].assign(n_bins = 1)
+        cells = cells.groupby(self.dimensions, as_index = False, dropna = False, sort = False).sum()
+
+        if self.cells is not None :
+            cells = pd.concat([self.cells, cells], ignore_index = True)
+            cells = cells.groupby(self.dimensions, as_index = False, dropna = False, sort = False).sum()
+
+        self.cells = cells
+
+        return self
+
+
+    def drop_users(self, users, key = 'user_idx') :
+
+        """
+        Remove the cells of the given users, e.g. before their timebins are added again after a rebuild
+        """
+
+        self.cells = self.cells[~self.cells[key].isin(users)].reset_index(drop = True)
+
+        return self
+
+
+    def query(self, by, where = None, measures = None) :
+
+        """
+        Return the mean of the measures for each combination of the by dimensions.
+
+        Parameters
+        ----------
+        by       : list of str
+
+                   The dimensions to keep. The other dimensions are rolled up.
+
+        where    : dict
+
+                   Optional filter on the dimensions, e.g. {'inclass': True, 'daytime': True}. A list of values
+                   selects the cells with any of the values.
+
+        measures : list of str
+
+                   The measures to return. Defaults to all measures.
+
+        Output
+        ------
+        A pandas.DataFrame with the by dimensions, the mean of each measure and the n_bins of each group.
+        """
+
+        measures = self.measures if measures is None else list(measures)
+
+        cells = self.cells
+
+        for dimension, value in (where if where is not None else {}).items() :
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            cells = cells[cells[dimension].isin(values)]
+
+        sums = cells[list(by) + measures + ['n_bins']].groupby(list(by), as_index = False, dropna = False).sum()
+
+        sums[measures] = sums[measures].div(sums['n_bins'], axis = 0)
+
+        return sums
+
+
+    def save(self, path) :
+
+        """
+        Save the cube to a pickle file, which can be read with load_cube
+        """
+
+        pd.to_pickle({'dimensions': self.dimensions, 'measures': self.measures, 'cells': self.cells}, path)
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def load_cube(path) :
+
+    """
+    Return a cube saved with MeasureCube.save
+    """
+
+    saved = pd.read_pickle(path)
+
+    cube = MeasureCube(saved['dimensions'], saved['measures'])
+    cube.cells = saved['cells']
+
+    return cube
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def hour_of_week(timebin) :
+
+    """
+    Helper function for MeasureCube
+
+    Return the hour of the week (0 to 167, starting Monday 00:00 UTC) of epoch times
+    """
+
+    #The beginning of epoch time was a Thursday, 3 days after the beginning of the week
+    return (np.asarray(timebin) // 3600 + 3 * 24) % (7 * 24)
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
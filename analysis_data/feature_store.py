@@ -0,0 +1,250 @@
+import numpy as np
+import pandas as pd
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+class FeatureStore :
+
+    """
+    Feature store keyed on a single sorted user index.
+
+    Sources are registered with their column projections and renames, and assemble aligns all of them
+    on the sorted keys of a base source with one lookup per source. This gives the same rows and columns as
+    a chain of left merges on the key, but the columns are written into one preallocated block per
+    dtype kind (numeric and other), instead of copying the growing frame once per merge. The columns then get
+    back the dtype of their source (see column_dtype), so e.g. bool and categorical columns stay bool and
+    categorical.
+
+    Parameters
+    ----------
+    key : str
+
+          The name of the user id variable.
+    """
+
+    def __init__(self, key = 'user_idx') :
+
+        self.key = key
+        self.sources = []
+
+
+    def register(self, name, frame, columns = None, rename = None, key_from_index = False) :
+
+        """
+        Register a source of features.
+
+        Parameters
+        ----------
+        name           : str
+
+                         Name of the source.
+
+        frame          : pandas.DataFrame
+
+                         The source. It may contain each user at most once.
+
+        columns        : list of str
+
+                         The columns to take from the source. Defaults to all columns except the key.
+
+        rename         : dict
+
+                         Optional renaming of the columns.
+
+        key_from_index : bool
+
+                         If True, the user ids are taken from the index of the frame instead of the key column.
+        """
+
+        keys = frame.index.to_numpy() if key_from_index else frame[self.key].to_numpy()
+
+        if columns is None :
+            columns = [c for c in frame.columns if c != self.key]
+
+        if pd.Index(keys).has_duplicates :
+            raise ValueError('The source {} contains some users more than once'.format(name))
+
+        order = np.argsort(keys, kind = 'mergesort')
+
+        values = frame[list(columns)].rename(columns = rename if rename is not None else {})
+
+        self.sources.append({'name': name, 'keys': keys[order], 'order': order, 'values': values})
+
+        return self
+
+
+    def assemble(self, base = None) :
+
+        """
+        Return a dataframe with the key and the columns of all sources aligned on the users of the base source
+        (the first registered source, if base is None) in sorted order
+        """
+
+        base_source = self.sources[0] if base is None else self.source(base)
+        index = base_source['keys']
+
+        columns = [c for source in self.sources for c in source['values'].columns]
+
+        if len(set(columns)) < len(columns) :
+            raise ValueError('Two sources have columns with the same name')
+
+        numeric = [c for source in self.sources for c in source['values'].columns
+                   if pd.api.types.is_numeric_dtype(source['values'][c])]
+        numeric_pos = {c : j for j, c in enumerate(numeric)}
+        other_pos = {c : j for j, c in enumerate(c for c in columns if c not in numeric_pos)}
+
+        numeric_block = np.full((len(index), len(numeric_pos)), np.nan)
+        other_block = np.full((len(index), len(other_pos)), np.nan, dtype = object)
+
+        dtypes = {}
+
+        for source in self.sources :
+
+            if len(source['keys']) == 0 :
+                dtypes.update({c : column_dtype(source['values'][c].dtype, len(index) == 0)
+                               for c in source['values'].columns})
+                continue
+
+            pos = np.minimum(np.searchsorted(source['keys'], index), len(source['keys']) - 1)
+            found = source['keys'][pos] == index
+            rows = source['order'][pos[found]]
+
+            for c in source['values'].columns :
+                dtypes[c] = column_dtype(source['values'][c].dtype, found.all())
+                values = source['values'][c].to_numpy()[rows]
+                if c in numeric_pos :
+                    numeric_block[found, numeric_pos[c]] = values
+                else :
+                    other_block[found, other_pos[c]] = values
+
+        assembled = pd.concat([pd.DataFrame({self.key: index}),
+                               pd.DataFrame(numeric_block, columns = list(numeric_pos)),
+                               pd.DataFrame(other_block, columns = list(other_pos))], axis = 1)
+
+        return assembled[[self.key] + columns].astype(dtypes)
+
+
+    def save(self, path, base = None) :
+
+        """
+        Assemble the features and save them to a .npz file, which can be read with load_features
+        """
+
+        save_features(self.assemble(base), path, self.key)
+
+
+    def source(self, name) :
+
+        """
+        Helper function for assemble
+
+        Return the registered source with the given name
+        """
+
+        for source in self.sources :
+            if source['name'] == name :
+                return source
+
+        raise KeyError(name)
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def column_dtype(dtype, complete) :
+
+    """
+    Helper function for FeatureStore
+
+    Return the dtype of an assembled column from the dtype of its source. If complete is False, some users are
+    missing from the source: integer columns become floats with NaN like in a left merge, bool columns become
+    the nullable boolean dtype, and the other dtypes (e.g. categorical) keep their dtype with missing values.
+    """
+
+    if complete or isinstance(dtype, pd.CategoricalDtype) :
+        return dtype
+
+    if pd.api.types.is_bool_dtype(dtype) :
+        return pd.BooleanDtype()
+
+    if pd.api.types.is_integer_dtype(dtype) :
+        return np.dtype(float)
+
+    return dtype
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def save_features(features, path, key = 'user_idx') :
+
+    """
+    Save an assembled feature matrix to a .npz file with the sorted keys, the numeric block, the other block
+    and the dtypes of the columns
+    """
+
+    columns = [c for c in features.columns if c != key]
+    numeric = [c for c in columns if pd.api.types.is_numeric_dtype(features[c])]
+    other = [c for c in columns if c not in numeric]
+
+    dtypes = np.empty(len(columns), dtype = object)
+    dtypes[:] = [features[c].dtype for c in columns]
+
+    np.savez(path,
+             key = np.array([key]),
+             index = features[key].to_numpy(),
+             columns = np.array(columns, dtype = object),
+             dtypes = dtypes,
+             numeric_columns = np.array(numeric, dtype = object),
+             numeric = features[numeric].to_numpy(dtype = float, na_value = np.nan),
+             other_columns = np.array(other, dtype = object),
+             other = features[other].to_numpy(dtype = object))
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def load_features(path, columns = None) :
+
+    """
+    Return the key and the requested columns (all columns, if columns is None) of a feature matrix saved
+    with FeatureStore.save with their saved dtypes
+    """
+
+    with np.load(path, allow_pickle = True) as saved :
+
+        key = str(saved['key'][0])
+        all_columns = list(saved['columns'])
+        numeric_pos = {c : j for j, c in enumerate(saved['numeric_columns'])}
+        other_pos = {c : j for j, c in enumerate(saved['other_columns'])}
+
+        if columns is None :
+            columns = all_columns
+
+        numeric = saved['numeric']
+        other = saved['other']
+
+        #Files saved before the dtypes were recorded keep the dtypes of the blocks
+        dtypes = dict(zip(all_columns, saved['dtypes'])) if 'dtypes' in saved.files else {}
+
+        features = pd.DataFrame({key: saved['index']})
+
+        for c in columns :
+            if c in numeric_pos :
+                features[c] = numeric[:, numeric_pos[c]]
+            else :
+                features[c] = other[:, other_pos[c]]
+            if c in dtypes :
+                features[c] = features[c].astype(dtypes[c])
+
+    return features
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
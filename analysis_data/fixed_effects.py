@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def demean_two_way(data, columns, fe1 = 'user_idx', fe2 = 'course_num_sem', tol = 1e-10, max_iter = 10000) :
+
+    """
+    Return the columns demeaned on two fixed effects together with the degrees-of-freedom metadata.
+
+    The columns are demeaned with alternating projections: the group means of fe1 and fe2 are subtracted in turn,
+    until the largest change in a sweep is below tol. The groups are represented by integer codes, and the group
+    means are computed with numpy.bincount, so no dummy variables are ever built. A regression without an intercept
+    on the demeaned columns gives the same coefficients as a regression on the original columns with dummies for
+    both fixed effects (e.g. lm(grade ~ screentime + skipping + user_idx + course_num_sem)).
+
+    Parameters
+    ----------
+    data    : pandas.DataFrame
+
+              The dataset with the columns to demean and the two fixed effect variables.
+              Rows with missing values in any of them are dropped first.
+
+    columns : list of str
+
+              The columns to demean, e.g. the response and the regressors.
+
+    fe1     : str
+    fe2     : str
+
+              The names of the two fixed effect variables.
+
+    tol     : float
+
+              Convergence tolerance on the largest absolute change in a sweep.
+
+    max_iter: int
+
+              Maximum number of sweeps.
+
+    Output
+    ------
+    A tuple with:
+
+    * A pandas.DataFrame with fe1, fe2 and the demeaned columns.
+    * A dict with the metadata:
+      - n_obs        : Number of observations used.
+      - n_dropped    : Number of observations dropped because of missing values.
+      - n_groups     : Number of groups of each fixed effect.
+      - n_components : Number of connected components of the bipartite graph of fe1 and fe2 groups.
+                       One fixed effect per component is redundant.
+      - df_fe        : Degrees of freedom absorbed by the fixed effects (n_groups of both minus n_components).
+                       The residual degrees of freedom of a regression on the demeaned columns
+                       is n_obs - df_fe - the number of regressors.
+      - iterations   : Number of sweeps.
+      - converged    : True, if the largest change in the last sweep was below tol.
+    """
+
+    complete = data.dropna(subset = list(columns) + [fe1, fe2])
+
+    codes1, groups1 = pd.factorize(complete[fe1], sort = True)
+    codes2, groups2 = pd.factorize(complete[fe2], sort = True)
+
+    counts1 = np.bincount(codes1, minlength = len(groups1))
+    counts2 = np.bincount(codes2, minlength = len(groups2))
+
+    values = complete[list(columns)].to_numpy(dtype = float).copy()
+
+    converged = False
+    iteration = 0
+
+    while iteration < max_iter and not converged :
+
+        iteration += 1
+
+        change = 0.0
+
+        for codes, counts in ((codes1, counts1), (codes2, counts2)) :
+            means = group_means(values, codes, counts)
+            values -= means[codes]
+            change = max(change, np.abs(means).max(initial = 0.0))
+
+        converged = change < tol
+
+    demeaned = pd.DataFrame(values, columns = list(columns), index = complete.index)
+    demeaned.insert(0, fe2, complete[fe2])
+    demeaned.insert(0, fe1, complete[fe1])
+
+    n_components = connected_components(codes1, codes2, len(groups1), len(groups2))
+
+    meta = {'n_obs': len(complete),
+            'n_dropped': len(data) - len(complete),
+            'n_groups': {fe1: len(groups1), fe2: len(groups2)},
+            'n_components': n_components,
+            'df_fe': len(groups1) + len(groups2) - n_components,
+            'iterations': iteration,
+            'converged': bool(converged)}
+
+    return demeaned.reset_index(drop = True), meta
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def filter_sparse_groups(data, threshold, fe1 = 'user_idx', fe2 = 'course_num_sem') :
+
+    """
+    Return the rows of data, where both the fe1 group and the fe2 group have at least threshold observations.
+
+    Removing rows can make other groups too small, so the filter is repeated until no more rows are removed
+    (the same as filter_sparse_groups in analysis.R).
+    """
+
+    while True :
+
+        before = len(data)
+
+        data = data[data.groupby(fe2)[fe2].transform('size') >= threshold]
+        data = data[data.groupby(fe1)[fe1].transform('size') >= threshold]
+
+        if len(data) == before :
+            return data
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def group_means(values, codes, counts) :
+
+    """
+    Helper function for demean_two_way
+
+    Return a (groups x columns) array with the mean of each column in each group
+    """
+
+    sums = np.column_stack([np.bincount(codes, weights = values[:, j], minlength = len(counts))
+                            for j in range(values.shape[1])])
+
+    return sums / counts[:, np.newaxis]
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def connected_components(codes1, codes2, n_groups1, n_groups2) :
+
+    """
+    Helper function for demean_two_way
+
+    Return the number of connected components of the bipartite graph, where each observation connects
+    its fe1 group with its fe2 group
+    """
+
+    parent = list(range(n_groups1 + n_groups2))
+
+    def find(node) :
+        while parent[node] != node :
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    edges = np.unique(np.column_stack([codes1, codes2 + n_groups1]), axis = 0)
+
+    for a, b in edges :
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b :
+            parent[root_a] = root_b
+
+    return len({find(node) for node in range(len(parent))})
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,5 @@
+from .load_datasets import load_datasets, load_dataset, clear_cache
+from .fixed_effects import demean_two_way, filter_sparse_groups
+from .feature_store import FeatureStore, save_features, load_features
+from .cube import MeasureCube, load_cube
+from .bootstrap import cluster_bootstrap, bootstrap_intervals
@@ -0,0 +1,202 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def load_datasets(datasets, workers = 8) :
+
+    """
+    Return a dictionary with the decoded dataframes of the declared input datasets.
+
+    The datasets are read concurrently on a thread pool, and the decoded dataframes are cached in the process,
+    so later sections of the preprocessing that read the same dataset with the same projection get it from
+    memory instead of from disk.
+
+    Parameters
+    ----------
+    datasets : dict
+
+               Maps the name of each dataset to its declaration, which is either:
+               * a path to a .pkl or .csv file.
+               * a dict with the keys:
+                 - path        : Path to a .pkl or .csv file.
+                 - function    : A function without arguments returning a dataframe (used instead of path,
+                                 e.g. cns.get_temporal_context_frame).
+                 - reset_index : If True, the index of the dataframe is moved into the columns after loading.
+                 - columns     : The columns to keep. For .csv files, only these columns are parsed.
+                 - rename      : A dict used to rename the columns after the projection.
+
+    workers  : int
+
+               Number of threads used to read the datasets.
+
+    Output
+    ------
+    A dict with the same keys as datasets and a pandas.DataFrame for each key. The dataframes are copies
+    of the cached frames, so they can be changed freely by the caller.
+    """
+
+    specs = {name : dataset_spec(decl) for name, decl in datasets.items()}
+
+    unique_keys = list(dict.fromkeys(cache_key(spec) for spec in specs.values()))
+    spec_of_key = {cache_key(spec) : spec for spec in specs.values()}
+
+    with ThreadPoolExecutor(max_workers = max(1, min(workers, len(unique_keys)))) as pool :
+        frames = dict(zip(unique_keys, pool.map(lambda key : cached_frame(key, spec_of_key[key]), unique_keys)))
+
+    return {name : frames[cache_key(spec)].copy() for name, spec in specs.items()}
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def load_dataset(path = None, columns = None, reset_index = False, rename = None, function = None) :
+
+    """
+    Return a single dataset with the same declaration and caching as load_datasets
+    """
+
+    decl = {'path': path, 'function': function, 'columns': columns, 'reset_index': reset_index, 'rename': rename}
+
+    return load_datasets({'dataset': decl}, workers = 1)['dataset']
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def clear_cache() :
+
+    """
+    Remove all the cached dataframes from memory
+    """
+
+    with _cache_lock :
+        _cache.clear()
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def dataset_spec(decl) :
+
+    """
+    Helper function for load_datasets
+
+    Return the declaration of a dataset as a dict with all the keys filled out
+    """
+
+    if not isinstance(decl, dict) :
+        decl = {'path': decl}
+
+    spec = {'path': None, 'function': None, 'columns': None, 'reset_index': False, 'rename': None}
+    spec.update(decl)
+
+    if (spec['path'] is None) == (spec['function'] is None) :
+        raise ValueError('A dataset must be declared with exactly one of path and function')
+
+    return spec
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def cache_key(spec) :
+
+    """
+    Helper function for load_datasets
+
+    Return a hashable key identifying the decoded and projected dataframe of a dataset declaration.
+    The modification time of a file is part of the key, so a file that is rewritten is read again.
+    """
+
+    if spec['path'] is not None :
+        path = os.path.abspath(spec['path'])
+        source = (path, os.path.getmtime(path))
+    else :
+        source = (spec['function'].__module__, spec['function'].__qualname__)
+
+    columns = None if spec['columns'] is None else tuple(spec['columns'])
+    rename = None if spec['rename'] is None else tuple(sorted(spec['rename'].items()))
+
+    return (source, columns, bool(spec['reset_index']), rename)
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def cached_frame(key, spec) :
+
+    """
+    Helper function for load_datasets
+
+    Return the dataframe for the given key from the cache, and read it from its source first if it is not cached
+    """
+
+    with _cache_lock :
+        if key in _cache :
+            return _cache[key]
+
+    frame = read_frame(spec)
+
+    with _cache_lock :
+        return _cache.setdefault(key, frame)
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
+def read_frame(spec) :
+
+    """
+    Helper function for cached_frame
+
+    Read the dataset from its source and apply the index reset, the column projection and the renaming
+    """
+
+    columns = spec['columns']
+
+    if spec['function'] is not None :
+        frame = spec['function']()
+
+    elif spec['path'].endswith('.csv') and not spec['reset_index'] :
+        frame = pd.read_csv(spec['path'], usecols = columns)
+
+    elif spec['path'].endswith('.csv') :
+        frame = pd.read_csv(spec['path'])
+
+    else :
+        frame = pd.read_pickle(spec['path'])
+
+    if spec['reset_index'] :
+        frame = frame.reset_index()
+
+    if columns is not None :
+        frame = frame.loc[:, list(columns)]
+
+    if spec['rename'] is not None :
+        frame = frame.rename(columns = spec['rename'])
+
+    return frame
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
@@ -14,10 +14,18 @@ os.chdir(projpath)
 # In[4]:
 
 
+import json
 import pandas as pd
 import numpy as np
 from datetime import datetime as dt
 import cns
+from screen_behaviour.partition import UserPartition
+from screen_behaviour.coverage import coverage_report, eligible_users
+from analysis_data.load_datasets import load_datasets
+from analysis_data.fixed_effects import demean_two_way, filter_sparse_groups
+from analysis_data.feature_store import FeatureStore, save_features, load_features
+from analysis_data.cube import MeasureCube
+from analysis_data.bootstrap import cluster_bootstrap, bootstrap_intervals
 
 
 # ## Global parameters
@@ -86,14 +94,32 @@ invalidation_stamps = invalidation_stamps.rename(columns = {'timestamp_5m': 'tim
 invalidation_stamps = invalidation_stamps[['timestamp', 'user_idx']]
 
 
+# Count the valid and invalidated timebins, heartbeat gaps, twins and dropped sessions of each user per day. The counts only need the heartbeat gaps, so they are cheap compared to the screen behaviour dataset:
+
+# In[17]:
+
+
+coverage = coverage_report(screen, invalidation_stamps, timebin_len, 3*timebin_len)
+
+
+# The analysis needs at least 40 in-class measurements of a user in a course, so users with fewer than 40 valid timebins in total can never be used. They are dropped before the screen behaviour dataset is built:
+
+# In[18]:
+
+
+eligible = eligible_users(coverage, 40)
+screen = screen[screen['user_idx'].isin(eligible)]
+invalidation_stamps = invalidation_stamps[invalidation_stamps['user_idx'].isin(eligible)]
+
+
 # Build the screen behaviour dataset with the help of the screen_behaviour function. Note that the screen_behaviour function is quite time consuming (it has to run over night). If you want to speed it up, this block of code is very easy to parallelize with ipyparallel. Path to screen_behaviour function: cns/preproc/screen/screen_behaviour.py.
 
 # In[19]:
 
 
-by_user_screen = [u_df for u,u_df in screen.groupby('user_idx')]
-by_user_invalidation = [u_df for u,u_df in invalidation_stamps.groupby('user_idx')]
-parsed = [cns.screen_behaviour(screen, invalidation, timebin_len, 3*timebin_length, only_screen_behav = False) for (screen, invalidation) in zip(by_user_screen, by_user_invalidation)]
+partition = UserPartition({'screen': screen, 'invalidation': invalidation_stamps})
+missing_users = partition.missing_users()
+parsed = [cns.screen_behaviour(u_screen, u_invalidation, timebin_len, 3*timebin_length, only_screen_behav = False) for (u, u_screen, u_invalidation) in partition.groups(missing = 'skip')]
 
 
 # In[20]:
@@ -102,11 +128,9 @@ parsed = [cns.screen_behaviour(screen, invalidation, timebin_len, 3*timebin_leng
 invalid_binss = [p[0] for p in parsed]
 screen_diffs = [p[1] for p in parsed]
 screen_behavs = [p[2] for p in parsed]
-n_invs = [p[3] for p in parsed]
 invalid_bins = pd.concat(invalid_binss, ignore_index = True)
 screen_sessions = pd.concat(screen_diffs, ignore_index = True)
 screen_behav = pd.concat(screen_behavs, ignore_index = True)
-n_inv = pd.concat(n_invs, ignore_index = True)
 
 
 # Save the output datasets:
@@ -117,7 +141,8 @@ n_inv = pd.concat(n_invs, ignore_index = True)
 screen_behav.to_pickle('personal/asger/preprocessed_data/screen_behaviour_1m.pkl')
 screen_sessions.to_pickle('personal/asger/preprocessed_data/screen_sessions_1m.pkl')
 invalid_bins.to_pickle('personal/asger/preprocessed_data/invalid_bins_1m.pkl')
-n_inv.to_pickle('personal/asger/preprocessed_data/invalidation_counts_1m.pkl')
+coverage.to_pickle('personal/asger/preprocessed_data/invalidation_counts_1m.pkl')
+missing_users.to_pickle('personal/asger/preprocessed_data/missing_users_1m.pkl')
 
 
 # ## Build screen behaviour in class dataset
@@ -262,6 +287,16 @@ counts = screen_behav_inclass[['timebin','user_idx','course_num_sem']]         .
 attention = attention.merge(counts, on = ['user_idx','course_num_sem'], how = 'left')
 
 
+# Bootstrap confidence intervals of the attention measure, resampling the timebins within each user-course:
+
+# In[21]:
+
+
+attention_boot, attention_replicates = cluster_bootstrap(screen_behav_inclass, 'screentime', ['user_idx','course_num_sem'], n_replicates = 1000, workers = 8, normal_threshold = 500)
+attention_boot = bootstrap_intervals(attention_boot, attention_replicates)
+attention_boot.to_pickle('personal/asger/preprocessed_data/attention_bootstrap.pkl')
+
+
 # Filter out observation from the unrelevant semesters and prepare the grades data to be merge:
 
 # In[22]:
@@ -378,17 +413,39 @@ attention_w_num_grades.to_pickle('personal/asger/preprocessed_data/course_attent
 # In[67]:
 
 
-screen_behav = pd.read_pickle('personal/asger/preprocessed_data/screen_behaviour_notinclass.pkl')
-grades_primary = pd.read_pickle('data/struct/features/grades_primary.pkl')
-grades_highschool = pd.read_pickle('data/struct/features/grades_hs.pkl')
-parent_edu = pd.read_pickle('data/struct/features/parent_edu.pkl')
-parent_inc = pd.read_pickle('data/struct/features/parent_inc.pkl')
-dem = pd.read_pickle('data/struct/features/demographics.pkl')
-survey = pd.read_pickle('data/struct/features/survey.pkl')
-organization_dtu = pd.read_pickle('data/preproc/dtu/organization.pkl')
-user_map = pd.read_pickle('data/preproc/users/all_users.pkl').loc[:,['user_idx','user']]
+screen_behav_notinclass_decl = {'path': 'personal/asger/preprocessed_data/screen_behaviour_notinclass.pkl',
+                                 'columns': ['user_idx', 'timebin', 'screentime', 'screencount']}
+temp_context_decl = {'function': cns.get_temporal_context_frame, 'columns': ['hourbin', 'hour', 'semester']}
+
+
+# In[68]:
+
+
+inputs = load_datasets({'screen_behav': screen_behav_notinclass_decl,
+                        'grades_primary': {'path': 'data/struct/features/grades_primary.pkl', 'reset_index': True,
+                                           'columns': ['user_idx', 'elem_matematik_exam', 'elem_gpa']},
+                        'grades_highschool': {'path': 'data/struct/features/grades_hs.pkl', 'reset_index': True,
+                                              'columns': ['user_idx', 'hs_matematik', 'hs_gpa']},
+                        'parent_edu': {'path': 'data/struct/features/parent_edu.pkl', 'reset_index': True,
+                                       'columns': ['user_idx', 'edu_max']},
+                        'parent_inc': {'path': 'data/struct/features/parent_inc.pkl', 'reset_index': True,
+                                       'columns': ['user_idx', 'inc_max', 'inc_mean']},
+                        'dem': {'path': 'data/struct/features/demographics.pkl', 'reset_index': True},
+                        'survey': 'data/struct/features/survey.pkl',
+                        'organization_dtu': {'path': 'data/preproc/dtu/organization.pkl', 'columns': ['user', 'study']},
+                        'user_map': {'path': 'data/preproc/users/all_users.pkl', 'columns': ['user_idx', 'user']},
+                        'temp_context': temp_context_decl})
+screen_behav = inputs['screen_behav']
+grades_primary = inputs['grades_primary']
+grades_highschool = inputs['grades_highschool']
+parent_edu = inputs['parent_edu']
+parent_inc = inputs['parent_inc']
+dem = inputs['dem']
+survey = inputs['survey']
+organization_dtu = inputs['organization_dtu']
+user_map = inputs['user_map']
 organization_dtu = organization_dtu.merge(user_map, on='user', how='inner')
-temp_context = cns.get_temporal_context_frame()[['hourbin','hour','semester']]
+temp_context = inputs['temp_context']
 
 
 # Calculate the average screen behaviour out of class during daytime:
@@ -424,53 +481,40 @@ avr_screen_behav = screen_behav.groupby('user_idx', as_index = False).mean()
 # In[10]:
 
 
-grades_primary = grades_primary.reset_index()
-grades_highschool = grades_highschool.reset_index()
-parent_edu = parent_edu.reset_index()
-parent_inc = parent_inc.reset_index()
-dem = dem.reset_index()
-
+# The index of grades_primary, grades_highschool, parent_edu, parent_inc and dem has already been reset by load_datasets.
 
 # In[11]:
 
 
 avr_screen_behav = avr_screen_behav[['user_idx','screentime','screencount']]
 avr_screen_behav = avr_screen_behav.rename(columns = {'screentime' : 'screentime_outofclass', 'screencount' : 'screencount_outofclass'})
-psychology = survey[['1_bfi_agreeableness', '1_bfi_conscientiousness', '1_bfi_extraversion', '1_bfi_neuroticism', '1_bfi_openness', '1_locus_of_control','1_ambition','1_self_efficacy']].copy()
-psychology['user_idx'] = psychology.index
-psychology = psychology.rename(columns={'1_bfi_agreeableness':'agreeableness', '1_bfi_conscientiousness':'conscientiousness', '1_bfi_extraversion':'extraversion', '1_bfi_neuroticism':'neuroticism', '1_bfi_openness':'openness', '1_locus_of_control':'locus_of_control', '1_ambition': 'ambition', '1_self_efficacy':'self_efficacy'})
-health = survey[['1_bmi', '1_physical_activity', '1_smoke_freq']].copy()
-health = health.rename(columns={'1_bmi':'bmi','1_physical_activity':'physichal_activity', '1_smoke_freq': 'smoke_freq'})
-health['user_idx'] = health.index
-chosen_grades_highschool = grades_highschool[['user_idx','hs_matematik','hs_gpa']]
-chosen_grades_highschool = chosen_grades_highschool.rename(columns={'hs_matematik': 'hs_math'})
-chosen_grades_primary = grades_primary[['user_idx', 'elem_matematik_exam','elem_gpa']]
-chosen_grades_primary = chosen_grades_primary.rename(columns = {'elem_matematik_exam': 'elem_math'})
-parent_edu_max = parent_edu[['user_idx', 'edu_max']]
-parent_edu_max = parent_edu_max.rename(columns = {'edu_max':'parent_edu_max'})
-parent_inc_mean_max = parent_inc[['user_idx', 'inc_max', 'inc_mean']]
-parent_inc_mean_max = parent_inc_mean_max.rename(columns = {'inc_max':'parent_inc_max', 'inc_mean': 'parent_inc_mean'})
-dem = dem.drop('immig_desc', axis=1)
-organization_dtu = organization_dtu[['user_idx', 'study']]
+psychology_columns = {'1_bfi_agreeableness':'agreeableness', '1_bfi_conscientiousness':'conscientiousness', '1_bfi_extraversion':'extraversion', '1_bfi_neuroticism':'neuroticism', '1_bfi_openness':'openness', '1_locus_of_control':'locus_of_control', '1_ambition': 'ambition', '1_self_efficacy':'self_efficacy'}
+health_columns = {'1_bmi':'bmi','1_physical_activity':'physichal_activity', '1_smoke_freq': 'smoke_freq'}
+
 
+# Align all the variables on the sorted user_idx of the screen behaviour in one pass instead of a chain of merges:
 
 # In[12]:
 
 
-merged = avr_screen_behav.merge(chosen_grades_primary, on = 'user_idx', how = 'left')
-merged = merged.merge(chosen_grades_highschool, on = 'user_idx', how = 'left')
-merged = merged.merge(parent_edu_max, on = 'user_idx', how = 'left')
-merged = merged.merge(parent_inc_mean_max, on = 'user_idx', how = 'left')
-merged = merged.merge(dem, on = 'user_idx', how = 'left')
-merged = merged.merge(psychology, on='user_idx',how='left')
-merged = merged.merge(health, on='user_idx',how='left')
-merged = merged.merge(organization_dtu, on='user_idx',how='left')
+controls = FeatureStore('user_idx')
+controls.register('screen_behav', avr_screen_behav)
+controls.register('grades_primary', grades_primary, columns = ['elem_matematik_exam','elem_gpa'], rename = {'elem_matematik_exam': 'elem_math'})
+controls.register('grades_highschool', grades_highschool, columns = ['hs_matematik','hs_gpa'], rename = {'hs_matematik': 'hs_math'})
+controls.register('parent_edu', parent_edu, columns = ['edu_max'], rename = {'edu_max':'parent_edu_max'})
+controls.register('parent_inc', parent_inc, columns = ['inc_max', 'inc_mean'], rename = {'inc_max':'parent_inc_max', 'inc_mean': 'parent_inc_mean'})
+controls.register('demographics', dem, columns = [c for c in dem.columns if c not in ('user_idx', 'immig_desc')])
+controls.register('psychology', survey, columns = list(psychology_columns), rename = psychology_columns, key_from_index = True)
+controls.register('health', survey, columns = list(health_columns), rename = health_columns, key_from_index = True)
+controls.register('organization', organization_dtu, columns = ['study'])
+merged = controls.assemble('screen_behav')
 
 
 # In[79]:
 
 
 merged.to_pickle('personal/asger/preprocessed_data/user_level_control_vars.pkl')
+save_features(merged, 'personal/asger/preprocessed_data/user_level_control_vars.npz')
 
 
 # ## Build user-course level control variables
@@ -480,10 +524,14 @@ merged.to_pickle('personal/asger/preprocessed_data/user_level_control_vars.pkl')
 # In[35]:
 
 
-screen_behav_ooc = pd.read_pickle('personal/asger/preprocessed_data/screen_behaviour_notinclass.pkl')
-screen_behav_inclass = pd.read_pickle('personal/asger/preprocessed_data/screen_behaviour_inclass.pkl')
-attend = pd.read_pickle('data/preproc/behavior/attendance_geofence.pkl')
-temp_map = cns.get_temporal_context_frame()[['hourbin', 'hour', 'semester']]
+inputs = load_datasets({'screen_behav_ooc': 'personal/asger/preprocessed_data/screen_behaviour_notinclass.pkl',
+                        'screen_behav_inclass': 'personal/asger/preprocessed_data/screen_behaviour_inclass.pkl',
+                        'attend': 'data/preproc/behavior/attendance_geofence.pkl',
+                        'temp_map': temp_context_decl})
+screen_behav_ooc = inputs['screen_behav_ooc']
+screen_behav_inclass = inputs['screen_behav_inclass']
+attend = inputs['attend']
+temp_map = inputs['temp_map']
 
 
 # In[36]:
@@ -502,30 +550,33 @@ def is_day(row) :
 temp_map['day'] = temp_map.apply(is_day, axis = 1)
 screen_behav_ooc['hourbin'] = screen_behav_ooc['timebin'] // 3600 * 3600
 screen_behav_ooc = screen_behav_ooc.merge(temp_map, on = 'hourbin')
-screen_behav_ooc = screen_behav_ooc.loc[screen_behav_ooc.day, :]
-screen_behav_ooc = screen_behav_ooc.drop(['timebin','hourbin','hour','day'], axis = 1)
+screen_behav_ooc = screen_behav_ooc.rename(columns = {'day': 'daytime'})
 
 
 # In[38]:
 
 
-temp_map['day'] = temp_map.apply(is_day, axis = 1)
 screen_behav_inclass['hourbin'] = screen_behav_inclass['timebin'] // 3600 * 3600
 screen_behav_inclass = screen_behav_inclass.merge(temp_map.drop('semester',axis=1), on = 'hourbin')
-screen_behav_inclass = screen_behav_inclass.loc[screen_behav_inclass.day, :]
-screen_behav_inclass = screen_behav_inclass.drop(['timebin','hourbin','hour','day'], axis = 1)
+screen_behav_inclass = screen_behav_inclass.rename(columns = {'day': 'daytime'})
+
 
+# Aggregate the panel in a cube by user, semester, in class, daytime, course and hour of the week. The averages at other levels are computed from the cube instead of the panel:
 
 # In[39]:
 
 
-avr_screen_behav_ooc_semester = screen_behav_ooc.groupby(['user_idx','semester'], as_index = False).mean()
+cube = MeasureCube()
+cube.add(screen_behav_ooc, inclass = False, course_num_sem = np.nan)
+cube.add(screen_behav_inclass, inclass = True)
+cube.save('personal/asger/preprocessed_data/screen_behaviour_cube.pkl')
 
 
 # In[40]:
 
 
-avr_screen_behav_inclass_semester = screen_behav_inclass.groupby(['user_idx','semester'], as_index = False).mean()
+avr_screen_behav_ooc_semester = cube.query(['user_idx','semester'], where = {'inclass': False, 'daytime': True})
+avr_screen_behav_inclass_semester = cube.query(['user_idx','semester'], where = {'inclass': True, 'daytime': True})
 
 
 # Calculate how much of the time each user attended scheduled classtime for the courses, he/she was signed up for:
@@ -599,7 +650,7 @@ usercoursectrls.to_pickle('personal/asger/preprocessed_data/user_course_level_co
 
 
 course_att_perf = pd.read_pickle('personal/asger/preprocessed_data/course_attention_performance.pkl')
-user_cont_vars = pd.read_pickle('personal/asger/preprocessed_data/user_level_control_vars.pkl')
+user_cont_vars = load_features('personal/asger/preprocessed_data/user_level_control_vars.npz')
 user_course_cont_vars = pd.read_pickle('personal/asger/preprocessed_data/user_course_level_control_vars.pkl')
 
 
@@ -642,3 +693,36 @@ x = analysis_filt2[['user_idx','semester','course_num_sem', 'screentime_short_se
 
 x.to_pickle('personal/asger/preprocessed_data/screen_attendance_course_specific.pkl')
 
+
+# ## Build fixed effects demeaned analysis dataset
+
+# Prepare the panel sample of the fixed effects models in analysis.R (grade ~ screentime + skipping + user_idx + course_num_sem):
+
+# In[37]:
+
+
+panel = analysis_filt2.loc[analysis_filt2.grade.isin(['-3','0','2','4','7','10','12']) & ~analysis_filt2.attendance.isna()].copy()
+panel = panel.dropna(subset = ['hs_gpa', 'parent_edu_max', 'parent_inc_mean'])
+panel['grade'] = panel['grade'].astype(int)
+panel['skipping'] = (100 - panel['attendance']) / 100
+panel['screentime'] = panel['screentime'] / 100
+panel['n_courses_sem'] = panel.groupby(['user_idx', 'semester'])['course_num_sem'].transform('size')
+panel = panel[panel.n_courses_sem > 1]
+panel = filter_sparse_groups(panel, 2, 'user_idx', 'course_num_sem')
+
+
+# Demean the response and the regressors on both fixed effects. The models can then be fitted as small dense regressions without an intercept, with the residual degrees of freedom n_obs - df_fe - (number of regressors):
+
+# In[38]:
+
+
+panel_demeaned, panel_demeaned_meta = demean_two_way(panel, ['grade', 'screentime', 'skipping'], 'user_idx', 'course_num_sem')
+panel_demeaned_meta['df_resid'] = panel_demeaned_meta['n_obs'] - panel_demeaned_meta['df_fe'] - 2
+
+
+# In[39]:
+
+
+panel_demeaned.to_csv('personal/asger/preprocessed_data/analysis_demeaned.csv', index=False)
+with open('personal/asger/preprocessed_data/analysis_demeaned_meta.json', 'w') as f :
+    json.dump(panel_demeaned_meta, f, indent = 2)
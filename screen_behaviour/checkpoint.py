@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import pandas as pd
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def open_checkpoint(checkpoint_dir, params, resume) :
+
+    """
+    Return the manifest of a checkpoint directory for a panel build with the given parameters.
+
+    The manifest is a dict with the parameter fingerprint of the build and the list of completed users.
+    When resume is True, the completed users of an earlier build with the same parameters are kept.
+    An earlier build with other parameters raises a ValueError, since its shards cannot be reused.
+    When resume is False, the checkpoint starts over without any completed users.
+    """
+
+    os.makedirs(checkpoint_dir, exist_ok = True)
+
+    fingerprint = params_fingerprint(params)
+    path = manifest_path(checkpoint_dir)
+
+    if resume and os.path.exists(path) :
+
+        with open(path) as f :
+            manifest = json.load(f)
+
+        if manifest['fingerprint'] != fingerprint :
+            raise ValueError('The checkpoint in {} was built with other parameters: {}'
+                             .format(checkpoint_dir, manifest['params']))
+
+        #Only trust users whose shard is still on disk
+        manifest['completed'] = [u for u in manifest['completed']
+                                 if os.path.exists(shard_path(checkpoint_dir, u))]
+
+    else :
+
+        manifest = {'fingerprint': fingerprint, 'params': params, 'completed': []}
+
+    write_manifest(checkpoint_dir, manifest)
+
+    return manifest
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def record_completed(checkpoint_dir, manifest, users) :
+
+    """
+    Add users, whose shards have been written, to the completed users of the manifest and save it atomically
+    """
+
+    manifest['completed'].extend(to_json_value(u) for u in users)
+
+    write_manifest(checkpoint_dir, manifest)
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def write_shard(checkpoint_dir, user_idx, frame, suffix = '.pkl') :
+
+    """
+    Save the result of one user atomically: it is written to a temporary file, flushed to disk and then
+    renamed, so a crash never leaves a half-written shard behind
+    """
+
+    path = shard_path(checkpoint_dir, user_idx, suffix)
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'wb') as f :
+        pd.to_pickle(frame, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def read_shard(checkpoint_dir, user_idx, suffix = '.pkl') :
+
+    """
+    Read the saved result of one user
+    """
+
+    return pd.read_pickle(shard_path(checkpoint_dir, user_idx, suffix))
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def concat_shards(checkpoint_dir, users, output = None) :
+
+    """
+    Concatenate the shards of the given users in the given order. checkpoint_dir may also be a dict with the
+    checkpoint directory of each user (e.g. when the users were built in different shards).
+
+    If output is None, the concatenated dataframe is returned. If output is a .csv file, the shards are
+    appended to it one at a time, so only one shard is in memory at a time. Other outputs are pickled.
+    """
+
+    if isinstance(checkpoint_dir, dict) :
+        shards = (read_shard(checkpoint_dir[u], u) for u in users)
+    else :
+        shards = (read_shard(checkpoint_dir, u) for u in users)
+
+    if output is None :
+        return concat_frames(shards)
+
+    if output.endswith('.csv') :
+        tmp_path = output + '.tmp'
+        header = True
+        with open(tmp_path, 'w', newline = '') as f :
+            for shard in shards :
+                shard.to_csv(f, header = header, index = False)
+                header = False
+        os.replace(tmp_path, output)
+
+    else :
+        concat_frames(shards).to_pickle(output)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def params_fingerprint(params) :
+
+    """
+    Helper function for open_checkpoint
+
+    Return a hash of the parameters of a build
+    """
+
+    return hashlib.sha1(json.dumps(params, sort_keys = True, default = str).encode()).hexdigest()
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def write_manifest(checkpoint_dir, manifest) :
+
+    """
+    Helper function for open_checkpoint and record_completed
+
+    Save the manifest atomically
+    """
+
+    path = manifest_path(checkpoint_dir)
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'w') as f :
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def manifest_path(checkpoint_dir) :
+
+    """
+    Helper function for the checkpoint functions
+
+    Return the path of the manifest of a checkpoint directory
+    """
+
+    return os.path.join(checkpoint_dir, 'manifest.json')
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def shard_path(checkpoint_dir, user_idx, suffix = '.pkl') :
+
+    """
+    Helper function for the checkpoint functions
+
+    Return the path of the shard of a user
+    """
+
+    return os.path.join(checkpoint_dir, 'user-{}{}'.format(user_idx, suffix))
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def concat_frames(frames) :
+
+    """
+    Helper function for concat_shards
+
+    Concatenate an iterable of dataframes, and return an empty dataframe if there are none
+    """
+
+    frames = list(frames)
+
+    if len(frames) == 0 :
+        return pd.DataFrame()
+
+    return pd.concat(frames, ignore_index = True)
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def to_json_value(user_idx) :
+
+    """
+    Helper function for record_completed
+
+    Return a user id as a plain python value, which can be saved in the json manifest
+    """
+
+    return user_idx.item() if hasattr(user_idx, 'item') else user_idx
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
@@ -0,0 +1,342 @@
+import argparse
+import shutil
+
+from .panel import build_panel, read_frame, write_frame
+from .shared_memory import build_panel_shared
+from .session_sketch import SessionSketches
+from .event_log import write_event_log, EventLog
+from .sharding import plan_shards, run_shard, merge_shards
+from .heartbeat_bitmap import build_heartbeat_bitmap, load_heartbeat_bitmap
+from .scheduler import load_cost_model
+from .output_sink import appendable
+from .screen_measures import session_classes
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def main(argv = None) :
+
+    """
+    Command line entry point for building the screen behaviour panel.
+
+    Run it with: python -m screen_behaviour --screen screen.csv --invalidation sensor_time.pkl --output out.pkl
+    """
+
+    args = parse_args(argv)
+
+    if args.merge_shards :
+        merge_shards(args.shard_dir, args.output)
+        return
+
+    #Only the panel build reads the event log one user at a time, the other steps need the whole dataframes
+    frames = (args.write_event_log is not None or args.write_heartbeat_bitmap is not None or args.shared_memory
+              or args.plan_shards is not None or args.shard is not None)
+
+    screen, invalidation_stamps = read_inputs(args, frames)
+
+    if args.write_event_log is not None :
+        write_event_log(screen, invalidation_stamps, args.write_event_log)
+        return
+
+    if args.write_heartbeat_bitmap is not None :
+        build_heartbeat_bitmap(invalidation_stamps).save(args.write_heartbeat_bitmap)
+        return
+
+    if args.plan_shards is not None :
+        plan_shards(screen,
+                    invalidation_stamps,
+                    args.plan_shards,
+                    args.shard_dir,
+                    timebin_len = args.timebin_len,
+                    invalidate_cut = args.invalidate_cut,
+                    short_ses_len = args.short_ses_len,
+                    max_screen_ses = args.max_screen_ses,
+                    session_cuts = args.session_cuts)
+        return
+
+    cost_model = None if args.cost_model is None else load_cost_model(args.cost_model)
+    memory_budget = None if args.memory_budget is None else args.memory_budget * 2 ** 20
+
+    if args.shard is not None :
+        run_shard(screen,
+                  invalidation_stamps,
+                  args.shard_dir,
+                  args.shard[0],
+                  n_shards = args.shard[1],
+                  workers = args.workers,
+                  chunk_size = args.chunk_size,
+                  progress = not args.quiet,
+                  max_user_events = args.max_user_events,
+                  memory_budget = memory_budget,
+                  cost_model = cost_model)
+        if cost_model is not None :
+            cost_model.save(args.cost_model)
+        return
+
+    session_sketches = None
+    if args.session_sketches is not None :
+        semesters = None if args.semesters is None else read_frame(args.semesters)
+        session_sketches = SessionSketches(semesters, max_length = args.max_screen_ses)
+
+    if args.shared_memory :
+        screen_behav = build_panel_shared(screen,
+                                          invalidation_stamps,
+                                          timebin_len = args.timebin_len,
+                                          invalidate_cut = args.invalidate_cut,
+                                          short_ses_len = args.short_ses_len,
+                                          max_screen_ses = args.max_screen_ses,
+                                          workers = args.workers,
+                                          chunk_size = args.chunk_size,
+                                          progress = not args.quiet,
+                                          session_cuts = args.session_cuts)
+        write_frame(screen_behav, args.output)
+        return
+
+    checkpoint_dir = args.checkpoint_dir if args.checkpoint_dir is not None else args.output + '.checkpoint'
+
+    build_panel(screen,
+                invalidation_stamps,
+                timebin_len = args.timebin_len,
+                invalidate_cut = args.invalidate_cut,
+                short_ses_len = args.short_ses_len,
+                max_screen_ses = args.max_screen_ses,
+                workers = args.workers,
+                chunk_size = args.chunk_size,
+                checkpoint_dir = checkpoint_dir,
+                resume = args.resume,
+                output = args.output,
+                session_sketches = session_sketches,
+                progress = not args.quiet,
+                max_user_events = args.max_user_events,
+                session_cuts = args.session_cuts,
+                output_queue_size = args.output_queue_size,
+                memory_budget = memory_budget,
+                cost_model = cost_model)
+
+    if cost_model is not None :
+        cost_model.save(args.cost_model)
+
+    if session_sketches is not None :
+        write_frame(session_sketches.summary(), args.session_sketches)
+
+    #The default checkpoint is only kept for resuming an interrupted build
+    if args.checkpoint_dir is None and not args.resume :
+        shutil.rmtree(checkpoint_dir)
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def read_inputs(args, frames = True) :
+
+    """
+    Helper function for main
+
+    Return the screen and invalidation_stamps dataframes from an event log or from the input files. If frames is
+    False, an event log is returned as the EventLog (and None or the heartbeat bitmap) for build_panel, which
+    decodes it one user at a time.
+    """
+
+    if args.event_log is not None :
+        log = EventLog(args.event_log)
+        if frames :
+            screen, invalidation_stamps = log.frames()
+        else :
+            screen, invalidation_stamps = log, None
+        if args.heartbeat_bitmap is not None :
+            invalidation_stamps = load_heartbeat_bitmap(args.heartbeat_bitmap)
+        return screen, invalidation_stamps
+
+    screen = read_frame(args.screen)
+
+    if args.heartbeat_bitmap is not None :
+        invalidation_stamps = load_heartbeat_bitmap(args.heartbeat_bitmap)
+    else :
+        invalidation_stamps = read_frame(args.invalidation)
+
+    if args.user_map is not None :
+        user_map = read_frame(args.user_map).loc[:, ['user_idx', 'user']]
+        screen = screen.merge(user_map, how = 'left').drop('user', axis = 1)
+
+    if args.heartbeat_bitmap is not None :
+        return screen, invalidation_stamps
+
+    invalidation_stamps = invalidation_stamps.rename(columns = {args.invalidation_column: 'timestamp'})
+    invalidation_stamps = invalidation_stamps[['timestamp', 'user_idx']]
+
+    return screen, invalidation_stamps
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def parse_args(argv) :
+
+    """
+    Helper function for main
+
+    Parse the command line arguments
+    """
+
+    parser = argparse.ArgumentParser(prog = 'python -m screen_behaviour',
+                      description = 'Build the screen behaviour panel for all users.')
+
+    parser.add_argument('--screen', default = None,
+                        help = 'Screen events (.csv or .pkl) with user_idx (or user), timestamp and screen_on.')
+    parser.add_argument('--invalidation', default = None,
+                        help = 'Heartbeat stamps (.csv or .pkl) with user_idx and a timestamp column.')
+    parser.add_argument('--event-log', default = None,
+                        help = 'Binary event log with the screen events and heartbeat stamps '
+                               'instead of --screen and --invalidation.')
+    parser.add_argument('--output', default = None,
+                        help = 'Output file (.csv or .pkl).')
+    parser.add_argument('--write-event-log', default = None,
+                        help = 'Convert --screen and --invalidation to a binary event log instead of building the panel.')
+    parser.add_argument('--heartbeat-bitmap', default = None,
+                        help = 'Heartbeat bitmap written with --write-heartbeat-bitmap instead of the heartbeat stamps.')
+    parser.add_argument('--write-heartbeat-bitmap', default = None,
+                        help = 'Convert the heartbeat stamps (on a 5 minute grid) to a heartbeat bitmap '
+                               'instead of building the panel.')
+    parser.add_argument('--user-map', default = None,
+                        help = 'Optional map (.csv or .pkl) from user to user_idx for the screen events.')
+    parser.add_argument('--invalidation-column', default = 'timestamp',
+                        help = 'Name of the timestamp column of the heartbeat stamps, e.g. timestamp_5m.')
+
+    parser.add_argument('--timebin-len', type = int, default = 900)
+    parser.add_argument('--invalidate-cut', type = int, default = 1800)
+    parser.add_argument('--short-ses-len', type = int, default = 35)
+    parser.add_argument('--max-screen-ses', type = int, default = 7200)
+    parser.add_argument('--session-cuts', type = cut_points, default = None,
+                        help = 'Comma separated cut points of session length classes, e.g. 10,35,300,1800. '
+                               'Replaces the short and long session measures.')
+
+    parser.add_argument('--workers', type = int, default = 1,
+                        help = 'Number of worker processes.')
+    parser.add_argument('--chunk-size', type = int, default = 1,
+                        help = 'Number of users sent to a worker at a time.')
+    parser.add_argument('--checkpoint-dir', default = None,
+                        help = 'Directory for the per-user shards and the manifest, which is kept after the build. '
+                               'Defaults to OUTPUT.checkpoint, which is removed after a successful build '
+                               'unless --resume is given.')
+    parser.add_argument('--resume', action = 'store_true',
+                        help = 'Skip the users completed by an earlier run with the same parameters.')
+    parser.add_argument('--output-queue-size', type = int, default = 16,
+                        help = 'Maximum number of finished users waiting to be written to the output.')
+    parser.add_argument('--max-user-events', type = int, default = None,
+                        help = 'Split users with more screen events than this into time windows processed in parallel.')
+
+    parser.add_argument('--memory-budget', type = float, default = None,
+                        help = 'Budget in MB for the estimated peak memory of the users built at the same time. '
+                               'Needs a .csv --output.')
+    parser.add_argument('--cost-model', default = None,
+                        help = 'JSON file with the model of the runtime and memory of the users. It is created, '
+                               'if it does not exist, and refined with the costs measured in each build.')
+
+    parser.add_argument('--shared-memory', action = 'store_true',
+                        help = 'Hand the events to the workers through shared memory instead of pickling them. '
+                               'Cannot be combined with --resume, --session-sketches, --max-user-events, '
+                               '--memory-budget and --cost-model.')
+
+    parser.add_argument('--shard-dir', default = None,
+                        help = 'Shared directory with the shard plan and the results of the shards.')
+    parser.add_argument('--plan-shards', type = int, default = None,
+                        help = 'Assign the users to this many shards balanced by their number of screen events '
+                               'and write the plan to --shard-dir.')
+    parser.add_argument('--shard', default = None,
+                        help = 'Build shard K/N of the plan in --shard-dir, e.g. 0/4. The parameters of the panel '
+                               'are taken from the plan.')
+    parser.add_argument('--merge-shards', action = 'store_true',
+                        help = 'Check that all shards in --shard-dir are complete and write the panel to --output.')
+
+    parser.add_argument('--session-sketches', default = None,
+                        help = 'Optional output file (.csv or .pkl) with session length quantiles per user and semester.')
+    parser.add_argument('--semesters', default = None,
+                        help = 'Semesters (.csv or .pkl) with semester, start and end used for the session sketches.')
+
+    parser.add_argument('--quiet', action = 'store_true',
+                        help = 'Do not report the progress.')
+
+    args = parser.parse_args(argv)
+
+    sharded = args.plan_shards is not None or args.shard is not None or args.merge_shards
+
+    if sum([args.plan_shards is not None, args.shard is not None, args.merge_shards]) > 1 :
+        parser.error('--plan-shards, --shard and --merge-shards cannot be combined')
+
+    if args.plan_shards is not None and args.plan_shards < 1 :
+        parser.error('--plan-shards must be at least 1')
+
+    if sharded and args.shard_dir is None :
+        parser.error('--shard-dir is required with --plan-shards, --shard and --merge-shards')
+
+    if sharded and (args.shared_memory or args.session_sketches is not None) :
+        parser.error('--plan-shards, --shard and --merge-shards cannot be combined with --shared-memory '
+                     'and --session-sketches')
+
+    heartbeats = args.invalidation is not None or args.heartbeat_bitmap is not None
+
+    if not args.merge_shards and args.event_log is None and (args.screen is None or not heartbeats) :
+        parser.error('either --event-log or both --screen and --invalidation (or --heartbeat-bitmap) are required')
+
+    conversion = args.write_event_log is not None or args.write_heartbeat_bitmap is not None
+
+    if args.output is None and not conversion and args.plan_shards is None and args.shard is None :
+        parser.error('--output is required')
+
+    if args.heartbeat_bitmap is not None and (args.write_event_log is not None or args.shared_memory or sharded) :
+        parser.error('--heartbeat-bitmap cannot be combined with --write-event-log, --shared-memory and sharding')
+
+    if args.shard is not None :
+        try :
+            args.shard = tuple(int(k) for k in args.shard.split('/'))
+        except ValueError :
+            args.shard = ()
+        if len(args.shard) != 2 :
+            parser.error('--shard must be given as K/N, e.g. 0/4')
+
+    scheduled = args.memory_budget is not None or args.cost_model is not None
+
+    if args.memory_budget is not None and args.output is not None and not appendable(args.output) :
+        parser.error('--memory-budget needs a .csv --output, which is written one user at a time')
+
+    if args.shared_memory and (args.resume or args.session_sketches is not None or args.max_user_events is not None
+                               or scheduled) :
+        parser.error('--shared-memory cannot be combined with --resume, --session-sketches, --max-user-events, '
+                     '--memory-budget and --cost-model')
+
+    return args
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def cut_points(value) :
+
+    """
+    Helper function for parse_args
+
+    Parse comma separated cut points of session length classes, e.g. 10,35,300,1800
+    """
+
+    try :
+        cuts = [int(c) for c in value.split(',')]
+    except ValueError :
+        raise argparse.ArgumentTypeError('expected comma separated integers, got {!r}'.format(value))
+
+    try :
+        session_classes(None, cuts)
+    except ValueError as e :
+        raise argparse.ArgumentTypeError(str(e))
+
+    return cuts
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
@@ -0,0 +1,265 @@
+from datetime import datetime as dt
+import numpy as np
+import pandas as pd
+
+from .partition import UserPartition
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def coverage_report(screen,
+                    invalidation_stamps,
+                    timebin_len = 900,
+                    invalidate_cut = 1800,
+                    max_screen_ses = 7200,
+                    semesters = None) :
+
+    """
+    Return a per-user report of how much of the timeline is covered by valid data, per day or per semester.
+
+    The report is computed from the heartbeat gaps as intervals of timebins, so the grid of valid timebins is never
+    materialized. The screen events are only checked against the gap intervals, so the report is cheap
+    compared to screen_behaviour and can be used to select the eligible users before the panel is built.
+
+    Parameters
+    ----------
+    screen, invalidation_stamps                 : pandas.DataFrame
+
+                       The screen and invalidation_stamps dataframes of screen_behaviour for all users.
+                       Users without heartbeat stamps have no valid timebins.
+
+    timebin_len, invalidate_cut, max_screen_ses : int
+
+                       The same as for screen_behaviour.
+
+    semesters          : pandas.DataFrame
+
+                       Optional semesters with the variables semester, start and end (see SessionSketches).
+                       If None, the report is per day.
+
+    Output
+    ------
+    A pandas.DataFrame with a row per user and day (or semester) with the variables:
+
+    * user_idx         : Id of the user.
+    * day or semester  : Epoch time of the start of the day, or the name of the semester.
+    * valid_bins       : Number of timebins, where the phone is assumed to be on.
+    * invalid_bins     : Number of timebins invalidated by heartbeat gaps.
+    * gaps             : Number of heartbeat gaps longer than invalidate_cut starting in the period.
+    * twins            : Number of screen events invalidated as twins.
+    * sessions         : Number of valid screen sessions.
+    * dropped_sessions : Number of screen sessions dropped for being longer than max_screen_ses.
+    """
+
+    first_time, last_time = experiment_window()
+
+    if semesters is None :
+        period_name = 'day'
+        labels = np.arange(first_time, last_time + 1, 24 * 60 * 60)
+        starts = labels
+        ends = labels + 24 * 60 * 60
+    else :
+        period_name = 'semester'
+        semesters = semesters.sort_values('start')
+        labels = semesters['semester'].to_numpy()
+        starts = semesters['start'].to_numpy(dtype = np.int64)
+        ends = semesters['end'].to_numpy(dtype = np.int64)
+
+    partition = UserPartition({'screen': screen, 'invalidation': invalidation_stamps})
+
+    report = []
+
+    for (u, u_screen, u_invalidation) in partition.groups(missing = 'keep') :
+
+        counts = user_coverage(u_screen['timestamp'].to_numpy(dtype = np.int64),
+                               u_screen['screen_on'].to_numpy(),
+                               u_invalidation['timestamp'].to_numpy(dtype = np.int64),
+                               starts, ends, timebin_len, invalidate_cut, max_screen_ses)
+
+        counts.insert(0, period_name, labels)
+        counts.insert(0, 'user_idx', u)
+
+        report.append(counts)
+
+    return pd.concat(report, ignore_index = True)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def eligible_users(coverage, min_valid_bins) :
+
+    """
+    Return the users with at least min_valid_bins valid timebins in total in a coverage report
+    """
+
+    valid_bins = coverage.groupby('user_idx')['valid_bins'].sum()
+
+    return valid_bins.index[valid_bins >= min_valid_bins].to_numpy()
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def user_coverage(timestamps, screen_on, heartbeats, starts, ends, timebin_len, invalidate_cut, max_screen_ses) :
+
+    """
+    Helper function for coverage_report
+
+    Return the coverage counts of one user in each period [starts, ends) from the sorted screen events and
+    heartbeat stamps
+    """
+
+    first_time, last_time = experiment_window()
+    first_bin, last_bin = first_time // timebin_len, last_time // timebin_len
+
+    gap_start, gap_lo, gap_hi = gap_intervals(heartbeats, first_time, last_time, timebin_len, invalidate_cut)
+    lo, hi = disjoint_intervals(gap_lo, gap_hi)
+
+    #Timebins of each period inside the experiment: a timebin belongs to the period of its start time
+    period_lo = np.clip(-(-starts // timebin_len), first_bin, last_bin + 1)
+    period_hi = np.clip(-(-ends // timebin_len), first_bin, last_bin + 1)
+    period_hi = np.maximum(period_hi, period_lo)
+
+    invalid_bins = (bins_covered(lo, hi, period_hi) - bins_covered(lo, hi, period_lo))
+
+    #Screen events: twins and events in invalid timebins are invalid (see invalidate_off_bins and invalidate_twins)
+    twin = np.zeros(len(timestamps), dtype = bool)
+    twin[1:] = screen_on[1:] == screen_on[:-1]
+
+    event_bin = timestamps // timebin_len
+    k = np.searchsorted(lo, event_bin, side = 'right') - 1
+    in_gap = (k >= 0) & (event_bin <= hi[np.maximum(k, 0)]) if len(lo) > 0 else np.zeros(len(timestamps), bool)
+
+    valid = ~twin & ~in_gap
+
+    #Sessions: valid off events after a valid event (see prepare_screen_measurement)
+    timediff = np.zeros(len(timestamps), dtype = np.int64)
+    timediff[1:] = timestamps[1:] - timestamps[:-1]
+    previous_valid = np.concatenate([[False], valid[:-1]])
+
+    session = valid & previous_valid & (screen_on == 0) & (timediff > 0)
+
+    return pd.DataFrame({'valid_bins': period_hi - period_lo - invalid_bins,
+                         'invalid_bins': invalid_bins,
+                         'gaps': period_counts(gap_start, starts, ends),
+                         'twins': period_counts(timestamps[twin], starts, ends),
+                         'sessions': period_counts(timestamps[session & (timediff <= max_screen_ses)], starts, ends),
+                         'dropped_sessions': period_counts(timestamps[session & (timediff > max_screen_ses)],
+                                                           starts, ends)})
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def gap_intervals(heartbeats, first_time, last_time, timebin_len, invalidate_cut) :
+
+    """
+    Helper function for user_coverage
+
+    Return the start time and the first and last invalid bin_id of each heartbeat gap (see invalid_timebins)
+    """
+
+    stamps = np.concatenate([[first_time], heartbeats, [last_time]])
+
+    gap = np.diff(stamps) > invalidate_cut
+
+    return stamps[:-1][gap], stamps[:-1][gap] // timebin_len, stamps[1:][gap] // timebin_len
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def disjoint_intervals(lo, hi) :
+
+    """
+    Helper function for user_coverage
+
+    Return the union of the inclusive intervals [lo, hi] of consecutive gaps as disjoint intervals. Consecutive
+    gaps share the timebin of the heartbeat between them.
+    """
+
+    if len(lo) == 0 :
+        return lo, hi
+
+    covered = np.concatenate([[lo[0] - 1], np.maximum.accumulate(hi)[:-1]])
+
+    lo = np.maximum(lo, covered + 1)
+    keep = lo <= hi
+
+    return lo[keep], hi[keep]
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def bins_covered(lo, hi, bins) :
+
+    """
+    Helper function for user_coverage
+
+    Return the number of bin_ids below each of bins, which are covered by the disjoint intervals [lo, hi]
+    """
+
+    lengths = np.concatenate([[0], np.cumsum(hi - lo + 1)])
+
+    k = np.searchsorted(lo, bins, side = 'left')
+
+    #The intervals before k start below the bin, but the last of them may reach beyond it
+    overshoot = np.where(k > 0, np.maximum(hi[np.maximum(k - 1, 0)] + 1 - bins, 0), 0) if len(lo) > 0 else 0
+
+    return lengths[k] - overshoot
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def period_counts(timestamps, starts, ends) :
+
+    """
+    Helper function for user_coverage
+
+    Return the number of timestamps in each period [starts, ends). The periods must be sorted and disjoint.
+    """
+
+    k = np.searchsorted(starts, timestamps, side = 'right') - 1
+
+    inside = (k >= 0) & (timestamps < ends[np.maximum(k, 0)])
+
+    return np.bincount(k[inside], minlength = len(starts))
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def experiment_window() :
+
+    """
+    Helper function for coverage_report
+
+    Return the epoch times of the beginning and the end of the experiment
+    """
+
+    first_time = int((dt(year = 2013, month = 9, day=1) - dt(year=1970, month=1, day=1)).days * (24 * 60 * 60))
+
+    delta = ((dt(year = 2015, month = 8,day=31, hour=23, minute=59, second=59) - dt(year=1970, month=1, day=1)))
+    last_time = int(delta.days * 24 * 60 * 60 + delta.seconds)
+
+    return first_time, last_time
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
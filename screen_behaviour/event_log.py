@@ -0,0 +1,411 @@
+import numpy as np
+import pandas as pd
+
+from .partition import UserPartition
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+MAGIC = b'SBEVLOG1'
+
+STREAM_FIELDS = ['first', 'n', 'width', 'offset', 'n_exceptions', 'exceptions_offset']
+
+TABLE_DTYPE = np.dtype([('user_idx', '<i8')]
+                       + [('screen_' + f, '<i8') for f in STREAM_FIELDS]
+                       + [('screen_on_offset', '<i8')]
+                       + [('heartbeat_' + f, '<i8') for f in STREAM_FIELDS])
+
+WIDTHS = {1: '<u1', 2: '<u2', 4: '<u4'}
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def write_event_log(screen, invalidation_stamps, path) :
+
+    """
+    Write the screen events and heartbeat stamps of all users to a compact binary event log.
+
+    The file starts with a magic string, the number of users and a table with a row per user, which holds
+    the positions of the user's data in the file. The timestamps of each user are sorted and stored as the first
+    timestamp and the differences between consecutive timestamps, in the smallest of 1, 2 and 4 bytes that
+    gives the smallest file. Differences too large for the width are stored as the largest value of the width,
+    and the actual differences follow in a separate array of 8 byte exceptions. The screen_on values are
+    packed to one bit per event. The file is read with EventLog.
+
+    Parameters
+    ----------
+    screen              : pandas.DataFrame
+
+                          Screen events with the variables user_idx, timestamp and screen_on (0 or 1).
+
+    invalidation_stamps : pandas.DataFrame
+
+                          Heartbeat stamps with the variables user_idx and timestamp.
+
+    path                : str
+
+                          The file to write.
+    """
+
+    if not screen['screen_on'].isin([0, 1]).all() :
+        raise ValueError('screen_on must be 0 or 1')
+
+    partition = UserPartition({'screen': screen, 'invalidation': invalidation_stamps})
+
+    table = np.zeros(len(partition.users), dtype = TABLE_DTYPE)
+    table['user_idx'] = partition.users
+
+    position = len(MAGIC) + 8 + table.nbytes
+    chunks = []
+
+    def append(array) :
+        nonlocal position
+        offset = position
+        data = array.tobytes()
+        padding = -len(data) % 8
+        chunks.append(data + b'\0' * padding)
+        position += len(data) + padding
+        return offset
+
+    timestamps = partition.column('screen', 'timestamp', np.int64)
+    screen_on = partition.column('screen', 'screen_on', np.uint8)
+    heartbeats = partition.column('invalidation', 'timestamp', np.int64)
+
+    for i in range(len(partition.users)) :
+
+        s_start, s_end = partition.starts['screen'][i], partition.ends['screen'][i]
+        h_start, h_end = partition.starts['invalidation'][i], partition.ends['invalidation'][i]
+
+        streams = (('screen_', timestamps[s_start : s_end]), ('heartbeat_', heartbeats[h_start : h_end]))
+
+        for stream, values in streams :
+
+            first, width, deltas, exceptions = encode_deltas(values)
+
+            table[stream + 'first'][i] = first
+            table[stream + 'n'][i] = len(values)
+            table[stream + 'width'][i] = width
+            table[stream + 'offset'][i] = append(deltas)
+            table[stream + 'n_exceptions'][i] = len(exceptions)
+            table[stream + 'exceptions_offset'][i] = append(exceptions)
+
+        table['screen_on_offset'][i] = append(np.packbits(screen_on[s_start : s_end]))
+
+    with open(path, 'wb') as f :
+        f.write(MAGIC)
+        f.write(np.array([len(table)], dtype = '<i8').tobytes())
+        f.write(table.tobytes())
+        for chunk in chunks :
+            f.write(chunk)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+class EventLog :
+
+    """
+    Reader of a binary event log written by write_event_log.
+
+    The file is memory-mapped, so opening it only reads the table of users, and the events of a user are
+    decoded straight from the mapped file into the arrays used by screen_behaviour.
+
+    Parameters
+    ----------
+    path : str
+
+           The event log file.
+    """
+
+    def __init__(self, path) :
+
+        self.path = path
+        self.data = np.memmap(path, dtype = np.uint8, mode = 'r')
+
+        if bytes(self.data[: len(MAGIC)]) != MAGIC :
+            raise ValueError('{} is not a screen behaviour event log'.format(path))
+
+        n_users = int(self.view(len(MAGIC), 1, '<i8')[0])
+
+        self.table = self.view(len(MAGIC) + 8, n_users, TABLE_DTYPE)
+        self.users = self.table['user_idx']
+
+
+    def screen(self, user) :
+
+        """
+        Return the sorted timestamps and the screen_on values of a user's screen events as arrays
+        """
+
+        row = self.row(user)
+
+        timestamps = self.decode(row, 'screen_')
+        screen_on = np.unpackbits(self.view(row['screen_on_offset'], (len(timestamps) + 7) // 8, np.uint8),
+                                  count = len(timestamps)).astype(np.int8)
+
+        return timestamps, screen_on
+
+
+    def heartbeats(self, user) :
+
+        """
+        Return the sorted heartbeat stamps of a user as an array
+        """
+
+        return self.decode(self.row(user), 'heartbeat_')
+
+
+    def screen_frame(self, user) :
+
+        """
+        Return the screen events of a user as the screen dataframe of screen_behaviour
+        """
+
+        timestamps, screen_on = self.screen(user)
+
+        return pd.DataFrame({'timestamp': timestamps, 'screen_on': screen_on, 'user_idx': user})
+
+
+    def invalidation_frame(self, user) :
+
+        """
+        Return the heartbeat stamps of a user as the invalidation_stamps dataframe of screen_behaviour
+        """
+
+        return pd.DataFrame({'timestamp': self.heartbeats(user), 'user_idx': user})
+
+
+    def groups(self) :
+
+        """
+        Iterate over the users, who have both screen events and heartbeat stamps, and yield a
+        (user, screen, invalidation_stamps) tuple with the dataframes of screen_behaviour
+        """
+
+        for user, n_screen, n_heartbeats in zip(self.users, self.table['screen_n'], self.table['heartbeat_n']) :
+            if n_screen > 0 and n_heartbeats > 0 :
+                yield user, self.screen_frame(user), self.invalidation_frame(user)
+
+
+    def frames(self) :
+
+        """
+        Return the screen events and the heartbeat stamps of all users as two dataframes (e.g. for build_panel)
+        """
+
+        screen = [self.screen_frame(u) for u in self.users]
+        invalidation_stamps = [self.invalidation_frame(u) for u in self.users]
+
+        return pd.concat(screen, ignore_index = True), pd.concat(invalidation_stamps, ignore_index = True)
+
+
+    def row(self, user) :
+
+        """
+        Helper function for screen and heartbeats
+
+        Return the row of the table of a user
+        """
+
+        i = np.searchsorted(self.users, user)
+
+        if i == len(self.users) or self.users[i] != user :
+            raise KeyError(user)
+
+        return self.table[i]
+
+
+    def decode(self, row, stream) :
+
+        """
+        Helper function for screen and heartbeats
+
+        Return the timestamps of one stream of a user
+        """
+
+        n = int(row[stream + 'n'])
+
+        if n == 0 :
+            return np.zeros(0, dtype = np.int64)
+
+        width = int(row[stream + 'width'])
+        deltas = self.view(row[stream + 'offset'], n - 1, WIDTHS[width])
+        exceptions = self.view(row[stream + 'exceptions_offset'], row[stream + 'n_exceptions'], '<i8')
+
+        return decode_deltas(int(row[stream + 'first']), width, deltas, exceptions)
+
+
+    def view(self, offset, count, dtype) :
+
+        """
+        Helper function for EventLog
+
+        Return a view of count values of the given dtype at offset in the mapped file
+        """
+
+        dtype = np.dtype(dtype)
+        offset = int(offset)
+
+        return self.data[offset : offset + int(count) * dtype.itemsize].view(dtype)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+class LoggedFrame :
+
+    """
+    Reference to the screen events or the heartbeat stamps of a user in an event log. The dataframe is only decoded
+    by load, e.g. in the worker building the user, so build_panel never holds the events of all users at once.
+    len gives the number of events from the table of the log without decoding them.
+
+    Parameters
+    ----------
+    path   : str
+
+             The event log file.
+
+    user   : int
+
+             The user_idx.
+
+    stream : str
+
+             'screen' or 'heartbeat'.
+
+    n      : int
+
+             Number of events of the user in the stream.
+    """
+
+    def __init__(self, path, user, stream, n) :
+
+        self.path = path
+        self.user = user
+        self.stream = stream
+        self.n = int(n)
+
+
+    def __len__(self) :
+
+        return self.n
+
+
+    def load(self) :
+
+        """
+        Return the screen_frame or invalidation_frame of the user
+        """
+
+        log = open_event_log(self.path)
+
+        if self.stream == 'screen' :
+            return log.screen_frame(self.user)
+
+        return log.invalidation_frame(self.user)
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def open_event_log(path) :
+
+    """
+    Helper function for LoggedFrame
+
+    Return an EventLog of path, which is opened once per process
+    """
+
+    if path not in OPEN_LOGS :
+        OPEN_LOGS[path] = EventLog(path)
+
+    return OPEN_LOGS[path]
+
+
+OPEN_LOGS = {}
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def encode_deltas(timestamps) :
+
+    """
+    Helper function for write_event_log
+
+    Return the first timestamp, the width, the differences and the exceptions of sorted timestamps
+    """
+
+    if len(timestamps) == 0 :
+        return 0, 1, np.zeros(0, dtype = WIDTHS[1]), np.zeros(0, dtype = '<i8')
+
+    deltas = np.diff(timestamps)
+
+    if (deltas < 0).any() :
+        raise ValueError('The timestamps must be sorted')
+
+    def size(width) :
+        return len(deltas) * width + 8 * int((deltas >= escape_value(width)).sum())
+
+    width = min(WIDTHS, key = size)
+    escape = escape_value(width)
+
+    exceptions = deltas[deltas >= escape].astype('<i8')
+
+    return int(timestamps[0]), width, np.minimum(deltas, escape).astype(WIDTHS[width]), exceptions
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def decode_deltas(first, width, deltas, exceptions) :
+
+    """
+    Helper function for EventLog
+
+    Return the timestamps from the first timestamp, the differences and the exceptions
+    """
+
+    deltas = deltas.astype(np.int64)
+    deltas[deltas == escape_value(width)] = exceptions
+
+    timestamps = np.empty(len(deltas) + 1, dtype = np.int64)
+    timestamps[0] = first
+    np.cumsum(deltas, out = timestamps[1:])
+    timestamps[1:] += first
+
+    return timestamps
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def escape_value(width) :
+
+    """
+    Helper function for encode_deltas and decode_deltas
+
+    Return the largest value of an unsigned integer of width bytes, which marks an exception
+    """
+
+    return 2 ** (8 * width) - 1
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
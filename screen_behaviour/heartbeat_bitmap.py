@@ -0,0 +1,272 @@
+import numpy as np
+import pandas as pd
+
+from .partition import UserPartition
+from .coverage import disjoint_intervals, experiment_window
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def build_heartbeat_bitmap(invalidation_stamps, slot_len = 300) :
+
+    """
+    Build the heartbeat bitmap of all users from heartbeat stamps on a grid of slot_len seconds (e.g. timestamp_5m).
+
+    The experiment window is divided into slots of slot_len seconds, starting at the beginning of the experiment,
+    and the bit of a slot is set, if the user has a heartbeat stamp at the start of the slot. The bits of each user
+    are packed to bytes. The stamps before and after the experiment window are kept as they are, so the heartbeat
+    gaps between them and the gaps at the edges of the window are the same as in invalid_timebins.
+
+    Parameters
+    ----------
+    invalidation_stamps : pandas.DataFrame
+
+                          Heartbeat stamps with the variables user_idx and timestamp. The timestamps inside the
+                          experiment window must be on the grid of slots.
+
+    slot_len            : int
+
+                          Length of the slots in seconds.
+
+    Output
+    ------
+    A HeartbeatBitmap.
+    """
+
+    first_time, last_time = experiment_window()
+
+    n_slots = (last_time - first_time) // slot_len + 1
+
+    partition = UserPartition({'invalidation': invalidation_stamps})
+    stamps = partition.column('invalidation', 'timestamp', np.int64)
+
+    bits = np.zeros((len(partition.users), (n_slots + 7) // 8), dtype = np.uint8)
+    outside = []
+
+    for i in range(len(partition.users)) :
+
+        u_stamps = stamps[partition.starts['invalidation'][i] : partition.ends['invalidation'][i]]
+
+        inside = (u_stamps >= first_time) & (u_stamps <= last_time)
+        offsets = u_stamps[inside] - first_time
+
+        if (offsets % slot_len != 0).any() :
+            raise ValueError('The heartbeat stamps of user {} are not on the grid of {} second slots'.format(
+                partition.users[i], slot_len))
+
+        slots = np.zeros(n_slots, dtype = bool)
+        slots[offsets // slot_len] = True
+        bits[i] = np.packbits(slots, bitorder = 'big')[: bits.shape[1]]
+
+        outside.append(np.unique(u_stamps[~inside]))
+
+    outside_offsets = np.concatenate([[0], np.cumsum([len(o) for o in outside])]).astype(np.int64)
+    outside = np.concatenate(outside + [np.zeros(0, dtype = np.int64)])
+
+    return HeartbeatBitmap(partition.users, bits, outside, outside_offsets, slot_len)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+class HeartbeatBitmap :
+
+    """
+    Packed bitmap of the heartbeat slots of each user over the experiment window (see build_heartbeat_bitmap).
+
+    The bitmap is built once and replaces the heartbeat stamps for any timebin_len and invalidate_cut: it can be
+    passed as invalidation_stamps to screen_behaviour, screen_behaviour_windowed and build_panel. The invalid
+    timebins are found by skipping the runs of empty bytes, unpacking only the bytes with heartbeats and
+    comparing the runs of empty slots between the set bits with the cut. The slots are only converted to
+    timebins for the gaps. The few stamps outside the experiment window are compared in seconds.
+
+    Parameters
+    ----------
+    users    : numpy array
+
+               Sorted user_idx of the rows.
+
+    bits     : numpy array
+
+               (users x bytes) array with the packed bits of the slots.
+
+    outside         : numpy array
+
+                      Sorted stamps before and after the experiment window of all users.
+
+    outside_offsets : numpy array
+
+                      Position of each user's stamps in outside, with the end of the last user's stamps at the end.
+
+    slot_len        : int
+
+                      Length of the slots in seconds.
+    """
+
+    def __init__(self, users, bits, outside, outside_offsets, slot_len = 300) :
+
+        self.users = np.asarray(users)
+        self.bits = bits
+        self.outside = np.asarray(outside, dtype = np.int64)
+        self.outside_offsets = np.asarray(outside_offsets, dtype = np.int64)
+        self.slot_len = int(slot_len)
+
+
+    def slots(self, user) :
+
+        """
+        Return the indices of the set slots of a user
+        """
+
+        row = self.bits[self.row(user)]
+
+        #Skip the runs of empty bytes and unpack the others
+        nonempty = np.flatnonzero(row)
+        unpacked = np.unpackbits(row[nonempty][:, None], axis = 1, bitorder = 'big')
+
+        byte, bit = np.nonzero(unpacked)
+
+        return nonempty[byte] * 8 + bit
+
+
+    def stamps(self, user) :
+
+        """
+        Return the sorted heartbeat stamps of a user, which are the stamps the bitmap was built from
+        without duplicates
+        """
+
+        first_time, last_time = experiment_window()
+
+        before, after = self.outside_stamps(user)
+
+        stamps = first_time + self.slots(user).astype(np.int64) * self.slot_len
+
+        return np.concatenate([before, stamps, after])
+
+
+    def invalid_bins(self, user, timebin_len, invalidate_cut) :
+
+        """
+        Return the same dataframe with the bin_ids of the invalid timebins as invalid_timebins for a user
+        """
+
+        first_time, last_time = experiment_window()
+
+        slots = self.slots(user)
+        before, after = self.outside_stamps(user)
+
+        #A run of empty slots between two set slots is a gap, if the set slots are more than invalidate_cut apart
+        runs = slots[1:] - slots[:-1] - 1
+        gap = runs >= invalidate_cut // self.slot_len
+
+        gap_start = first_time + slots[:-1][gap].astype(np.int64) * self.slot_len
+        gap_end = first_time + slots[1:][gap].astype(np.int64) * self.slot_len
+
+        #The gaps before the first slot and after the last slot are found in seconds like in invalid_timebins,
+        #from the beginning of the experiment through the stamps before the window to the first slot, and from
+        #the last slot through the stamps after the window to the end of the experiment
+        if len(slots) > 0 :
+            first_stamp = first_time + int(slots[0]) * self.slot_len
+            last_stamp = first_time + int(slots[-1]) * self.slot_len
+            edges = [np.concatenate([[first_time], before, [first_stamp]]),
+                     np.concatenate([[last_stamp], after, [last_time]])]
+        else :
+            edges = [np.concatenate([[first_time], before, after, [last_time]])]
+
+        edge_start = [e[:-1][np.diff(e) > invalidate_cut] for e in edges]
+        edge_end = [e[1:][np.diff(e) > invalidate_cut] for e in edges]
+
+        gap_start = np.concatenate([edge_start[0], gap_start] + edge_start[1:])
+        gap_end = np.concatenate([edge_end[0], gap_end] + edge_end[1:])
+
+        lo, hi = disjoint_intervals(gap_start // timebin_len, gap_end // timebin_len)
+
+        lengths = hi - lo + 1
+        shifts = np.repeat(np.cumsum(lengths) - lengths - lo, lengths)
+
+        return pd.DataFrame({'bin_id': np.arange(lengths.sum()) - shifts, 'invalid': 1})
+
+
+    def subset(self, users) :
+
+        """
+        Return a HeartbeatBitmap with the rows of the given users, e.g. to send a user to a worker process
+        """
+
+        rows = [self.row(u) for u in users]
+
+        outside = [self.outside[self.outside_offsets[i] : self.outside_offsets[i + 1]] for i in rows]
+        outside_offsets = np.concatenate([[0], np.cumsum([len(o) for o in outside])])
+
+        return HeartbeatBitmap(self.users[rows], self.bits[rows], np.concatenate(outside + [np.zeros(0)]),
+                               outside_offsets, self.slot_len)
+
+
+    def save(self, path) :
+
+        """
+        Save the bitmap to a compressed numpy .npz file, which can be read with load_heartbeat_bitmap
+        """
+
+        with open(path, 'wb') as f :
+            np.savez_compressed(f, users = self.users, bits = self.bits, outside = self.outside,
+                                outside_offsets = self.outside_offsets, slot_len = self.slot_len)
+
+
+    def outside_stamps(self, user) :
+
+        """
+        Helper function for HeartbeatBitmap
+
+        Return the stamps of a user before and after the experiment window
+        """
+
+        first_time, last_time = experiment_window()
+
+        i = self.row(user)
+        stamps = self.outside[self.outside_offsets[i] : self.outside_offsets[i + 1]]
+
+        return stamps[stamps < first_time], stamps[stamps > last_time]
+
+
+    def row(self, user) :
+
+        """
+        Helper function for HeartbeatBitmap
+
+        Return the row of a user
+        """
+
+        i = np.searchsorted(self.users, user)
+
+        if i == len(self.users) or self.users[i] != user :
+            raise KeyError(user)
+
+        return i
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def load_heartbeat_bitmap(path) :
+
+    """
+    Return a bitmap saved with HeartbeatBitmap.save
+    """
+
+    with np.load(path) as saved :
+        return HeartbeatBitmap(saved['users'], saved['bits'], saved['outside'], saved['outside_offsets'],
+                               int(saved['slot_len']))
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
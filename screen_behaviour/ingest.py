@@ -0,0 +1,167 @@
+import heapq
+import numpy as np
+import pandas as pd
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+class ReorderBuffer :
+
+    """
+    Bounded reorder buffer for one user's screen events arriving in almost sorted order.
+
+    The events are kept in a small heap, and an event is released, when an event more than lateness seconds
+    later has arrived. The events are therefore released in timestamp order (ties in arrival order, like
+    sort_by_timestamp), as long as no event arrives more than lateness seconds late. Events that arrive after a
+    later event has been released cannot be put in order, so they are dropped and counted as late.
+
+    While the events are released, they are checked for twins: an event with the same screen_on value as the
+    previously released event (see invalidate_twins).
+
+    Parameters
+    ----------
+    lateness : int
+
+               Number of seconds an event may arrive later than an event with a later timestamp.
+    """
+
+    def __init__(self, lateness = 60) :
+
+        self.lateness = lateness
+
+        self.heap = []
+        self.seq = 0
+        self.max_seen = None
+        self.last_timestamp = None
+        self.last_screen_on = None
+
+        self.n_events = 0
+        self.n_late = 0
+        self.n_twins = 0
+
+
+    def push(self, timestamp, screen_on) :
+
+        """
+        Add an event, and return a list of (timestamp, screen_on, twin) tuples of the events released by it
+        """
+
+        self.n_events += 1
+
+        if self.last_timestamp is not None and timestamp < self.last_timestamp :
+            self.n_late += 1
+            return []
+
+        heapq.heappush(self.heap, (timestamp, self.seq, screen_on))
+        self.seq += 1
+
+        if self.max_seen is None or timestamp > self.max_seen :
+            self.max_seen = timestamp
+
+        return self.release(self.max_seen - self.lateness)
+
+
+    def flush(self) :
+
+        """
+        Release all the events left in the buffer
+        """
+
+        return self.release(None)
+
+
+    def release(self, until) :
+
+        """
+        Helper function for push and flush
+
+        Release the events with a timestamp up to until (all events, if until is None) in order
+        """
+
+        released = []
+
+        while self.heap and (until is None or self.heap[0][0] <= until) :
+
+            timestamp, seq, screen_on = heapq.heappop(self.heap)
+
+            twin = (self.last_screen_on is not None) and (screen_on == self.last_screen_on)
+            self.n_twins += twin
+
+            self.last_timestamp = timestamp
+            self.last_screen_on = screen_on
+
+            released.append((timestamp, screen_on, twin))
+
+        return released
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def ingest_events(events, lateness = 60) :
+
+    """
+    Return the screen events of each user sorted by timestamp, using a ReorderBuffer per user instead of a
+    global sort.
+
+    Parameters
+    ----------
+    events   : pandas.DataFrame
+
+               The screen events in arrival order with the variables user_idx, timestamp and screen_on.
+
+    lateness : int
+
+               Number of seconds an event may arrive later than an event with a later timestamp.
+
+    Output
+    ------
+    A tuple with:
+
+    * A dict with a pandas.DataFrame for each user with the variables timestamp, screen_on, user_idx and twin.
+      The dataframes can be passed to screen_behaviour with presorted = True.
+    * A pandas.DataFrame with the number of events, late (dropped) events and twins of each user.
+    """
+
+    buffers = {}
+    released = {}
+
+    for user_idx, timestamp, screen_on in zip(events['user_idx'].to_numpy(),
+                                              events['timestamp'].to_numpy(),
+                                              events['screen_on'].to_numpy()) :
+
+        if user_idx not in buffers :
+            buffers[user_idx] = ReorderBuffer(lateness)
+            released[user_idx] = []
+
+        released[user_idx].extend(buffers[user_idx].push(timestamp, screen_on))
+
+    by_user = {}
+
+    for user_idx, buffer in buffers.items() :
+
+        released[user_idx].extend(buffer.flush())
+
+        timestamps, screen_on, twins = zip(*released[user_idx])
+
+        by_user[user_idx] = pd.DataFrame({'timestamp': np.array(timestamps),
+                                          'screen_on': np.array(screen_on),
+                                          'user_idx': user_idx,
+                                          'twin': np.array(twins, dtype = bool)})
+
+    stats = pd.DataFrame({'user_idx': list(buffers),
+                          'events': [b.n_events for b in buffers.values()],
+                          'late_events': [b.n_late for b in buffers.values()],
+                          'twins': [b.n_twins for b in buffers.values()]})
+
+    return by_user, stats
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
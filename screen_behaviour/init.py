@@ -1 +1,15 @@
-from .screen_behaviour import screen_behaviour
\ No newline at end of file
+from .screen_behaviour import screen_behaviour
+from .rolling_features import screen_prefix_sums, range_features, rolling_features, features_frame
+from .session_sketch import SessionLengthSketch, SessionSketches
+from .panel import build_panel
+from .checkpoint import concat_shards
+from .shared_memory import build_panel_shared
+from .ingest import ReorderBuffer, ingest_events
+from .streaming import StreamingScreenAggregator
+from .time_windows import screen_behaviour_windowed
+from .partition import UserPartition
+from .coverage import coverage_report, eligible_users
+from .event_log import write_event_log, EventLog
+from .sharding import plan_shards, run_shard, merge_shards
+from .heartbeat_bitmap import build_heartbeat_bitmap, HeartbeatBitmap, load_heartbeat_bitmap
+from .scheduler import CostModel, load_cost_model, user_stats
@@ -1,4 +1,6 @@
 from datetime import datetime as dt
+import heapq
+import itertools
 import numpy as np
 import pandas as pd
 
@@ -13,18 +15,28 @@ def invalid_timebins(invalidation_stamps, timebin_len, invalidate_cut) :
     Helper function for screen_behaviour
     
     Return a dataframe with bin_ids of the timebins where the phone is assumed to be turned off 
+    
+    invalidation_stamps is either a sorted dataframe with a timestamp variable, or a list of sorted arrays
+    of timestamps from different sources (e.g. sensor_time, wifi and location), which are merged lazily.
     """    
     
     first_time = int((dt(year = 2013, month = 9, day=1) - dt(year=1970, month=1, day=1)).days * (24 * 60 * 60))
-    first = pd.DataFrame({'timestamp': first_time}, index = [0])
     
     delta = ((dt(year = 2015, month = 8,day=31, hour=23, minute=59, second=59) - dt(year=1970, month=1, day=1)))
     last_time = int(delta.days * 24 * 60 * 60 + delta.seconds)
-    last = pd.DataFrame({'timestamp': last_time}, index = [0])
     
-    invalidation_stamps = pd.concat([first, invalidation_stamps, last], ignore_index = True)
+    if isinstance(invalidation_stamps, list) :
+        
+        invalid_stamps = invalid_timestamps_merged(invalidation_stamps, first_time, last_time, invalidate_cut)
     
-    invalid_stamps = invalid_timestamps(invalidation_stamps, invalidate_cut)
+    else :
+        
+        first = pd.DataFrame({'timestamp': first_time}, index = [0])
+        last = pd.DataFrame({'timestamp': last_time}, index = [0])
+        
+        invalidation_stamps = pd.concat([first, invalidation_stamps, last], ignore_index = True)
+        
+        invalid_stamps = invalid_timestamps(invalidation_stamps, invalidate_cut)
     
     invalid_bins = invalid_bins_frame(invalid_stamps, timebin_len)
     
@@ -55,6 +67,39 @@ def invalid_timestamps(invalidation_stamps, invalidate_cut) :
 #----------------------------------------------------------------------------------------------------------------------
 
 
+def invalid_timestamps_merged(sources, first_time, last_time, invalidate_cut) :
+    
+    """
+    Helper function for invalid_timebins
+    
+    Return the same dataframe as invalid_timestamps for several sorted sources of timestamps.
+    
+    The sources are merged with a streaming k-way merge, and the first_time and last_time boundary stamps are
+    injected before and after the merged stream, so the sources are never concatenated, copied or sorted.
+    """
+    
+    stamps = itertools.chain([first_time], heapq.merge(*sources), [last_time])
+    
+    timestamps = []
+    timediffs = []
+    
+    previous = next(stamps)
+    
+    for stamp in stamps :
+        
+        if stamp - previous > invalidate_cut :
+            timestamps.append(int(stamp))
+            timediffs.append(int(stamp - previous))
+        
+        previous = stamp
+    
+    return pd.DataFrame({'timestamp': timestamps, 'timediff': timediffs}, dtype = int)
+
+
+#----------------------------------------------------------------------------------------------------------------------
+#----------------------------------------------------------------------------------------------------------------------
+
+
 def invalid_bins_frame(invalid_stamps, timebin_len) :
     
     """
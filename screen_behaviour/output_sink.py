@@ -0,0 +1,156 @@
+import os
+import queue
+import threading
+
+from .checkpoint import read_shard, concat_frames
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+class OutputSink :
+
+    """
+    Asynchronous output of the screen behaviour panel.
+
+    The results of the users are put in a bounded queue, which is drained by a writer thread, so the results are
+    serialized while the next users are computed. When the queue is full, put blocks until the writer catches up,
+    which keeps the number of results in memory bounded. The output is written to a temporary file, which replaces
+    output when the sink is closed, so the output is either complete or not there.
+
+    A .csv output is appended one user at a time. A pickle cannot be appended, so for other outputs the writer
+    collects the results and pickles them when the sink is closed, which needs memory for the whole panel twice.
+    Use a .csv output (see appendable), when the memory has to stay bounded.
+
+    Parameters
+    ----------
+    output         : str
+
+                     The .csv or .pkl file.
+
+    checkpoint_dir : str
+
+                     Optional checkpoint directory. Users put without a result are read from their shard in it.
+
+    queue_size     : int
+
+                     Maximum number of users waiting to be written.
+    """
+
+    def __init__(self, output, checkpoint_dir = None, queue_size = 16) :
+
+        self.output = output
+        self.checkpoint_dir = checkpoint_dir
+        self.tmp_path = output + '.tmp'
+        self.queue = queue.Queue(maxsize = queue_size)
+        self.error = None
+
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+
+    def put(self, user, result = None) :
+
+        """
+        Queue the result of a user (or None to read it from the user's shard) to be written after the earlier users
+        """
+
+        if self.error is not None :
+            raise self.error
+
+        self.queue.put((user, result))
+
+
+    def close(self, abort = False) :
+
+        """
+        Write the remaining results and move the output into place, or remove the temporary file if abort is True
+        """
+
+        self.queue.put(ABORT if abort else CLOSE)
+        self.thread.join()
+
+        if self.error is not None and not abort :
+            raise self.error
+
+
+    def run(self) :
+
+        """
+        Helper function for OutputSink
+
+        Write the queued results until the sink is closed
+        """
+
+        item = None
+
+        try :
+
+            frames = []
+            header = True
+
+            with open(self.tmp_path, 'w', newline = '') as f :
+
+                item = self.queue.get()
+
+                while item is not CLOSE and item is not ABORT :
+
+                    user, result = item
+                    if result is None :
+                        result = read_shard(self.checkpoint_dir, user)
+
+                    if appendable(self.output) :
+                        result.to_csv(f, header = header, index = False)
+                        header = False
+                    else :
+                        frames.append(result)
+
+                    item = self.queue.get()
+
+            if item is ABORT :
+                os.remove(self.tmp_path)
+                return
+
+            if not appendable(self.output) :
+                concat_frames(frames).to_pickle(self.tmp_path)
+
+            os.replace(self.tmp_path, self.output)
+
+        except Exception as e :
+
+            self.error = e
+
+            #Keep draining the queue, so put and close do not block
+            while item is not CLOSE and item is not ABORT :
+                item = self.queue.get()
+
+            if os.path.exists(self.tmp_path) :
+                os.remove(self.tmp_path)
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+CLOSE = ('close', )
+ABORT = ('abort', )
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def appendable(output) :
+
+    """
+    Return True, if the output file is written one user at a time by OutputSink (a .csv file)
+    """
+
+    return output.endswith('.csv')
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
@@ -0,0 +1,668 @@
+import collections
+import contextlib
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+
+from .screen_behaviour import screen_behaviour
+from .screen_measures import session_classes
+from .time_windows import screen_behaviour_windowed
+from .session_sketch import SessionSketches
+from .partition import UserPartition
+from .heartbeat_bitmap import HeartbeatBitmap
+from .event_log import EventLog, LoggedFrame
+from .output_sink import OutputSink, appendable
+from .scheduler import CostModel, CostMeter, user_stats, budgeted_imap
+from .checkpoint import open_checkpoint, record_completed, write_shard, read_shard, concat_shards, concat_frames
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def build_panel(screen,
+                invalidation_stamps,
+                timebin_len = 900,
+                invalidate_cut = 1800,
+                short_ses_len = 35,
+                max_screen_ses = 7200,
+                workers = 1,
+                chunk_size = 1,
+                checkpoint_dir = None,
+                resume = False,
+                output = None,
+                session_sketches = None,
+                progress = False,
+                max_user_events = None,
+                session_cuts = None,
+                output_queue_size = 16,
+                memory_budget = None,
+                cost_model = None,
+                collect = True) :
+
+    """
+    Return the screen behaviour panel for all users, built with screen_behaviour.
+
+    Parameters
+    ----------
+    screen, invalidation_stamps                                  : pandas.DataFrame
+
+                                 The screen and invalidation_stamps dataframes of screen_behaviour for all users.
+                                 Users missing from one of the dataframes are skipped. invalidation_stamps can
+                                 also be a HeartbeatBitmap of all users. screen can also be an EventLog, which
+                                 is decoded one user at a time, with invalidation_stamps None (the heartbeats of
+                                 the event log) or a HeartbeatBitmap.
+
+    timebin_len, invalidate_cut, short_ses_len, max_screen_ses   : int
+
+                                 Passed on to screen_behaviour.
+
+    workers                      : int
+
+                                 Number of worker processes. With 1 worker, all users are processed in this process.
+
+    chunk_size                   : int
+
+                                 Number of users sent to a worker at a time.
+
+    checkpoint_dir               : str
+
+                                 Optional directory, where the result of each user is saved atomically as a shard
+                                 as soon as it is finished, together with a manifest of the completed users and
+                                 a fingerprint of the parameters.
+
+    resume                       : bool
+
+                                 If True, the users completed in checkpoint_dir by an earlier build with the same
+                                 parameters are skipped.
+
+    output                       : str
+
+                                 Optional .csv or .pkl file. If given, the panel is written to the file instead of
+                                 being returned. The users are handed to an OutputSink in user order as soon as
+                                 they are finished, and a writer thread writes them while the next users are
+                                 computed. Only a .csv file is written one user at a time: a .pkl file is pickled
+                                 at the end with the whole panel in memory, so it is rejected with a memory_budget.
+
+    session_sketches             : SessionSketches
+
+                                 Optional. The session length sketches of all users are merged into this collection.
+
+    progress                     : bool
+
+                                 If True, the progress, the throughput and the estimated time left are reported
+                                 to stderr while the panel is built.
+
+    max_user_events              : int
+
+                                 Optional. Users with more screen events than this are not given to a single worker.
+                                 Their timelines are split into time windows of at most about max_user_events
+                                 events, which are processed in parallel by screen_behaviour_windowed after
+                                 the other users are finished.
+
+    session_cuts                 : list of int
+
+                                 Optional cut points of session length classes passed on to screen_behaviour.
+                                 A ValueError is raised before the build, unless they are positive and distinct.
+
+    output_queue_size            : int
+
+                                 Maximum number of users waiting for the writer thread of the output. When the
+                                 queue is full, the build waits for the writer, and no further chunks are sent
+                                 to the workers, so the results in memory stay bounded.
+
+    memory_budget                : int
+
+                                 Optional budget in bytes for the estimated peak memory of the users running at
+                                 the same time in the workers. A chunk is only started, when its estimate fits in
+                                 the budget together with the running chunks.
+
+    cost_model                   : CostModel
+
+                                 Optional model of the runtime and peak memory of a user. With a cost_model or a
+                                 memory_budget, the runtime and memory of each user are estimated from pre-scan
+                                 statistics (see user_stats), and the users with the longest estimated runtime are
+                                 started first. With a cost_model, the runtime and peak memory of each user are
+                                 also measured, and the model is refitted with them after the build (save it
+                                 with CostModel.save to use the measurements in later builds).
+
+    collect                      : bool
+
+                                 If False, the results are only kept in checkpoint_dir, and the panel is not
+                                 concatenated (e.g. for a shard, which is concatenated by merge_shards).
+
+    Output
+    ------
+    A pandas.DataFrame with the concatenated output of screen_behaviour for all users in user order,
+    or None if output is given or collect is False.
+    """
+
+    params = {'timebin_len': timebin_len,
+              'invalidate_cut': invalidate_cut,
+              'short_ses_len': short_ses_len,
+              'max_screen_ses': max_screen_ses}
+
+    if session_cuts is not None :
+        session_classes(short_ses_len, session_cuts)
+        params['session_cuts'] = list(session_cuts)
+
+    sketch_params = None
+    if session_sketches is not None :
+        sketch_params = (session_sketches.semesters, session_sketches.sketch_params)
+
+    if not collect and (checkpoint_dir is None or output is not None) :
+        raise ValueError('collect = False needs a checkpoint_dir and no output')
+
+    if memory_budget is not None and output is not None and not appendable(output) :
+        raise ValueError('With a memory_budget the output must be a .csv file, which is written one user at a time, '
+                         'not {}'.format(output))
+
+    pairs = user_pairs(screen, invalidation_stamps)
+    users = [u for (u, u_screen, u_invalidation) in pairs]
+
+    #With a schedule, the users finish out of user order, so their results wait for the output in temporary
+    #shards instead of in memory
+    tmp_checkpoint_dir = None
+    scheduled = (cost_model is not None or memory_budget is not None) and workers > 1
+    if scheduled and output is not None and checkpoint_dir is None :
+        tmp_checkpoint_dir = tempfile.mkdtemp(prefix = os.path.basename(output) + '.', suffix = '.shards',
+                                              dir = os.path.dirname(os.path.abspath(output)))
+        checkpoint_dir = tmp_checkpoint_dir
+
+    progress = ProgressReporter(len(pairs), chunk_events(pairs)) if progress else None
+
+    completed = set()
+    manifest = None
+    if checkpoint_dir is not None :
+        fingerprint_params = dict(params, session_sketches = sketch_params_record(sketch_params))
+        manifest = open_checkpoint(checkpoint_dir, fingerprint_params, resume)
+        completed = set(manifest['completed'])
+
+    todo = [pair for pair in pairs if pair[0] not in completed]
+
+    heavy = []
+    if max_user_events is not None :
+        heavy = [pair for pair in todo if len(pair[1]) > max_user_events]
+        todo = [pair for pair in todo if len(pair[1]) <= max_user_events]
+
+    if progress is not None :
+        done = [pair for pair in pairs if pair[0] in completed]
+        progress.skip(len(done), chunk_events(done))
+
+    model = cost_model
+    if model is None and memory_budget is not None :
+        model = CostModel()
+
+    measure = cost_model is not None
+
+    if model is not None :
+        stats = {u : user_stats(load_frame(u_screen), load_frame(u_invalidation), timebin_len, invalidate_cut)
+                 for (u, u_screen, u_invalidation) in todo}
+        estimates = {u : model.estimate(stats[u]) for u in stats}
+        if workers > 1 :
+            todo = sorted(todo, key = lambda pair : -estimates[pair[0]][0])
+
+    #A sample of the users is traced for their peak memory, the runtime is measured on the others
+    traced = set()
+    if measure :
+        rng = np.random.default_rng()
+        traced = {u for (u, u_screen, u_invalidation) in todo if rng.random() < cost_model.memory_sample}
+
+    chunks = [todo[i : i + chunk_size] for i in range(0, len(todo), chunk_size)]
+    jobs = [(chunk, checkpoint_dir, params, sketch_params, None,
+             [pair[0] in traced for pair in chunk] if measure else None) for chunk in chunks]
+
+    #The heavy users are split into time windows, which use all the workers. They are built first, so the
+    #output can be written in user order while the other users are built.
+    heavy_jobs = [([pair], checkpoint_dir, params, sketch_params, (max_user_events, workers), None)
+                  for pair in heavy]
+
+    results = {}
+
+    sink = None
+    if output is not None :
+        sink = OutputSink(output, checkpoint_dir, output_queue_size)
+
+    #Users are handed to the sink in user order, as soon as they and all users before them are finished
+    ready = set(completed)
+    position = 0
+
+    try :
+
+        for chunk_results in map(build_chunk, heavy_jobs) :
+            collect_chunk(chunk_results, results, checkpoint_dir, manifest, session_sketches, progress)
+            ready.update(u for (u, result, sketches, events, cost) in chunk_results)
+
+        if workers > 1 :
+            pool = Pool(workers)
+            if model is not None :
+                memory = [max(estimates[pair[0]][1] for pair in job[0]) for job in jobs]
+                chunks = budgeted_imap(pool, build_chunk, jobs, memory, workers, memory_budget)
+            elif sink is not None :
+                chunks = ordered_imap(pool, jobs, 2 * workers)
+            else :
+                chunks = pool.imap_unordered(build_chunk, jobs)
+        else :
+            pool = None
+            chunks = map(build_chunk, jobs)
+
+        try :
+            for chunk_results in chunks :
+                collect_chunk(chunk_results, results, checkpoint_dir, manifest, session_sketches, progress)
+                ready.update(u for (u, result, sketches, events, cost) in chunk_results)
+                if measure :
+                    for (u, result, sketches, events, cost) in chunk_results :
+                        cost_model.observe(stats[u], *cost)
+                if sink is not None :
+                    while position < len(users) and users[position] in ready :
+                        sink.put(users[position], results.pop(users[position], None))
+                        position += 1
+        finally :
+            if pool is not None :
+                pool.terminate()
+
+        if sink is not None :
+            for u in users[position :] :
+                sink.put(u, results.pop(u, None))
+
+    except BaseException :
+        if sink is not None :
+            sink.close(abort = True)
+        if tmp_checkpoint_dir is not None :
+            shutil.rmtree(tmp_checkpoint_dir, ignore_errors = True)
+        raise
+
+    if progress is not None :
+        progress.finish()
+
+    if measure :
+        cost_model.fit()
+
+    #The sketches of users completed in an earlier build are read from their shards
+    if checkpoint_dir is not None and session_sketches is not None :
+        for u in users :
+            if u in completed :
+                session_sketches.merge(read_shard(checkpoint_dir, u, SKETCH_SUFFIX))
+
+    if sink is not None :
+        sink.close()
+        if tmp_checkpoint_dir is not None :
+            shutil.rmtree(tmp_checkpoint_dir)
+        return None
+
+    if not collect :
+        return None
+
+    if checkpoint_dir is None :
+        return concat_frames(results[u] for u in users)
+
+    return concat_shards(checkpoint_dir, users, None)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+SKETCH_SUFFIX = '.sketch.pkl'
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def user_pairs(screen, invalidation_stamps) :
+
+    """
+    Helper function for build_panel
+
+    Return a list of (user_idx, screen, invalidation_stamps) tuples with the dataframes of each user,
+    who has observations in both dataframes. The dataframes are slices of a UserPartition. With a HeartbeatBitmap,
+    each user gets the bitmap of only that user. With an EventLog, the dataframes are LoggedFrame references,
+    which are only decoded by load_frame where the user is built, and the users are selected by the event counts
+    in the table of the log.
+    """
+
+    if isinstance(screen, EventLog) :
+        table = screen.table
+        if invalidation_stamps is None :
+            return [(u, LoggedFrame(screen.path, u, 'screen', n_screen),
+                     LoggedFrame(screen.path, u, 'heartbeat', n_heartbeats))
+                    for (u, n_screen, n_heartbeats) in zip(screen.users, table['screen_n'], table['heartbeat_n'])
+                    if n_screen > 0 and n_heartbeats > 0]
+        bitmap_users = set(invalidation_stamps.users)
+        return [(u, LoggedFrame(screen.path, u, 'screen', n_screen), invalidation_stamps.subset([u]))
+                for (u, n_screen) in zip(screen.users, table['screen_n']) if n_screen > 0 and u in bitmap_users]
+
+    if isinstance(invalidation_stamps, HeartbeatBitmap) :
+        partition = UserPartition({'screen': screen})
+        bitmap_users = set(invalidation_stamps.users)
+        return [(u, u_screen, invalidation_stamps.subset([u])) for (u, u_screen) in partition.groups()
+                if u in bitmap_users]
+
+    partition = UserPartition({'screen': screen, 'invalidation': invalidation_stamps})
+
+    return list(partition.groups(missing = 'skip'))
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def load_frame(frame) :
+
+    """
+    Helper function for build_panel
+
+    Return the dataframe of a LoggedFrame from user_pairs, or the dataframe (or bitmap) itself
+    """
+
+    if isinstance(frame, LoggedFrame) :
+        return frame.load()
+
+    return frame
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def build_chunk(job) :
+
+    """
+    Helper function for build_panel
+
+    Run screen_behaviour for each user in a chunk of users, or screen_behaviour_windowed, if the job has
+    window parameters. With a checkpoint_dir, each user's result (and session sketches) is saved as a shard
+    as soon as the user is finished.
+    If the job has a measure list, the peak memory of screen_behaviour is measured for the users, where it is
+    True, and the runtime for the others (see CostMeter).
+    Return a list with a (user_idx, result, sketches, events, cost) tuple for each user, where result and sketches
+    are None, if they have been saved, and cost is a (seconds, peak) tuple or None.
+    """
+
+    chunk, checkpoint_dir, params, sketch_params, window_params, measure = job
+
+    chunk_results = []
+
+    for k, (u, u_screen, u_invalidation) in enumerate(chunk) :
+
+        u_screen = load_frame(u_screen)
+        u_invalidation = load_frame(u_invalidation)
+
+        sketches = None if sketch_params is None else SessionSketches(sketch_params[0], **sketch_params[1])
+
+        meter = CostMeter(measure[k]) if measure is not None else contextlib.nullcontext()
+
+        with meter :
+            if window_params is None :
+                result = screen_behaviour(u_screen, u_invalidation, session_sketches = sketches, **params)
+            else :
+                max_window_events, workers = window_params
+                result = screen_behaviour_windowed(u_screen, u_invalidation, max_window_events = max_window_events,
+                                                   workers = workers, session_sketches = sketches, **params)
+
+        cost = (meter.seconds, meter.peak) if measure is not None else None
+
+        if checkpoint_dir is not None :
+            if sketches is not None :
+                write_shard(checkpoint_dir, u, sketches, SKETCH_SUFFIX)
+                sketches = None
+            write_shard(checkpoint_dir, u, result)
+            result = None
+
+        chunk_results.append((u, result, sketches, len(u_screen), cost))
+
+    return chunk_results
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def ordered_imap(pool, jobs, window) :
+
+    """
+    Helper function for build_panel
+
+    Run build_chunk on the jobs in a pool and yield the results in the order of the jobs. At most window jobs are
+    sent to the pool ahead of the result being yielded, so the results waiting in memory stay bounded while the
+    consumer is blocked.
+    """
+
+    jobs = iter(jobs)
+    pending = collections.deque()
+
+    for job in itertools.islice(jobs, window) :
+        pending.append(pool.apply_async(build_chunk, (job, )))
+
+    while pending :
+
+        chunk_results = pending.popleft().get()
+
+        for job in itertools.islice(jobs, 1) :
+            pending.append(pool.apply_async(build_chunk, (job, )))
+
+        yield chunk_results
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def collect_chunk(chunk_results, results, checkpoint_dir, manifest, session_sketches, progress) :
+
+    """
+    Helper function for build_panel
+
+    Record the users of a finished chunk in the manifest (or keep their results in memory),
+    merge their session sketches and report the progress
+    """
+
+    users = [u for (u, result, sketches, events, cost) in chunk_results]
+
+    if checkpoint_dir is not None :
+        record_completed(checkpoint_dir, manifest, users)
+        if session_sketches is not None :
+            for u in users :
+                session_sketches.merge(read_shard(checkpoint_dir, u, SKETCH_SUFFIX))
+
+    else :
+        for (u, result, sketches, events, cost) in chunk_results :
+            results[u] = result
+            if session_sketches is not None :
+                session_sketches.merge(sketches)
+
+    if progress is not None :
+        progress.update(len(users), sum(events for (u, result, sketches, events, cost) in chunk_results))
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def sketch_params_record(sketch_params) :
+
+    """
+    Helper function for build_panel
+
+    Return the session sketch parameters in a form that can be part of the parameter fingerprint
+    """
+
+    if sketch_params is None :
+        return None
+
+    semesters, params = sketch_params
+    semesters = None if semesters is None else semesters.to_dict(orient = 'list')
+
+    return {'semesters': semesters, 'params': params}
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def chunk_events(chunk) :
+
+    """
+    Helper function for build_panel
+
+    Return the number of screen events in a chunk of users
+    """
+
+    return sum(len(u_screen) for (u, u_screen, u_invalidation) in chunk)
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def read_frame(path) :
+
+    """
+    Helper function for build_panel and the command line entry point
+
+    Read a dataframe from a .csv or a .pkl file
+    """
+
+    if path.endswith('.csv') :
+        return pd.read_csv(path)
+
+    return pd.read_pickle(path)
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def write_frame(frame, path) :
+
+    """
+    Helper function for build_panel and the command line entry point
+
+    Write a dataframe to a .csv or a .pkl file
+    """
+
+    if path.endswith('.csv') :
+        frame.to_csv(path, index = False)
+    else :
+        frame.to_pickle(path)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+class ProgressReporter :
+
+    """
+    Report the progress of a panel build with the throughput in users/s and events/s and the
+    estimated time left. The time left is estimated from the event throughput, since the cost of a
+    user mostly depends on the number of screen events.
+    """
+
+    def __init__(self, total_users, total_events, interval = 5, stream = sys.stderr) :
+
+        self.total_users = total_users
+        self.total_events = total_events
+        self.interval = interval
+        self.stream = stream
+
+        self.users = 0
+        self.events = 0
+        self.skipped_users = 0
+        self.skipped_events = 0
+        self.start = time.time()
+        self.last_report = 0
+
+
+    def skip(self, users, events) :
+
+        """
+        Count users that are already done (e.g. when resuming) without counting them in the throughput
+        """
+
+        self.skipped_users += users
+        self.skipped_events += events
+
+
+    def update(self, users, events) :
+
+        """
+        Count finished users and report the progress, if more than interval seconds have passed
+        """
+
+        self.users += users
+        self.events += events
+
+        if time.time() - self.last_report >= self.interval :
+            self.report()
+
+
+    def finish(self) :
+
+        """
+        Report the final progress
+        """
+
+        self.report()
+
+
+    def report(self) :
+
+        """
+        Helper function for update and finish
+
+        Write a line with the progress to the stream
+        """
+
+        self.last_report = time.time()
+        elapsed = max(self.last_report - self.start, 1e-9)
+
+        users_rate = self.users / elapsed
+        events_rate = self.events / elapsed
+
+        done_users = self.users + self.skipped_users
+        remaining_events = self.total_events - self.events - self.skipped_events
+
+        if remaining_events <= 0 :
+            eta = format_seconds(0)
+        elif events_rate > 0 :
+            eta = format_seconds(remaining_events / events_rate)
+        else :
+            eta = '?'
+
+        self.stream.write('users {}/{} ({:.1f}%) | {:.2f} users/s | {:,.0f} events/s | elapsed {} | ETA {}\n'
+                          .format(done_users, self.total_users, 100 * done_users / max(self.total_users, 1),
+                                  users_rate, events_rate, format_seconds(elapsed), eta))
+        self.stream.flush()
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def format_seconds(seconds) :
+
+    """
+    Helper function for ProgressReporter
+
+    Return a number of seconds formatted as h:mm:ss
+    """
+
+    seconds = int(round(seconds))
+
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
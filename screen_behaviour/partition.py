@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+class UserPartition :
+
+    """
+    Partition index of several datasets on the same users (e.g. screen events and heartbeat stamps).
+
+    Each dataset is sorted once by user and timestamp, and the rows of each user are found with an offsets
+    array (like the row pointers of a CSR matrix) aligned on the sorted union of the users of all datasets.
+    A user's rows are then a slice of the sorted dataset, so iterating over the users needs no hash grouping,
+    and the slices share the memory of the sorted dataset. Users missing from a dataset get an empty slice,
+    and it is up to the caller to decide, whether they are skipped, kept or an error.
+
+    Parameters
+    ----------
+    datasets : dict
+
+               The datasets by name. Each dataset must have the key variable and the order variable.
+
+    key      : str
+
+               The name of the user id variable.
+
+    order    : str
+
+               The name of the variable the rows of each user are sorted by.
+    """
+
+    def __init__(self, datasets, key = 'user_idx', order = 'timestamp') :
+
+        self.key = key
+        self.names = list(datasets)
+        self.frames = {}
+        keys = {}
+
+        for name, frame in datasets.items() :
+            self.frames[name] = frame.sort_values([key, order], kind = 'mergesort')
+            keys[name] = self.frames[name][key].to_numpy()
+
+        self.users = np.unique(np.concatenate([np.unique(k) for k in keys.values()]))
+
+        self.starts = {name : np.searchsorted(keys[name], self.users, side = 'left') for name in self.names}
+        self.ends = {name : np.searchsorted(keys[name], self.users, side = 'right') for name in self.names}
+
+
+    def counts(self, name) :
+
+        """
+        Return the number of rows of each user in a dataset
+        """
+
+        return self.ends[name] - self.starts[name]
+
+
+    def present(self, names = None) :
+
+        """
+        Return a boolean array, which is True for the users with rows in all the given datasets (all, if None)
+        """
+
+        names = self.names if names is None else names
+
+        return np.logical_and.reduce([self.counts(name) > 0 for name in names])
+
+
+    def missing_users(self) :
+
+        """
+        Return a dataframe with the users, who are missing from at least one dataset, and a boolean
+        in_<name> variable for each dataset
+        """
+
+        missing = ~self.present()
+
+        table = pd.DataFrame({self.key: self.users[missing]})
+        for name in self.names :
+            table['in_' + name] = self.counts(name)[missing] > 0
+
+        return table
+
+
+    def user_slice(self, name, user) :
+
+        """
+        Return the rows of a user in a dataset (empty, if the user is missing from the dataset)
+        """
+
+        i = np.searchsorted(self.users, user)
+
+        if i == len(self.users) or self.users[i] != user :
+            return self.frames[name].iloc[0 : 0]
+
+        return self.frames[name].iloc[self.starts[name][i] : self.ends[name][i]]
+
+
+    def column(self, name, column, dtype = None) :
+
+        """
+        Return a column of a sorted dataset as an array, which can be sliced with the offsets
+        """
+
+        return self.frames[name][column].to_numpy(dtype = dtype)
+
+
+    def groups(self, names = None, missing = 'skip') :
+
+        """
+        Iterate over the users in sorted order and yield a (user, slice, slice, ...) tuple with the user's rows
+        in each of the given datasets (all, if None).
+
+        missing decides what happens with users missing from one of the datasets:
+        'skip' skips them, 'keep' yields empty slices, and 'raise' raises a ValueError.
+        """
+
+        names = self.names if names is None else names
+
+        present = self.present(names)
+
+        if missing == 'raise' and not present.all() :
+            raise ValueError('{} users are missing from at least one of the datasets {}'
+                             .format(int((~present).sum()), names))
+
+        for i, user in enumerate(self.users) :
+
+            if missing == 'skip' and not present[i] :
+                continue
+
+            yield (user,) + tuple(self.frames[name].iloc[self.starts[name][i] : self.ends[name][i]] for name in names)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
@@ -0,0 +1,267 @@
+from datetime import datetime as dt
+import numpy as np
+import pandas as pd
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def screen_prefix_sums(screen_behav, timebin_len = 900, measures = None) :
+
+    """
+    Return per-user cumulative sums of the screen measures over the timebin axis.
+
+    The cumulative sums are stored per user from the user's first to last valid timebin, together with the
+    cumulative number of valid timebins, so the sum and the number of valid timebins in any range of timebins
+    can be found with two lookups. Invalidated timebins are missing from the output of screen_behaviour, and
+    they therefore add nothing to neither the sums nor the valid-bin counts.
+
+    Parameters
+    ----------
+    screen_behav : pandas.DataFrame
+
+                   The output of screen_behaviour for one or more users.
+
+    timebin_len  : int
+
+                   Number of seconds in each timebin. Must be the timebin_len used to build screen_behav.
+
+    measures     : list of str
+
+                   The measures to build cumulative sums for. Defaults to all columns except user_idx and timebin.
+
+    Output
+    ------
+    A dict used by range_features and rolling_features with the keys:
+
+    * user_idx      : numpy.ndarray with the sorted user ids.
+    * timebin_len   : The timebin length.
+    * first_bin     : numpy.ndarray with the bin_id of the first valid timebin of each user.
+    * n_bins        : numpy.ndarray with the number of timebins from the first to the last valid timebin of each user.
+    * offsets       : numpy.ndarray with the position of each user's cumulative sums in the flat arrays.
+    * valid_bins    : Flat numpy.ndarray with the cumulative number of valid timebins.
+    * sums          : Dict with a flat numpy.ndarray of cumulative sums for each measure.
+
+    Each user has n_bins + 1 entries in the flat arrays, starting with a zero.
+    """
+
+    if measures is None :
+        measures = [c for c in screen_behav.columns if c not in ('user_idx', 'timebin')]
+
+    user_idx = screen_behav['user_idx'].to_numpy()
+    bin_id = screen_behav['timebin'].to_numpy() // timebin_len
+
+    users, user_pos = np.unique(user_idx, return_inverse = True)
+
+    first_bin = np.full(len(users), np.iinfo(np.int64).max, dtype = np.int64)
+    last_bin = np.full(len(users), np.iinfo(np.int64).min, dtype = np.int64)
+    np.minimum.at(first_bin, user_pos, bin_id)
+    np.maximum.at(last_bin, user_pos, bin_id)
+
+    n_bins = last_bin - first_bin + 1
+    offsets = np.concatenate([[0], np.cumsum(n_bins + 1)[:-1]])
+    total = int((n_bins + 1).sum())
+
+    positions = offsets[user_pos] + 1 + (bin_id - first_bin[user_pos])
+
+    valid = np.zeros(total, dtype = np.int64)
+    valid[positions] = 1
+
+    sums = {}
+    for measure in measures :
+        column = screen_behav[measure].to_numpy()
+        values = np.zeros(total, dtype = column.dtype)
+        values[positions] = column
+        sums[measure] = segment_cumsum(values, offsets)
+
+    return {'user_idx': users,
+            'timebin_len': timebin_len,
+            'first_bin': first_bin,
+            'n_bins': n_bins,
+            'offsets': offsets,
+            'valid_bins': segment_cumsum(valid, offsets),
+            'sums': sums}
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def range_features(prefix, starts, ends, min_valid_bins = 1) :
+
+    """
+    Return the mean of each measure over the valid timebins in each of the time ranges [start, end).
+
+    A timebin belongs to a range, when the start of the timebin lies in the range. Every range is answered with
+    two lookups per user in the cumulative sums, so the cost does not depend on the length of the ranges.
+
+    Parameters
+    ----------
+    prefix         : dict
+
+                     The output of screen_prefix_sums.
+
+    starts, ends   : array-like of int
+
+                     Epoch times of the start (inclusive) and the end (exclusive) of each range,
+                     e.g. the start and end of each semester.
+
+    min_valid_bins : int
+
+                     Minimum number of valid timebins in a range, before the mean is reported.
+                     Ranges with fewer valid timebins get NaN.
+
+    Output
+    ------
+    A dict of feature matrices with one row per user (in the order of prefix['user_idx']) and one column
+    per range:
+
+    * user_idx   : The user ids of the rows.
+    * start, end : The ranges of the columns.
+    * valid_bins : The number of valid timebins in each range.
+    * <measure>  : The mean of the measure over the valid timebins in each range.
+    """
+
+    timebin_len = prefix['timebin_len']
+
+    starts = np.asarray(starts, dtype = np.int64)
+    ends = np.asarray(ends, dtype = np.int64)
+
+    #Index of the first timebin starting at or after each time
+    start_bins = -(-starts // timebin_len)
+    end_bins = -(-ends // timebin_len)
+
+    lo = prefix_positions(prefix, start_bins)
+    hi = prefix_positions(prefix, end_bins)
+
+    valid_bins = prefix['valid_bins'][hi] - prefix['valid_bins'][lo]
+    enough = valid_bins >= max(min_valid_bins, 1)
+
+    features = {'user_idx': prefix['user_idx'], 'start': starts, 'end': ends, 'valid_bins': valid_bins}
+
+    for measure, sums in prefix['sums'].items() :
+        total = (sums[hi] - sums[lo]).astype(float)
+        features[measure] = np.divide(total, valid_bins, out = np.full(total.shape, np.nan), where = enough)
+
+    return features
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def rolling_features(prefix, window_len, step = None, min_valid_bins = 1) :
+
+    """
+    Return the mean of each measure over trailing windows of window_len seconds, e.g. 24 * 60 * 60 for
+    daily and 7 * 24 * 60 * 60 for weekly features.
+
+    The windows end every step seconds from the first timebin of the experiment plus window_len to the end of
+    the experiment. step defaults to window_len, i.e. back to back windows. The output has the same form as the
+    output of range_features with one column per window, so a step of one timebin gives about 70,000 columns
+    per measure for 900 second timebins.
+    """
+
+    timebin_len = prefix['timebin_len']
+
+    if step is None :
+        step = window_len
+
+    first_timebin, last_timebin = experiment_timebins(timebin_len)
+
+    ends = np.arange(first_timebin + window_len, last_timebin + timebin_len + 1, step, dtype = np.int64)
+
+    return range_features(prefix, ends - window_len, ends, min_valid_bins)
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def features_frame(features) :
+
+    """
+    Return the feature matrices from range_features or rolling_features as a long dataframe with one row
+    per user and range
+    """
+
+    n_users = len(features['user_idx'])
+    n_ranges = len(features['start'])
+
+    frame = pd.DataFrame({'user_idx': np.repeat(features['user_idx'], n_ranges),
+                          'start': np.tile(features['start'], n_users),
+                          'end': np.tile(features['end'], n_users)})
+
+    for key, matrix in features.items() :
+        if key not in ('user_idx', 'start', 'end') :
+            frame[key] = matrix.ravel()
+
+    return frame
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def segment_cumsum(values, offsets) :
+
+    """
+    Helper function for screen_prefix_sums
+
+    Return the cumulative sums of values restarted at every offset. The value at each offset must be zero.
+    """
+
+    cumsum = np.cumsum(values)
+
+    segment_len = np.diff(np.append(offsets, len(values)))
+
+    return cumsum - np.repeat(cumsum[offsets], segment_len)
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def prefix_positions(prefix, bins) :
+
+    """
+    Helper function for range_features
+
+    Return a (users x bins) matrix with the positions in the flat arrays of the cumulative sums
+    of all timebins before each of the given bin_ids
+    """
+
+    local = bins[np.newaxis, :] - prefix['first_bin'][:, np.newaxis]
+    local = np.clip(local, 0, prefix['n_bins'][:, np.newaxis])
+
+    return prefix['offsets'][:, np.newaxis] + local
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def experiment_timebins(timebin_len) :
+
+    """
+    Helper function for rolling_features
+
+    Return the first and the last timebin of the experiment
+    """
+
+    first_timebin = ((dt(2013,9,day=1) - dt(year=1970,month=1,day=1)).days) * (24 * 60 * 60)
+
+    delta = ((dt(2015, 8, day=31, hour=23, minute=59, second=59) - dt(year=1970, month=1, day=1)))
+    last_timestamp = (delta.days * 24 * 60 * 60 + delta.seconds)
+    last_timebin = last_timestamp // timebin_len * timebin_len
+
+    return first_timebin, last_timebin
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
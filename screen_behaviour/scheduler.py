@@ -0,0 +1,307 @@
+import json
+import os
+import queue
+import time
+import tracemalloc
+import numpy as np
+
+from .heartbeat_bitmap import HeartbeatBitmap
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+FEATURES = ['events', 'long_sessions', 'gaps']
+
+#Coefficients (intercept, events, long_sessions, gaps) used until enough costs have been measured
+DEFAULT_RUNTIME = [0.02, 2e-5, 1e-4, 2e-3]
+DEFAULT_MEMORY = [2e6, 500.0, 2e3, 2e4]
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+class CostModel :
+
+    """
+    Linear model of the runtime (seconds) and the peak memory (bytes) of screen_behaviour for a user, estimated
+    from the pre-scan statistics of user_stats: the number of screen events, the number of sessions spanning more
+    than one timebin and the number of heartbeat gaps.
+
+    The model starts with default coefficients. The costs measured during a build are added as observations with
+    observe, and fit refits the coefficients by least squares, once there are enough observations. The model is
+    saved as JSON with the observations, so the estimates improve with each build.
+
+    Tracing the memory with tracemalloc slows screen_behaviour down several times, so only a sample of the users
+    is traced for their peak memory, and the runtime is measured on the other users.
+
+    Parameters
+    ----------
+    runtime, memory  : list of float
+
+                       Coefficients of the intercept and the FEATURES.
+
+    observations     : list
+
+                       Measured costs as [events, long_sessions, gaps, seconds, peak] lists, where either seconds
+                       or peak is None.
+
+    margin           : float
+
+                       Factor applied to the estimated memory, since the budget should hold for most users,
+                       not for the average user.
+
+    max_observations : int
+
+                       Number of most recent observations kept.
+
+    memory_sample    : float
+
+                       Fraction of the users traced for their peak memory.
+    """
+
+    def __init__(self, runtime = None, memory = None, observations = None, margin = 1.25, max_observations = 10000,
+                 memory_sample = 0.1) :
+
+        self.runtime = list(DEFAULT_RUNTIME if runtime is None else runtime)
+        self.memory = list(DEFAULT_MEMORY if memory is None else memory)
+        self.observations = [] if observations is None else list(observations)
+        self.margin = margin
+        self.max_observations = max_observations
+        self.memory_sample = memory_sample
+
+
+    def estimate(self, stats) :
+
+        """
+        Return the estimated runtime and peak memory of a user from its statistics
+        """
+
+        x = np.array([1.0] + [stats[f] for f in FEATURES])
+
+        return max(float(x @ self.runtime), 0.0), max(float(x @ self.memory), 0.0) * self.margin
+
+
+    def observe(self, stats, seconds, peak) :
+
+        """
+        Add the measured runtime or peak memory (the other is None) of a user
+        """
+
+        self.observations.append([stats[f] for f in FEATURES] + [seconds, peak])
+        self.observations = self.observations[-self.max_observations :]
+
+
+    def fit(self) :
+
+        """
+        Refit the coefficients from the observations. The runtime and the memory coefficients are each kept, while
+        there are fewer than ten observations per coefficient.
+        """
+
+        if len(self.observations) == 0 :
+            return self
+
+        #None becomes nan
+        observations = np.array(self.observations, dtype = float)
+
+        x = np.column_stack([np.ones(len(observations)), observations[:, : len(FEATURES)]])
+
+        for name, y in (('runtime', observations[:, -2]), ('memory', observations[:, -1])) :
+            measured = ~np.isnan(y)
+            if measured.sum() >= 10 * (len(FEATURES) + 1) :
+                coefficients = np.linalg.lstsq(x[measured], y[measured], rcond = None)[0]
+                setattr(self, name, np.maximum(coefficients, 0).tolist())
+
+        return self
+
+
+    def save(self, path) :
+
+        """
+        Save the model as JSON, which can be read with load_cost_model
+        """
+
+        model = {'runtime': self.runtime,
+                 'memory': self.memory,
+                 'margin': self.margin,
+                 'memory_sample': self.memory_sample,
+                 'observations': self.observations}
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f :
+            json.dump(model, f)
+        os.replace(tmp_path, path)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def load_cost_model(path) :
+
+    """
+    Return a model saved with CostModel.save, or a model with the default coefficients if path does not exist
+    """
+
+    if not os.path.exists(path) :
+        return CostModel()
+
+    with open(path) as f :
+        model = json.load(f)
+
+    return CostModel(model['runtime'], model['memory'], model['observations'], model['margin'],
+                     memory_sample = model.get('memory_sample', 0.1))
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def user_stats(screen, invalidation_stamps, timebin_len, invalidate_cut) :
+
+    """
+    Return the pre-scan statistics of a user used by CostModel
+
+    * events        : Number of screen events.
+    * long_sessions : Number of on events followed by an off event more than timebin_len seconds later,
+                      i.e. sessions spread over several timebins.
+    * gaps          : Number of heartbeat gaps longer than invalidate_cut.
+    """
+
+    order = np.argsort(screen['timestamp'].to_numpy(), kind = 'mergesort')
+    timestamps = screen['timestamp'].to_numpy()[order]
+    screen_on = screen['screen_on'].to_numpy()[order]
+
+    session = (screen_on[:-1] == 1) & (screen_on[1:] == 0)
+    long_sessions = int((session & (timestamps[1:] - timestamps[:-1] > timebin_len)).sum())
+
+    if isinstance(invalidation_stamps, HeartbeatBitmap) :
+        heartbeats = invalidation_stamps.stamps(invalidation_stamps.users[0])
+    elif isinstance(invalidation_stamps, list) :
+        heartbeats = np.sort(np.concatenate([np.asarray(s, dtype = np.int64) for s in invalidation_stamps]))
+    else :
+        heartbeats = np.sort(invalidation_stamps['timestamp'].to_numpy(dtype = np.int64))
+
+    gaps = int((np.diff(heartbeats) > invalidate_cut).sum())
+
+    return {'events': len(screen), 'long_sessions': long_sessions, 'gaps': gaps}
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def budgeted_imap(pool, function, jobs, memory, workers, memory_budget = None) :
+
+    """
+    Run function on the jobs in a pool in the given order, and yield the results as they finish.
+
+    A job is only started, when it fits in the memory budget together with the estimated memory of the running
+    jobs, so jobs wait instead of running together, when they would exceed the budget. A job larger than
+    the budget runs alone. The jobs are started in the given order, so sorting them by decreasing runtime gives
+    a longest-processing-time-first schedule.
+
+    Parameters
+    ----------
+    pool          : multiprocessing.Pool
+
+    function      : The function to run on each job.
+
+    jobs, memory  : list
+
+                    The jobs and their estimated peak memory.
+
+    workers       : int
+
+                    Maximum number of running jobs.
+
+    memory_budget : float
+
+                    Optional memory budget in bytes.
+    """
+
+    finished = queue.Queue()
+
+    running = 0
+    in_flight = 0.0
+    i = 0
+
+    while i < len(jobs) or running > 0 :
+
+        while i < len(jobs) and running < workers and (running == 0 or memory_budget is None
+                                                       or in_flight + memory[i] <= memory_budget) :
+
+            pool.apply_async(function, (jobs[i], ),
+                             callback = lambda result, m = memory[i] : finished.put((result, m, None)),
+                             error_callback = lambda error, m = memory[i] : finished.put((None, m, error)))
+
+            running += 1
+            in_flight += memory[i]
+            i += 1
+
+        result, m, error = finished.get()
+
+        if error is not None :
+            raise error
+
+        running -= 1
+        in_flight -= m
+
+        yield result
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+class CostMeter :
+
+    """
+    Context manager measuring the cost of the code inside it, e.g. for one user in build_chunk. If trace is False,
+    the runtime is measured in seconds. If trace is True, the peak memory allocated inside it is measured with
+    tracemalloc in peak instead, since the tracing distorts the runtime. The other result is None.
+    """
+
+    def __init__(self, trace = False) :
+
+        self.trace = trace
+        self.seconds = None
+        self.peak = None
+
+
+    def __enter__(self) :
+
+        if self.trace :
+            self.started_tracing = not tracemalloc.is_tracing()
+            if self.started_tracing :
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.base = tracemalloc.get_traced_memory()[0]
+
+        self.start = time.perf_counter()
+
+        return self
+
+
+    def __exit__(self, *exc_info) :
+
+        if self.trace :
+            self.peak = max(tracemalloc.get_traced_memory()[1] - self.base, 0)
+            if self.started_tracing :
+                tracemalloc.stop()
+        else :
+            self.seconds = time.perf_counter() - self.start
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
@@ -3,7 +3,8 @@ import numpy as np
 import pandas as pd
 
 from .invalidate_bins import invalid_timebins
-from .screen_measures import prepare_screen_measurement, screen_measures, merge_short_long
+from .heartbeat_bitmap import HeartbeatBitmap
+from .screen_measures import prepare_screen_measurement, session_measures
 
 
 #*****************************************************************************************************************
@@ -16,7 +17,10 @@ def screen_behaviour(screen,
                      timebin_len = 900, 
                      invalidate_cut = 1800, 
                      short_ses_len = 35,
-                     max_screen_ses = 7200) :
+                     max_screen_ses = 7200,
+                     session_sketches = None,
+                     presorted = False,
+                     session_cuts = None) :
     
     """
     Return a dataframe with the number of seconds and the number of times, the screen has been on in each timebin.
@@ -39,7 +43,7 @@ def screen_behaviour(screen,
   
                           This dataframe is used to construct the measures of the given user's screen usage.
     
-    invalidation_stamps : pandas.DataFrame
+    invalidation_stamps : pandas.DataFrame, list or HeartbeatBitmap
                     
                           A dataframe with one variable:
                           * timestamp: The epoch time when a signal was received from the phone.
@@ -48,6 +52,13 @@ def screen_behaviour(screen,
 
                           This dataframe is used to determine the timebins, where the phone is assumed to be off,
                           which means the bins should be invalidated.
+                          
+                          Alternatively a list of arrays of timestamps from several heartbeat sources of the user
+                          (e.g. sensor_time, wifi and location). Each array must already be sorted. The arrays are
+                          merged lazily during the gap detection, and they are never concatenated or sorted.
+
+                          Alternatively a HeartbeatBitmap with the user's heartbeat slots (see
+                          build_heartbeat_bitmap), which is built once for all timebin_len and invalidate_cut.
     
     timebin_len         : int
     
@@ -68,6 +79,28 @@ def screen_behaviour(screen,
                           Maximum number of seconds the screen can be on, before the given screen session
                           is considered unrealistically long and therefore invalidated.
     
+    session_sketches    : SessionSketches
+    
+                          Optional. If given, the lengths of the valid screen sessions are added to the
+                          per-user and per-semester quantile sketches, while the sessions are extracted.
+                          This gives descriptive statistics of the session lengths without keeping
+                          the full table of sessions.
+    
+    presorted           : bool
+    
+                          If True, the screen dataframe is assumed to be sorted by timestamp already (e.g. by
+                          ingest_events), and it is not sorted again. A twin variable from ingest_events is used
+                          instead of detecting the twins again.
+    
+    session_cuts        : list of int
+    
+                          Optional cut points of session length classes, e.g. [10, 35, 300, 1800]. If given,
+                          the short and long session measures are replaced by a screentime_ses_le_<cut> and a
+                          screencount_ses_le_<cut> variable for each cut (the sessions longer than the previous
+                          cut and at most cut seconds long) and a screentime_ses_gt_<last cut> and
+                          screencount_ses_gt_<last cut> variable for the longer sessions. The cuts must be
+                          positive and distinct.
+    
     Output
     ------
     A pandas.DataFrame with measures of screen usage for the given user. 
@@ -113,18 +146,25 @@ def screen_behaviour(screen,
     
     #Prepare the screen and the invalidation_stamps dataframe ----------------------
     screen_user = screen.loc[screen.index[0], 'user_idx']
-    invalidation_user = invalidation_stamps.loc[invalidation_stamps.index[0], 'user_idx']
-    assert (screen_user == invalidation_user)
-    
     screen = screen.drop('user_idx', axis = 1)
-    invalidation_stamps = invalidation_stamps.drop('user_idx', axis = 1)
     
-    screen = sort_by_timestamp(screen)
-    invalidation_stamps = sort_by_timestamp(invalidation_stamps)
+    if presorted :
+        screen = screen.reset_index(drop = True)
+    else :
+        screen = sort_by_timestamp(screen)
+    
+    if not isinstance(invalidation_stamps, (list, HeartbeatBitmap)) :
+        invalidation_user = invalidation_stamps.loc[invalidation_stamps.index[0], 'user_idx']
+        assert (screen_user == invalidation_user)
+        invalidation_stamps = invalidation_stamps.drop('user_idx', axis = 1)
+        invalidation_stamps = sort_by_timestamp(invalidation_stamps)
     #-------------------------------------------------------------------------------
     
     #Determine the invalid timebins
-    invalid_bins = invalid_timebins(invalidation_stamps, timebin_len, invalidate_cut)
+    if isinstance(invalidation_stamps, HeartbeatBitmap) :
+        invalid_bins = invalidation_stamps.invalid_bins(screen_user, timebin_len, invalidate_cut)
+    else :
+        invalid_bins = invalid_timebins(invalidation_stamps, timebin_len, invalidate_cut)
     
     #Invalidate screen observations
     screen = invalidate_off_bins(screen, invalid_bins, timebin_len)
@@ -134,12 +174,32 @@ def screen_behaviour(screen,
     #Prepare the screen dataframe for the screen_measure function
     screen = prepare_screen_measurement(screen, timebin_len, short_ses_len, max_screen_ses)
     
+    if session_sketches is not None :
+        session_sketches.update(screen_user, screen['timestamp'], screen['timediff'])
+    
     #Calculate the screen measurements
-    screen_mes_short_ses = screen_measures(screen, timebin_len, True)
-    screen_mes_long_ses = screen_measures(screen, timebin_len, False)
-    screen_mes_both = merge_short_long(screen_mes_short_ses, screen_mes_long_ses)
+    screen_mes_both = session_measures(screen, timebin_len, short_ses_len, session_cuts)
     #-------------------------------------------------------------------------------
     
+    return finalize_measures(screen_mes_both, invalid_bins, timebin_len, screen_user)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def finalize_measures(screen_mes_both, invalid_bins, timebin_len, screen_user) :
+    
+    """
+    Helper function for screen_behaviour
+    
+    Return the measures of all valid timebins in percent of the timebin, given the measures of the timebins
+    with sessions and the invalid timebins (both in the bin_id representation)
+    """
+    
+    invalid_bins = invalid_bins.copy()
+    
     #Change from the bin_id representation of timebins to the time-at-start representation 
     invalid_bins['timebin'] = invalid_bins['bin_id'] * timebin_len
     invalid_bins = invalid_bins.drop('bin_id', axis = 1)
@@ -153,8 +213,7 @@ def screen_behaviour(screen,
     #Add zeros in the valid timebins without positive measurements
     screen_mes_w_zeros = valid_bins.merge(screen_mes_both, on = 'timebin', how = 'left')
     
-    screen_mes_list = ['screentime', 'screentime_short_ses', 'screentime_long_ses',
-                       'screencount', 'screencount_short_ses', 'screencount_long_ses']
+    screen_mes_list = [c for c in screen_mes_both.columns if c != 'timebin']
     
     screen_mes_w_zeros.loc[np.isnan(screen_mes_w_zeros.screentime), screen_mes_list] = 0
     #--------------------------------------------------------------------------------------
@@ -167,9 +226,8 @@ def screen_behaviour(screen,
     return screen_mes_w_zeros.astype(int)
 
 
-#*****************************************************************************************************************
-#*****************************************************************************************************************
-#*****************************************************************************************************************
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
 
 
 def sort_by_timestamp(df) :
@@ -217,9 +275,15 @@ def invalidate_twins(screen) :
     Helper function for screen_behaviour
     
     Invalidate screen observations if the screen is turned on twice without being turned off in between
-    or vice versa
+    or vice versa. If the twins have already been detected during ingestion, the twin variable is used.
     """
-            
+    
+    if 'twin' in screen.columns :
+        
+        screen.loc[screen['twin'], 'timestamp'] = np.nan
+        
+        return screen.drop('twin', axis=1)
+    
     screen['twins_test'] = screen['screen_on'].diff()
     
     screen.loc[screen['twins_test']==0, 'timestamp'] = np.nan
@@ -12,7 +12,7 @@ def prepare_screen_measurement(screen, timebin_len, short_ses_len, max_screen_se
     """
     Helper function for screen_behaviour
     
-    Preprocess the screen data to make it ready for the screen_measures function
+    Preprocess the screen data to make it ready for the session_measures function
     """    
     
     screen['bin_id'] = screen['timestamp'] // timebin_len
@@ -40,154 +40,113 @@ def prepare_screen_measurement(screen, timebin_len, short_ses_len, max_screen_se
 #----------------------------------------------------------------------------------------------------------------------
 
 
-def screen_measures(screen, timebin_len, short_session) :
+def session_classes(short_ses_len, session_cuts = None) :
 
     """
     Helper function for screen_behaviour
-    
-    Calculate the screen usage measures for the given user from the user's screen-on-off data.
-    The screen measures are calculated for either short or long screen sessions only according to 
-    the value of the boolean parameter short_session.
-    """  
-    
-    screen = screen.loc[screen.short_session == short_session, :]
-    
-    if short_session : 
-        time_colname = 'screentime_short_ses'
-        count_colname = 'screencount_short_ses'
-        
-    else : 
-        time_colname = 'screentime_long_ses'
-        count_colname = 'screencount_long_ses'
-    
-    #simple observations which do not cross bin_id boundaries:
-    simple = screen.loc[screen.bin_id_diff == 0, :].copy()
-    
-    #nasty observations which do cross bin_id boundaries:
-    nasty = screen.loc[screen.bin_id_diff > 0, :].copy()
-    
-    something_simple = (len(simple) > 0)
-    something_nasty = (len(nasty) > 0)
-    
-    #screen measures for simple observations:
-    if something_simple :
-        
-        screen_mes_simple = simple[['bin_id','timediff']].groupby('bin_id', as_index = False).sum()
-        screen_mes_simple = screen_mes_simple.rename(columns = {'timediff' : 'screentime_simple'})
-        
-        simple['screencount_simple'] = 1
-        screencount_simple = simple[['bin_id', 'screencount_simple']].groupby('bin_id', as_index = False).count()
-        
-        screen_mes_simple = screen_mes_simple.merge(screencount_simple, on = 'bin_id', how = 'outer').fillna(0)
-        
-    #screen measures for nasty observations:
-    if something_nasty :
-        
-        nasty['bin_id_starttime'] = nasty['bin_id'] * timebin_len
-        nasty['time_last_bin_id'] = nasty['timestamp'] - nasty['bin_id_starttime']
-        
-        screen_mes_nasty = f2(nasty, timebin_len)
-    
-    #merge the measures for simple and nasty observations
-    if (something_simple and something_nasty) :    
-        screen_mes = screen_mes_simple.merge(screen_mes_nasty, on = 'bin_id', how = 'outer').fillna(0)
-        screen_mes[time_colname] = screen_mes['screentime_simple'] + screen_mes['screentime_nasty']
-        screen_mes[count_colname] = screen_mes['screencount_simple'] + screen_mes['screencount_nasty']
-    
-    elif (something_simple) :
-        screen_mes = screen_mes_simple.rename(columns = {'screentime_simple': time_colname,
-                                                         'screencount_simple': count_colname})
-        
-    elif (something_nasty) :
-        screen_mes = screen_mes_nasty.rename(columns = {'screentime_nasty': time_colname,
-                                                        'screencount_nasty': count_colname})
-        
-    else :
-        screen_mes = pd.DataFrame({'bin_id':[], time_colname:[], count_colname: []})
-   
-    screen_mes = screen_mes[['bin_id',time_colname, count_colname]]
-    
-    return screen_mes
 
+    Return the cut points and the names of the session length classes. Without session_cuts there are two
+    classes, short_ses and long_ses, split at short_ses_len. Otherwise there is a class ses_le_<cut> for each cut
+    (the sessions longer than the previous cut and at most cut seconds long) and a class ses_gt_<last cut>.
+    The cuts must be positive and distinct, since classes with the same name would overwrite each other.
+    """
 
-#----------------------------------------------------------------------------------------------------------------------
-#----------------------------------------------------------------------------------------------------------------------
+    if session_cuts is None :
+        return [short_ses_len], ['short_ses', 'long_ses']
 
+    cuts = sorted(session_cuts)
 
-def f2(nasty, timebin_len) :
-    
-    """Helper function for screentime"""
-    
-    screen_measures = []
-    
-    for i in range(len(nasty)) :
-        
-        r = nasty.iloc[i]
-        
-        these_measures = f1(int(r['bin_id']),
-                            int(r['bin_id_diff']),
-                            r['timediff'],
-                            r['time_last_bin_id'],
-                            timebin_len)
-        
-        screen_measures.append(these_measures)
-    
-    screen_measures = pd.concat(screen_measures, ignore_index = True)
-    
-    if any(screen_measures.duplicated(subset = 'bin_id')) : 
-        
-        screen_measures['screentime_nasty'] = screen_measures[['bin_id','screentime_nasty']]\
-                                              .groupby('bin_id').transform('sum')
-        
-        screen_measures['screencount_nasty'] = screen_measures[['bin_id', 'screencount_nasty']]\
-                                               .groupby('bin_id').transform('sum')
-        
-        screen_measures = screen_measures.drop_duplicates(subset = 'bin_id')
-    
-    return screen_measures
+    if len(cuts) == 0 :
+        raise ValueError('session_cuts must contain at least one cut point')
+    if cuts[0] <= 0 :
+        raise ValueError('The session cut points must be positive, got {}'.format(cuts[0]))
+    if len(set(cuts)) < len(cuts) :
+        raise ValueError('The session cut points must be distinct, got {}'.format(cuts))
+
+    return cuts, ['ses_le_{}'.format(c) for c in cuts] + ['ses_gt_{}'.format(cuts[-1])]
 
 
 #----------------------------------------------------------------------------------------------------------------------
 #----------------------------------------------------------------------------------------------------------------------
 
 
-def f1(bin_id, bin_id_diff, timediff, time_last_bin_id, bin_len) :
-    
-    """Helper function for f2"""
-    
-    p = range(bin_id - bin_id_diff, bin_id + 1)
-    
-    time_first_bin_id = [timediff - (bin_len * (bin_id_diff - 1)) - time_last_bin_id]
-    time_middle_bin_ids = ([bin_len] * (bin_id_diff - 1))
-    time_last_bin_id = [time_last_bin_id]
-    
-    counts = [1] + ( [0] * (len(p) - 1) )
-    
-    return pd.DataFrame({'bin_id' : p, 
-                         'screentime_nasty' : time_first_bin_id + time_middle_bin_ids + time_last_bin_id,
-                         'screencount_nasty' : counts})
+def measure_columns(short_ses_len, session_cuts = None) :
+
+    """
+    Helper function for screen_behaviour
+
+    Return the names of the measure variables in the order of the output of screen_behaviour
+    """
+
+    cuts, names = session_classes(short_ses_len, session_cuts)
+
+    columns = [c for name in names for c in ('screentime_' + name, 'screencount_' + name)]
+
+    return columns + ['screentime', 'screencount']
 
 
 #----------------------------------------------------------------------------------------------------------------------
 #----------------------------------------------------------------------------------------------------------------------
 
 
-def merge_short_long(short, long) :
+def session_measures(screen, timebin_len, short_ses_len, session_cuts = None) :
 
     """
     Helper function for screen_behaviour
     
-    Merge the screen measures for the short and long screen sessions into a single dataframe
-    """  
+    Calculate the screen time and screen count of each session length class in each timebin from the sessions
+    prepared by prepare_screen_measurement, together with the totals over the classes.
+    
+    Each session is expanded to the timebins it covers: the whole session, if it lies within one timebin, and
+    otherwise the part in the first timebin, a full timebin for each timebin in between and the part in the
+    last timebin. The session is counted in the timebin where it starts. The expanded sessions are summed
+    per timebin and class in one grouped pass, so more classes do not add more passes or merges.
+    """
+    
+    cuts, names = session_classes(short_ses_len, session_cuts)
+    
+    n_classes = len(names)
     
-    both = short.merge(long, on = 'bin_id', how = 'outer').fillna(0)
+    timediff = screen['timediff'].to_numpy(dtype = float)
+    end_bin = screen['bin_id'].to_numpy(dtype = np.int64)
+    bin_diff = screen['bin_id_diff'].to_numpy(dtype = np.int64)
+    timestamp = screen['timestamp'].to_numpy(dtype = float)
     
-    both['screentime'] = both['screentime_short_ses'] + both['screentime_long_ses']
+    session_class = np.searchsorted(cuts, timediff, side = 'left')
     
-    both['screencount'] = both['screencount_short_ses'] + both['screencount_long_ses']
+    #Time in the last and the first timebin of each session
+    time_last = np.where(bin_diff > 0, timestamp - end_bin * timebin_len, timediff)
+    time_first = timediff - timebin_len * (bin_diff - 1) - time_last
     
-    return both
+    #Expand each session to the timebins it covers
+    n_bins = bin_diff + 1
+    session = np.repeat(np.arange(len(screen)), n_bins)
+    position = np.arange(len(session)) - np.repeat(np.cumsum(n_bins) - n_bins, n_bins)
+    
+    bin_id = end_bin[session] - bin_diff[session] + position
+    time = np.where(position == bin_diff[session], time_last[session],
+                    np.where(position == 0, time_first[session], timebin_len))
+    count = (position == 0).astype(float)
+    
+    #Sum per timebin and class in one pass
+    bin_ids, bin_code = np.unique(bin_id, return_inverse = True)
+    cell = bin_code * n_classes + session_class[session]
+    
+    size = len(bin_ids) * n_classes
+    time_sums = np.bincount(cell, weights = time, minlength = size).reshape(-1, n_classes)
+    count_sums = np.bincount(cell, weights = count, minlength = size).reshape(-1, n_classes)
+    
+    screen_mes = pd.DataFrame({'bin_id': bin_ids})
+    
+    for j, name in enumerate(names) :
+        screen_mes['screentime_' + name] = time_sums[:, j]
+        screen_mes['screencount_' + name] = count_sums[:, j]
+    
+    screen_mes['screentime'] = time_sums.sum(axis = 1)
+    screen_mes['screencount'] = count_sums.sum(axis = 1)
+    
+    return screen_mes
 
 
 #----------------------------------------------------------------------------------------------------------------------
-#----------------------------------------------------------------------------------------------------------------------
\ No newline at end of file
+#----------------------------------------------------------------------------------------------------------------------
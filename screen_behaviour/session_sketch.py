@@ -0,0 +1,266 @@
+import numpy as np
+import pandas as pd
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+class SessionLengthSketch :
+
+    """
+    Fixed-memory quantile sketch and histogram of screen session lengths.
+
+    The quantile sketch counts the session lengths in logarithmically spaced buckets, so every quantile
+    is reported with a relative error of at most relative_accuracy compared to the exact order statistic
+    (the session length at rank floor(q * (n - 1)) of the sorted lengths). The histogram counts the session
+    lengths in linear buckets of hist_bin_len seconds. Both use a number of counters that is fixed by
+    max_length, and two sketches with the same parameters are merged by adding their counters.
+
+    Parameters
+    ----------
+    relative_accuracy : float
+
+                        Maximum relative error of the reported quantiles.
+
+    max_length        : int
+
+                        The longest session length that can be added. Should be max_screen_ses.
+
+    hist_bin_len      : int
+
+                        Number of seconds in each bucket of the histogram.
+    """
+
+    def __init__(self, relative_accuracy = 0.01, max_length = 7200, hist_bin_len = 5) :
+
+        self.relative_accuracy = relative_accuracy
+        self.max_length = max_length
+        self.hist_bin_len = hist_bin_len
+
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        n_buckets = int(np.ceil(np.log(max_length) / np.log(self.gamma))) + 1
+
+        self.counts = np.zeros(n_buckets, dtype = np.int64)
+        self.hist = np.zeros(int(max_length // hist_bin_len) + 1, dtype = np.int64)
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+
+    def add(self, lengths) :
+
+        """
+        Add an array of session lengths (in seconds) to the sketch
+        """
+
+        lengths = np.asarray(lengths, dtype = float)
+
+        if len(lengths) == 0 :
+            return self
+
+        if (lengths <= 0).any() or (lengths > self.max_length).any() :
+            raise ValueError('Session lengths must be in (0, max_length]')
+
+        self.counts += np.bincount(self.bucket(lengths), minlength = len(self.counts))
+        self.hist += np.bincount((lengths // self.hist_bin_len).astype(int), minlength = len(self.hist))
+        self.n += len(lengths)
+        self.min = min(self.min, lengths.min())
+        self.max = max(self.max, lengths.max())
+
+        return self
+
+
+    def merge(self, other) :
+
+        """
+        Add the counts of another sketch with the same parameters to this sketch
+        """
+
+        if ((self.relative_accuracy, self.max_length, self.hist_bin_len) !=
+            (other.relative_accuracy, other.max_length, other.hist_bin_len)) :
+            raise ValueError('Only sketches with the same parameters can be merged')
+
+        self.counts += other.counts
+        self.hist += other.hist
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        return self
+
+
+    def quantile(self, q) :
+
+        """
+        Return the estimated session length at the quantile(s) q. The estimate is within relative_accuracy
+        of the exact order statistic at rank floor(q * (n - 1)).
+        """
+
+        q = np.asarray(q, dtype = float)
+
+        if self.n == 0 :
+            return np.full(q.shape, np.nan)
+
+        ranks = np.floor(q * (self.n - 1)).astype(np.int64)
+        buckets = np.searchsorted(np.cumsum(self.counts), ranks, side = 'right')
+
+        estimates = 2 * self.gamma ** buckets / (self.gamma + 1)
+
+        #The exact minimum and maximum are known, so the estimates never have to lie outside them
+        return np.clip(estimates, self.min, self.max)
+
+
+    def histogram(self) :
+
+        """
+        Return a dataframe with the lower edge of each histogram bucket and the number of sessions in it
+        """
+
+        return pd.DataFrame({'length': np.arange(len(self.hist)) * self.hist_bin_len, 'count': self.hist})
+
+
+    def bucket(self, lengths) :
+
+        """
+        Helper function for add
+
+        Return the index of the logarithmic bucket of each session length
+        """
+
+        return np.maximum(np.ceil(np.log(lengths) / np.log(self.gamma)), 0).astype(int)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+class SessionSketches :
+
+    """
+    Collection of SessionLengthSketch objects per user and semester.
+
+    Pass an instance to screen_behaviour through the session_sketches parameter, and the lengths of the
+    valid screen sessions are added to the sketches while the sessions are extracted. Collections built
+    in different worker processes are combined with merge.
+
+    Parameters
+    ----------
+    semesters         : pandas.DataFrame
+
+                        A dataframe with three variables:
+                        * semester : Name of the semester.
+                        * start    : Epoch time of the start of the semester (inclusive).
+                        * end      : Epoch time of the end of the semester (exclusive).
+
+                        Each session is assigned to the semester of the time when the screen was turned off.
+                        Sessions outside all semesters are assigned to the semester None.
+                        If semesters is None, all sessions are assigned to the semester None.
+
+    relative_accuracy : float
+    max_length        : int
+    hist_bin_len      : int
+
+                        Parameters of the sketches, see SessionLengthSketch.
+    """
+
+    def __init__(self, semesters = None, relative_accuracy = 0.01, max_length = 7200, hist_bin_len = 5) :
+
+        self.semesters = semesters
+        self.sketch_params = {'relative_accuracy': relative_accuracy,
+                              'max_length': max_length,
+                              'hist_bin_len': hist_bin_len}
+        self.sketches = {}
+
+
+    def update(self, user_idx, timestamps, lengths) :
+
+        """
+        Add the session lengths of one user. timestamps are the times when the screen was turned off.
+        """
+
+        timestamps = np.asarray(timestamps)
+        lengths = np.asarray(lengths)
+
+        for semester, in_semester in self.semester_masks(timestamps) :
+            if in_semester.any() :
+                key = (user_idx, semester)
+                if key not in self.sketches :
+                    self.sketches[key] = SessionLengthSketch(**self.sketch_params)
+                self.sketches[key].add(lengths[in_semester])
+
+        return self
+
+
+    def merge(self, other) :
+
+        """
+        Add the sketches of another collection (e.g. from another worker) to this collection
+        """
+
+        for key, sketch in other.sketches.items() :
+            if key in self.sketches :
+                self.sketches[key].merge(sketch)
+            else :
+                self.sketches[key] = SessionLengthSketch(**self.sketch_params).merge(sketch)
+
+        return self
+
+
+    def summary(self, by_semester = True, quantiles = (0.25, 0.5, 0.75)) :
+
+        """
+        Return a dataframe with the number of sessions, the minimum, the quantiles and the maximum
+        of the session lengths for each user (and semester, if by_semester is True)
+        """
+
+        combined = {}
+        for (user_idx, semester), sketch in self.sketches.items() :
+            key = (user_idx, semester) if by_semester else (user_idx, )
+            if key not in combined :
+                combined[key] = SessionLengthSketch(**self.sketch_params)
+            combined[key].merge(sketch)
+
+        rows = []
+        for key, sketch in combined.items() :
+            row = dict(zip(['user_idx', 'semester'], key))
+            row.update({'n_sessions': sketch.n, 'min': sketch.min})
+            row.update({'q' + str(int(q * 100)): v for q, v in zip(quantiles, sketch.quantile(quantiles))})
+            row['max'] = sketch.max
+            rows.append(row)
+
+        summary = pd.DataFrame(rows)
+
+        if len(summary) > 0 :
+            summary = summary.sort_values(['user_idx', 'semester'] if by_semester else ['user_idx'])
+
+        return summary.reset_index(drop = True)
+
+
+    def semester_masks(self, timestamps) :
+
+        """
+        Helper function for update
+
+        Yield each semester name together with a boolean mask of the sessions in that semester
+        """
+
+        if self.semesters is None :
+            yield None, np.ones(len(timestamps), dtype = bool)
+            return
+
+        outside = np.ones(len(timestamps), dtype = bool)
+
+        for semester, start, end in self.semesters[['semester', 'start', 'end']].itertuples(index = False) :
+            in_semester = (start <= timestamps) & (timestamps < end)
+            outside &= ~in_semester
+            yield semester, in_semester
+
+        yield None, outside
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
@@ -0,0 +1,234 @@
+import heapq
+import json
+import os
+
+from .panel import build_panel
+from .partition import UserPartition
+from .checkpoint import concat_shards, manifest_path, params_fingerprint, to_json_value
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def plan_shards(screen,
+                invalidation_stamps,
+                n_shards,
+                shard_dir,
+                timebin_len = 900,
+                invalidate_cut = 1800,
+                short_ses_len = 35,
+                max_screen_ses = 7200,
+                session_cuts = None) :
+
+    """
+    Assign the users to n_shards shards balanced by their number of screen events, and write the plan to
+    shard_dir/plan.json.
+
+    The users are assigned with the longest-processing-time-first rule: the users are taken in order of decreasing
+    number of events, and each user is assigned to the shard with the fewest events so far. Each shard is then
+    built by its own node with run_shard against the shared shard_dir, and the shards are combined with
+    merge_shards. The plan also records the parameters of the build, so all nodes use the same parameters.
+
+    Output
+    ------
+    The plan as a dict with the parameters, the users of each shard and the number of events of each shard.
+    """
+
+    params = {'timebin_len': timebin_len,
+              'invalidate_cut': invalidate_cut,
+              'short_ses_len': short_ses_len,
+              'max_screen_ses': max_screen_ses}
+
+    if session_cuts is not None :
+        params['session_cuts'] = list(session_cuts)
+
+    if n_shards < 1 :
+        raise ValueError('n_shards must be at least 1, got {}'.format(n_shards))
+
+    partition = UserPartition({'screen': screen, 'invalidation': invalidation_stamps})
+
+    present = partition.present()
+    users = partition.users[present]
+    events = partition.counts('screen')[present]
+
+    loads = [(0, k) for k in range(n_shards)]
+    shards = [[] for k in range(n_shards)]
+    shard_events = [0] * n_shards
+
+    for i in sorted(range(len(users)), key = lambda i : -events[i]) :
+        load, k = heapq.heappop(loads)
+        shards[k].append(to_json_value(users[i]))
+        shard_events[k] += int(events[i])
+        heapq.heappush(loads, (load + int(events[i]), k))
+
+    plan = {'n_shards': n_shards,
+            'params': params,
+            'fingerprint': params_fingerprint(params),
+            'shards': [sorted(s) for s in shards],
+            'events': shard_events}
+
+    os.makedirs(shard_dir, exist_ok = True)
+
+    tmp_path = plan_path(shard_dir) + '.tmp'
+    with open(tmp_path, 'w') as f :
+        json.dump(plan, f)
+    os.replace(tmp_path, plan_path(shard_dir))
+
+    return plan
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def run_shard(screen, invalidation_stamps, shard_dir, shard, n_shards = None, **build_args) :
+
+    """
+    Build the panel of the users of one shard of the plan in shard_dir.
+
+    The users' results are checkpointed in shard_dir/shard-<shard>, so an interrupted shard can be run again
+    and continues where it stopped. The results are only concatenated by merge_shards. The parameters of the
+    build are taken from the plan.
+
+    Parameters
+    ----------
+    screen, invalidation_stamps : pandas.DataFrame
+
+                                  The inputs of all users (or at least of the users of the shard).
+
+    shard_dir                   : str
+
+                                  The shared directory with the plan.
+
+    shard                       : int
+
+                                  The number of the shard, from 0 to n_shards - 1.
+
+    n_shards                    : int
+
+                                  Optional. If given, it must match the number of shards of the plan.
+
+    build_args                  : Further arguments of build_panel, e.g. workers and progress.
+    """
+
+    plan = read_plan(shard_dir)
+
+    if n_shards is not None and n_shards != plan['n_shards'] :
+        raise ValueError('The plan in {} has {} shards, not {}'.format(shard_dir, plan['n_shards'], n_shards))
+
+    if not 0 <= shard < plan['n_shards'] :
+        raise ValueError('Shard {} does not exist in a plan with {} shards'.format(shard, plan['n_shards']))
+
+    users = plan['shards'][shard]
+
+    screen = screen[screen['user_idx'].isin(users)]
+    invalidation_stamps = invalidation_stamps[invalidation_stamps['user_idx'].isin(users)]
+
+    build_panel(screen,
+                invalidation_stamps,
+                checkpoint_dir = shard_checkpoint_dir(shard_dir, shard),
+                resume = True,
+                collect = False,
+                **plan['params'],
+                **build_args)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def merge_shards(shard_dir, output = None) :
+
+    """
+    Check that all shards of the plan in shard_dir are complete, and concatenate the results in user order.
+
+    A shard is complete, when its checkpoint has been built with the parameters of the plan and all the users of
+    the shard are completed. An incomplete shard raises a ValueError naming the shards to run again.
+
+    If output is None, the panel is returned. Otherwise it is written to output (see concat_shards).
+    """
+
+    plan = read_plan(shard_dir)
+
+    incomplete = []
+    user_dirs = {}
+
+    for shard, users in enumerate(plan['shards']) :
+
+        checkpoint_dir = shard_checkpoint_dir(shard_dir, shard)
+
+        completed = set()
+        if os.path.exists(manifest_path(checkpoint_dir)) :
+            with open(manifest_path(checkpoint_dir)) as f :
+                manifest = json.load(f)
+            params = {k : v for k, v in manifest['params'].items() if k != 'session_sketches'}
+            if params_fingerprint(params) == plan['fingerprint'] :
+                completed = set(manifest['completed'])
+
+        missing = [u for u in users if u not in completed]
+
+        if missing :
+            incomplete.append('{} ({} of {} users missing)'.format(shard, len(missing), len(users)))
+
+        user_dirs.update({u : checkpoint_dir for u in users})
+
+    if incomplete :
+        raise ValueError('Incomplete shards in {}: {}'.format(shard_dir, ', '.join(incomplete)))
+
+    return concat_shards(user_dirs, sorted(user_dirs), output)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def read_plan(shard_dir) :
+
+    """
+    Helper function for run_shard and merge_shards
+
+    Return the plan in shard_dir
+    """
+
+    with open(plan_path(shard_dir)) as f :
+        return json.load(f)
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def plan_path(shard_dir) :
+
+    """
+    Helper function for the sharding functions
+
+    Return the path of the plan in shard_dir
+    """
+
+    return os.path.join(shard_dir, 'plan.json')
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def shard_checkpoint_dir(shard_dir, shard) :
+
+    """
+    Helper function for run_shard and merge_shards
+
+    Return the checkpoint directory of a shard
+    """
+
+    return os.path.join(shard_dir, 'shard-{}'.format(shard))
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
@@ -0,0 +1,227 @@
+from datetime import datetime as dt
+from multiprocessing import Pool, shared_memory
+import numpy as np
+import pandas as pd
+
+from .screen_behaviour import screen_behaviour
+from .screen_measures import measure_columns
+from .panel import ProgressReporter
+from .partition import UserPartition
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def build_panel_shared(screen,
+                       invalidation_stamps,
+                       timebin_len = 900,
+                       invalidate_cut = 1800,
+                       short_ses_len = 35,
+                       max_screen_ses = 7200,
+                       workers = 2,
+                       chunk_size = 1,
+                       progress = False,
+                       session_cuts = None) :
+
+    """
+    Return the same panel as build_panel, but hand the data to the worker processes through shared memory.
+
+    The screen events and the heartbeat stamps are sorted by user and timestamp once in a UserPartition, and
+    their timestamp and screen_on arrays are put into multiprocessing.shared_memory together with the offsets
+    of each user.
+    The output is preallocated in shared memory with room for the largest possible number of valid timebins
+    of each user. The workers read zero-copy views of a user's events, write the measures straight into the
+    output buffers and only send the user's position and number of rows back, so no dataframes are pickled.
+
+    The parameters are the same as for build_panel. Checkpointing and session sketches are not available
+    in this mode.
+    """
+
+    params = {'timebin_len': timebin_len,
+              'invalidate_cut': invalidate_cut,
+              'short_ses_len': short_ses_len,
+              'max_screen_ses': max_screen_ses,
+              'session_cuts': session_cuts}
+
+    columns = measure_columns(short_ses_len, session_cuts)
+
+    partition = UserPartition({'screen': screen, 'invalidation': invalidation_stamps})
+
+    present = partition.present()
+    users = partition.users[present]
+
+    screen_start = partition.starts['screen'][present]
+    screen_end = partition.ends['screen'][present]
+    invalidation_start = partition.starts['invalidation'][present]
+    invalidation_end = partition.ends['invalidation'][present]
+
+    capacity = output_capacity(invalidation_end - invalidation_start, timebin_len, invalidate_cut)
+    output_start = np.concatenate([[0], np.cumsum(capacity)[:-1]]).astype(np.int64)
+
+    arrays = {'timestamp': partition.column('screen', 'timestamp', np.int64),
+              'screen_on': partition.column('screen', 'screen_on', np.int8),
+              'heartbeat': partition.column('invalidation', 'timestamp', np.int64),
+              'out_timebin': np.zeros(int(capacity.sum()), dtype = np.int64),
+              'out_measures': np.zeros((int(capacity.sum()), len(columns)), dtype = np.int64)}
+
+    blocks = {}
+
+    try :
+
+        layout = {}
+        for name, array in arrays.items() :
+            blocks[name] = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+            layout[name] = (blocks[name].name, array.shape, array.dtype.str)
+            shared_view(blocks[name], layout[name])[...] = array
+
+        del arrays
+
+        tasks = [(i, users[i], screen_start[i], screen_end[i], invalidation_start[i], invalidation_end[i],
+                  output_start[i], capacity[i]) for i in range(len(users))]
+
+        reporter = None
+        if progress :
+            reporter = ProgressReporter(len(users), int((screen_end - screen_start).sum()))
+
+        n_rows = np.zeros(len(users), dtype = np.int64)
+
+        with Pool(workers, initializer = attach_shared, initargs = (layout, params)) as pool :
+            for i, rows in pool.imap_unordered(build_user_shared, tasks, chunksize = chunk_size) :
+                n_rows[i] = rows
+                if reporter is not None :
+                    reporter.update(1, int(screen_end[i] - screen_start[i]))
+
+        if reporter is not None :
+            reporter.finish()
+
+        out_timebin = shared_view(blocks['out_timebin'], layout['out_timebin'])
+        out_measures = shared_view(blocks['out_measures'], layout['out_measures'])
+
+        rows = np.concatenate([np.arange(output_start[i], output_start[i] + n_rows[i]) for i in range(len(users))]
+                              + [np.zeros(0, dtype = np.int64)])
+
+        panel = pd.DataFrame(out_measures[rows], columns = columns)
+        panel.insert(0, 'timebin', out_timebin[rows])
+        panel['user_idx'] = np.repeat(users, n_rows)
+
+        #The views must be released before the shared memory blocks can be closed
+        del out_timebin, out_measures
+
+    finally :
+
+        for block in blocks.values() :
+            block.close()
+            block.unlink()
+
+    return panel
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+_worker = {}
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def attach_shared(layout, params) :
+
+    """
+    Helper function for build_panel_shared
+
+    Attach a worker process to the shared memory blocks
+    """
+
+    _worker['blocks'] = {name : shared_memory.SharedMemory(name = block_name)
+                         for name, (block_name, shape, dtype) in layout.items()}
+    _worker['views'] = {name : shared_view(_worker['blocks'][name], layout[name]) for name in layout}
+    _worker['params'] = params
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def build_user_shared(task) :
+
+    """
+    Helper function for build_panel_shared
+
+    Run screen_behaviour for one user on zero-copy views of the shared arrays, and write the measures
+    into the user's part of the shared output buffers. Return the user's position and number of rows.
+    """
+
+    i, user, s_start, s_end, h_start, h_end, o_start, capacity = task
+
+    views = _worker['views']
+
+    screen = pd.DataFrame({'timestamp': views['timestamp'][s_start : s_end],
+                           'screen_on': views['screen_on'][s_start : s_end]})
+    screen['user_idx'] = user
+
+    #The heartbeat view is already sorted, so it is passed as a single heartbeat source
+    measures = screen_behaviour(screen, [views['heartbeat'][h_start : h_end]], **_worker['params'])
+
+    rows = len(measures)
+
+    if rows > capacity :
+        raise RuntimeError('User {} has {} valid timebins, but only room for {}'.format(user, rows, capacity))
+
+    views['out_timebin'][o_start : o_start + rows] = measures['timebin'].to_numpy()
+    views['out_measures'][o_start : o_start + rows] = measures.drop(['timebin', 'user_idx'], axis = 1).to_numpy()
+
+    return i, rows
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def shared_view(block, block_layout) :
+
+    """
+    Helper function for build_panel_shared and attach_shared
+
+    Return a numpy array backed by a shared memory block
+    """
+
+    block_name, shape, dtype = block_layout
+
+    return np.ndarray(shape, np.dtype(dtype), buffer = block.buf)
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def output_capacity(n_heartbeats, timebin_len, invalidate_cut) :
+
+    """
+    Helper function for build_panel_shared
+
+    Return the largest possible number of valid timebins of each user.
+
+    Every timebin of the experiment lies between two consecutive heartbeat stamps (including the boundary stamps).
+    If the stamps are more than invalidate_cut apart, all the timebins between them are invalid, and otherwise
+    there are at most invalidate_cut // timebin_len + 2 timebins between them.
+    """
+
+    first_time = int((dt(year = 2013, month = 9, day=1) - dt(year=1970, month=1, day=1)).days * (24 * 60 * 60))
+
+    delta = ((dt(year = 2015, month = 8,day=31, hour=23, minute=59, second=59) - dt(year=1970, month=1, day=1)))
+    last_time = int(delta.days * 24 * 60 * 60 + delta.seconds)
+
+    n_bins = last_time // timebin_len - first_time // timebin_len + 1
+
+    return np.minimum((n_heartbeats + 1) * (invalidate_cut // timebin_len + 2), n_bins).astype(np.int64)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
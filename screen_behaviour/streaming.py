@@ -0,0 +1,378 @@
+from collections import deque
+from datetime import datetime as dt
+import numpy as np
+import pandas as pd
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+MEASURE_COLUMNS = ['screentime_short_ses', 'screencount_short_ses', 'screentime_long_ses', 'screencount_long_ses',
+                   'screentime', 'screencount']
+
+#Bound of a stream before its first event, before any possible timestamp. It is an integer, so the frontiers
+#derived from it stay integers and nothing is emitted from a stream that has not started yet.
+NO_BOUND = -2 ** 62
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+class StreamingScreenAggregator :
+
+    """
+    Streaming version of screen_behaviour for one user.
+
+    The aggregator consumes screen on/off events and heartbeat stamps one at a time or in micro-batches, and emits
+    each timebin with the same measures as screen_behaviour, as soon as the timebin is final: when no later event
+    can change neither the validity of the timebin nor its measures. Replaying a user's history through the
+    aggregator and calling flush at the end gives the same rows as screen_behaviour.
+
+    Both streams must arrive in timestamp order (see ReorderBuffer for near-sorted streams), but the two streams
+    may lag each other. The watermark is a promise that no event of either stream older than it will arrive.
+    A timebin after the last heartbeat can only be finalized, once the watermark is more than invalidate_cut
+    past the last heartbeat, since the phone is then known to have been off.
+
+    The state is small: the last heartbeat, the previous screen event (the open session), the screen events
+    waiting for the validity of their timebin to become known, the heartbeat gaps that may still be needed,
+    and the partial sums of the timebins that are not yet emitted.
+
+    Parameters
+    ----------
+    user_idx, timebin_len, invalidate_cut, short_ses_len, max_screen_ses
+
+        The same as for screen_behaviour. timebin_len must divide the number of seconds from the beginning
+        of epoch time to the beginning of the experiment.
+    """
+
+    def __init__(self, user_idx, timebin_len = 900, invalidate_cut = 1800, short_ses_len = 35, max_screen_ses = 7200) :
+
+        self.user_idx = user_idx
+        self.timebin_len = timebin_len
+        self.invalidate_cut = invalidate_cut
+        self.short_ses_len = short_ses_len
+        self.max_screen_ses = max_screen_ses
+
+        first_time = int((dt(year = 2013, month = 9, day=1) - dt(year=1970, month=1, day=1)).days * (24 * 60 * 60))
+        delta = ((dt(year = 2015, month = 8,day=31, hour=23, minute=59, second=59) - dt(year=1970, month=1, day=1)))
+        self.last_time = int(delta.days * 24 * 60 * 60 + delta.seconds)
+
+        self.first_bin = first_time // timebin_len
+        self.last_bin = self.last_time // timebin_len
+
+        #Heartbeats: the boundary stamp at the beginning of the experiment acts as the first heartbeat
+        self.last_heartbeat = first_time
+        self.heartbeat_bound = NO_BOUND
+        self.gaps = deque()
+
+        #Screen events
+        self.screen_bound = NO_BOUND
+        self.pending = deque()
+        self.prev_screen_on = None
+        self.prev_valid_timestamp = None
+        self.event_bin = NO_BOUND
+
+        self.watermark = NO_BOUND
+        self.finished = False
+
+        #Partial sums of the timebins: bin_id -> [screentime_short, screencount_short, screentime_long, screencount_long]
+        self.open_bins = {}
+        self.next_bin = self.first_bin
+
+
+    #-------------------------------------------------------------------------------------------------------------
+
+
+    def add_heartbeat(self, timestamp) :
+
+        """
+        Add a heartbeat stamp. The stamps must arrive in timestamp order.
+        """
+
+        timestamp = int(timestamp)
+
+        if timestamp < self.heartbeat_bound :
+            raise ValueError('Heartbeat stamps must arrive in timestamp order')
+
+        self.heartbeat_pair(timestamp)
+        self.heartbeat_bound = timestamp
+
+
+    def add_screen_event(self, timestamp, screen_on) :
+
+        """
+        Add a screen event. The events must arrive in timestamp order.
+        """
+
+        if timestamp < self.screen_bound :
+            raise ValueError('Screen events must arrive in timestamp order')
+
+        self.pending.append((timestamp, screen_on))
+        self.screen_bound = timestamp
+
+
+    def advance_watermark(self, watermark) :
+
+        """
+        Promise that no event of either stream with a timestamp before watermark will arrive. The watermark is
+        rounded down to whole seconds, so e.g. time.time() can be passed.
+        """
+
+        self.watermark = max(self.watermark, int(np.floor(watermark)))
+
+
+    def update(self, screen = None, heartbeats = None, watermark = None) :
+
+        """
+        Add a micro-batch and return the timebins finalized by it.
+
+        Parameters
+        ----------
+        screen     : pandas.DataFrame with the variables timestamp and screen_on in timestamp order.
+        heartbeats : array-like of heartbeat timestamps in timestamp order.
+        watermark  : Optional new watermark.
+
+        Output
+        ------
+        A pandas.DataFrame with the finalized timebins in the format of screen_behaviour.
+        """
+
+        if heartbeats is not None :
+            for timestamp in np.asarray(heartbeats) :
+                self.add_heartbeat(timestamp)
+
+        if screen is not None :
+            for timestamp, screen_on in zip(screen['timestamp'].to_numpy(), screen['screen_on'].to_numpy()) :
+                self.add_screen_event(timestamp, screen_on)
+
+        if watermark is not None :
+            self.advance_watermark(watermark)
+
+        return self.emit()
+
+
+    def flush(self) :
+
+        """
+        End both streams and return all the remaining timebins
+        """
+
+        #The boundary stamp at the end of the experiment acts as the last heartbeat
+        self.heartbeat_pair(self.last_time)
+        self.finished = True
+
+        return self.emit()
+
+
+    def heartbeat_pair(self, timestamp) :
+
+        """
+        Helper function for add_heartbeat and flush
+
+        Record the timebins from the last heartbeat to timestamp as invalid, if they are more than invalidate_cut
+        apart (see invalid_bins_id)
+        """
+
+        if timestamp - self.last_heartbeat > self.invalidate_cut :
+            self.gaps.append((self.last_heartbeat // self.timebin_len, timestamp // self.timebin_len))
+
+        self.last_heartbeat = timestamp
+
+
+    #-------------------------------------------------------------------------------------------------------------
+
+
+    def emit(self) :
+
+        """
+        Process the screen events in the timebins with known validity, and return the finalized timebins
+        """
+
+        validity_frontier = self.validity_frontier()
+
+        while self.pending and self.pending[0][0] // self.timebin_len < validity_frontier :
+            self.process_event(*self.pending.popleft())
+
+        frontier = min(validity_frontier, self.emission_frontier(), self.last_bin + 1)
+
+        timebins = []
+        measures = []
+
+        for bin_id in range(self.next_bin, frontier) :
+            sums = self.open_bins.pop(bin_id, None)
+            if not self.bin_invalid(bin_id) :
+                timebins.append(bin_id * self.timebin_len)
+                measures.append(sums if sums is not None else [0, 0, 0, 0])
+
+        self.next_bin = max(self.next_bin, frontier)
+
+        #Forget the partial sums and the heartbeat gaps, which can no longer be needed
+        for bin_id in [b for b in self.open_bins if b < self.next_bin] :
+            del self.open_bins[bin_id]
+
+        while self.gaps and self.gaps[0][1] < min(self.next_bin, self.event_bin) :
+            self.gaps.popleft()
+
+        return self.measures_frame(timebins, measures)
+
+
+    def validity_frontier(self) :
+
+        """
+        Helper function for emit
+
+        Return the first bin_id whose validity may still change. Without heartbeats and watermark, the gap from
+        the beginning of the experiment to the first heartbeat is not known, so no timebin is known.
+        """
+
+        if self.finished :
+            return self.last_bin + 1
+
+        bound = max(self.watermark, self.heartbeat_bound)
+
+        #The next heartbeat will be more than invalidate_cut after the last one, so the phone is known to be off
+        if bound - self.last_heartbeat > self.invalidate_cut :
+            return bound // self.timebin_len + 1
+
+        return min(self.last_heartbeat, bound) // self.timebin_len
+
+
+    def emission_frontier(self) :
+
+        """
+        Helper function for emit
+
+        Return the first bin_id whose measures may still change. Without screen events and watermark, any
+        timebin may still get screen events, so no timebin is final.
+        """
+
+        if self.finished :
+            return self.last_bin + 1
+
+        frontier = max(self.watermark, self.screen_bound) // self.timebin_len
+
+        #The open session can still end and add screen time from the bin where it started
+        if self.prev_screen_on == 1 and self.prev_valid_timestamp is not None :
+            next_off = self.pending[0][0] if self.pending else max(self.watermark, self.screen_bound)
+            if next_off - self.prev_valid_timestamp <= self.max_screen_ses :
+                frontier = min(frontier, self.prev_valid_timestamp // self.timebin_len)
+
+        return frontier
+
+
+    def bin_invalid(self, bin_id) :
+
+        """
+        Helper function for emit and process_event
+
+        Return True if the phone is assumed to be off in the timebin. The validity must be known.
+        """
+
+        for lo, hi in self.gaps :
+            if lo > bin_id :
+                break
+            if bin_id <= hi :
+                return True
+
+        bound = max(self.watermark, self.heartbeat_bound)
+
+        if not self.finished and bound - self.last_heartbeat > self.invalidate_cut :
+            return self.last_heartbeat // self.timebin_len <= bin_id
+
+        return False
+
+
+    def process_event(self, timestamp, screen_on) :
+
+        """
+        Helper function for emit
+
+        Invalidate a screen event like invalidate_off_bins and invalidate_twins, and add the session it ends,
+        if it is a valid session (see prepare_screen_measurement)
+        """
+
+        self.event_bin = timestamp // self.timebin_len
+
+        twin = (self.prev_screen_on is not None) and (screen_on == self.prev_screen_on)
+        valid = not twin and not self.bin_invalid(self.event_bin)
+
+        if screen_on == 0 and valid and self.prev_valid_timestamp is not None :
+            timediff = timestamp - self.prev_valid_timestamp
+            if 0 < timediff <= self.max_screen_ses :
+                self.add_session(self.prev_valid_timestamp, timestamp, timediff)
+
+        self.prev_screen_on = screen_on
+        self.prev_valid_timestamp = timestamp if valid else None
+
+
+    def add_session(self, start, end, timediff) :
+
+        """
+        Helper function for process_event
+
+        Add the screen time and count of a session to the partial sums of its timebins (see session_measures)
+        """
+
+        offset = 0 if timediff <= self.short_ses_len else 2
+
+        start_bin = start // self.timebin_len
+        end_bin = end // self.timebin_len
+
+        if start_bin == end_bin :
+            self.bin_sums(end_bin)[offset] += timediff
+            self.bin_sums(end_bin)[offset + 1] += 1
+            return
+
+        time_last_bin = end - end_bin * self.timebin_len
+        time_first_bin = timediff - self.timebin_len * (end_bin - start_bin - 1) - time_last_bin
+
+        self.bin_sums(start_bin)[offset] += time_first_bin
+        self.bin_sums(start_bin)[offset + 1] += 1
+
+        for bin_id in range(start_bin + 1, end_bin) :
+            self.bin_sums(bin_id)[offset] += self.timebin_len
+
+        self.bin_sums(end_bin)[offset] += time_last_bin
+
+
+    def bin_sums(self, bin_id) :
+
+        """
+        Helper function for add_session
+
+        Return the partial sums of a timebin
+        """
+
+        if bin_id not in self.open_bins :
+            self.open_bins[bin_id] = [0, 0, 0, 0]
+
+        return self.open_bins[bin_id]
+
+
+    def measures_frame(self, timebins, measures) :
+
+        """
+        Helper function for emit
+
+        Return the finalized timebins as a dataframe in the format of screen_behaviour
+        """
+
+        sums = np.array(measures, dtype = float).reshape(-1, 4)
+
+        values = np.column_stack([sums, sums[:, 0] + sums[:, 2], sums[:, 1] + sums[:, 3]])
+        values = values / self.timebin_len * 100
+
+        frame = pd.DataFrame(values, columns = MEASURE_COLUMNS)
+        frame.insert(0, 'timebin', np.array(timebins, dtype = np.int64))
+        frame['user_idx'] = self.user_idx
+
+        return frame.astype(int)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
@@ -0,0 +1,251 @@
+from datetime import datetime as dt
+import heapq
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+
+from .invalidate_bins import invalid_timestamps, invalid_bins_frame
+from .heartbeat_bitmap import HeartbeatBitmap
+from .screen_measures import prepare_screen_measurement, session_measures
+from .screen_behaviour import sort_by_timestamp, invalidate_off_bins, invalidate_twins, finalize_measures
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def screen_behaviour_windowed(screen,
+                              invalidation_stamps,
+                              timebin_len = 900,
+                              invalidate_cut = 1800,
+                              short_ses_len = 35,
+                              max_screen_ses = 7200,
+                              max_window_events = 200000,
+                              workers = 1,
+                              session_sketches = None,
+                              presorted = False,
+                              session_cuts = None) :
+
+    """
+    Return the same dataframe as screen_behaviour, but split the user's timeline into time windows, which are
+    processed in parallel. This caps the runtime of a single task for users with millions of screen events.
+
+    The windows start at timebin boundaries and are chosen, so that each window has at most about
+    max_window_events screen events. The windows are processed in two phases with a small boundary exchange:
+
+    1. The heartbeat gaps of each window are found with the last heartbeat stamp before the window as the left
+       neighbour, so a gap crossing a window edge is found exactly once. The invalid timebins are the union of
+       the invalid timebins of all windows.
+    2. The screen events of each window are invalidated and turned into sessions with the two events before
+       the window as context: the event before the window is the start of a session crossing the window edge,
+       and the event before that decides whether it is a twin. The sessions ending in the context events
+       belong to the previous window and are dropped. The measures of the windows are summed per timebin.
+
+    Parameters
+    ----------
+    screen, invalidation_stamps, timebin_len, invalidate_cut, short_ses_len, max_screen_ses,
+    session_sketches, presorted, session_cuts
+
+                        The same as for screen_behaviour.
+
+    max_window_events : int
+
+                        Maximum number of screen events in each window.
+
+    workers           : int
+
+                        Number of worker processes. With 1 worker, the windows are processed in this process.
+
+    Output
+    ------
+    The same pandas.DataFrame as screen_behaviour.
+    """
+
+    params = {'timebin_len': timebin_len,
+              'invalidate_cut': invalidate_cut,
+              'short_ses_len': short_ses_len,
+              'max_screen_ses': max_screen_ses,
+              'session_cuts': session_cuts}
+
+    screen_user = screen.loc[screen.index[0], 'user_idx']
+    screen = screen.drop('user_idx', axis = 1)
+    screen = screen.reset_index(drop = True) if presorted else sort_by_timestamp(screen)
+
+    if isinstance(invalidation_stamps, HeartbeatBitmap) :
+        heartbeats = invalidation_stamps.stamps(screen_user)
+    elif isinstance(invalidation_stamps, list) :
+        heartbeats = np.fromiter(heapq.merge(*invalidation_stamps), dtype = np.int64)
+    else :
+        heartbeats = np.sort(invalidation_stamps['timestamp'].to_numpy(dtype = np.int64), kind = 'mergesort')
+
+    timestamps = screen['timestamp'].to_numpy()
+    edges = window_edges(timestamps, timebin_len, max_window_events)
+
+    gap_tasks = heartbeat_windows(heartbeats, edges, params)
+
+    screen_starts = np.concatenate([[0], np.searchsorted(timestamps, edges, side = 'left')])
+    screen_ends = np.concatenate([screen_starts[1:], [len(screen)]])
+
+    pool = Pool(workers) if workers > 1 else None
+
+    try :
+
+        window_bins = pool.map(window_invalid_bins, gap_tasks) if pool is not None else map(window_invalid_bins,
+                                                                                               gap_tasks)
+        invalid_bins = pd.concat(list(window_bins), ignore_index = True).drop_duplicates()
+
+        screen_tasks = [(screen_window(screen, start, end), invalid_bins, params, session_sketches is not None)
+                        for start, end in zip(screen_starts, screen_ends)]
+
+        results = pool.map(window_measures, screen_tasks) if pool is not None else map(window_measures,
+                                                                                        screen_tasks)
+        results = list(results)
+
+    finally :
+
+        if pool is not None :
+            pool.close()
+            pool.join()
+
+    if session_sketches is not None :
+        sessions = pd.concat([sessions for (measures, sessions) in results], ignore_index = True)
+        session_sketches.update(screen_user, sessions['timestamp'], sessions['timediff'])
+
+    screen_mes_both = pd.concat([measures for (measures, sessions) in results], ignore_index = True)
+    screen_mes_both = screen_mes_both.groupby('bin_id', as_index = False).sum()
+
+    return finalize_measures(screen_mes_both, invalid_bins, timebin_len, screen_user)
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+def window_edges(timestamps, timebin_len, max_window_events) :
+
+    """
+    Helper function for screen_behaviour_windowed
+
+    Return the start times of all windows but the first. The sorted timestamps are split into windows with equal
+    numbers of events, and the edges are moved back to the start of their timebins. Every window contains at least
+    one event.
+    """
+
+    n_windows = max(1, -(-len(timestamps) // max_window_events))
+
+    cuts = timestamps[(np.arange(1, n_windows) * len(timestamps)) // n_windows]
+    edges = np.unique(cuts // timebin_len * timebin_len).astype(np.int64)
+
+    return edges[edges > timestamps[0]] if len(timestamps) > 0 else edges
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def heartbeat_windows(heartbeats, edges, params) :
+
+    """
+    Helper function for screen_behaviour_windowed
+
+    Return a (stamps, params) task for each window with the heartbeat stamps of the window after its left
+    neighbour: the first_time boundary stamp for the first window and otherwise the last stamp before the window.
+    The last_time boundary stamp is added to the last window. Each pair of consecutive stamps of the whole
+    timeline is then a pair of consecutive stamps in exactly one window.
+    """
+
+    first_time = int((dt(year = 2013, month = 9, day=1) - dt(year=1970, month=1, day=1)).days * (24 * 60 * 60))
+
+    delta = ((dt(year = 2015, month = 8,day=31, hour=23, minute=59, second=59) - dt(year=1970, month=1, day=1)))
+    last_time = int(delta.days * 24 * 60 * 60 + delta.seconds)
+
+    bounds = np.concatenate([[0], np.searchsorted(heartbeats, edges, side = 'left'), [len(heartbeats)]])
+
+    tasks = []
+
+    for k in range(len(bounds) - 1) :
+
+        start, end = bounds[k], bounds[k + 1]
+
+        left = [first_time] if start == 0 else [heartbeats[start - 1]]
+        right = [last_time] if k == len(bounds) - 2 else []
+
+        tasks.append((np.concatenate([left, heartbeats[start : end], right]).astype(np.int64), params))
+
+    return tasks
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def window_invalid_bins(task) :
+
+    """
+    Helper function for screen_behaviour_windowed
+
+    Return the invalid timebins of the heartbeat gaps of one window (see invalid_timebins)
+    """
+
+    stamps, params = task
+
+    invalid_stamps = invalid_timestamps(pd.DataFrame({'timestamp': stamps}), params['invalidate_cut'])
+
+    return invalid_bins_frame(invalid_stamps, params['timebin_len'])
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def screen_window(screen, start, end) :
+
+    """
+    Helper function for screen_behaviour_windowed
+
+    Return the screen events of a window with up to two events before the window, marked as context
+    """
+
+    context_start = max(start - 2, 0)
+
+    window = screen.iloc[context_start : end].reset_index(drop = True)
+    window['context'] = np.arange(len(window)) < start - context_start
+
+    return window
+
+
+#-----------------------------------------------------------------------------------------------------------------
+#-----------------------------------------------------------------------------------------------------------------
+
+
+def window_measures(task) :
+
+    """
+    Helper function for screen_behaviour_windowed
+
+    Return the measures of the sessions ending in one window (in the bin_id representation), and the timestamp
+    and length of the sessions, if they are needed for the session sketches
+    """
+
+    window, invalid_bins, params, keep_sessions = task
+
+    timebin_len = params['timebin_len']
+
+    window = invalidate_off_bins(window, invalid_bins, timebin_len)
+    window = invalidate_twins(window)
+
+    window = prepare_screen_measurement(window, timebin_len, params['short_ses_len'], params['max_screen_ses'])
+    window = window.loc[~window['context'], :]
+
+    screen_mes_both = session_measures(window, timebin_len, params['short_ses_len'], params['session_cuts'])
+
+    sessions = window[['timestamp', 'timediff']] if keep_sessions else None
+
+    return screen_mes_both, sessions
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
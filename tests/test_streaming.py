@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from screen_behaviour.screen_behaviour import screen_behaviour
+from screen_behaviour.streaming import StreamingScreenAggregator
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+PARAMS = [dict(timebin_len = 900),
+          dict(timebin_len = 60, invalidate_cut = 600, short_ses_len = 10, max_screen_ses = 2000),
+          dict(timebin_len = 3600)]
+
+
+def user_history(seed, n = 300) :
+
+    """
+    Helper function for the tests
+
+    Return the screen events and the heartbeat stamps of a synthetic user, with twin events and a heartbeat gap
+    """
+
+    rng = np.random.default_rng(seed)
+
+    start = 1380585600
+    timestamps = []
+    screen_on = []
+
+    t = start
+    for i in range(n) :
+        t += int(rng.integers(1, 3000))
+        timestamps.append(t)
+        screen_on.append(1)
+        t += int(rng.choice([5, 20, 40, 300, 1000, 8000]))
+        timestamps.append(t)
+        screen_on.append(0)
+        if rng.random() < 0.05 :
+            timestamps.append(t + 1)
+            screen_on.append(0)
+
+    screen = pd.DataFrame({'user_idx': 1, 'timestamp': timestamps, 'screen_on': screen_on})
+
+    heartbeats = np.arange(start - 3600, t + 3600, 300)
+    heartbeats = heartbeats[rng.random(len(heartbeats)) > 0.3]
+    heartbeats = heartbeats[~((heartbeats > start + 100000) & (heartbeats < start + 120000))]
+
+    return screen, pd.DataFrame({'user_idx': 1, 'timestamp': heartbeats})
+
+
+def assert_same(frames, screen, heartbeats, params) :
+
+    """
+    Helper function for the tests
+
+    Check that the streamed timebins are the rows of screen_behaviour
+    """
+
+    expected = screen_behaviour(screen.copy(), heartbeats.copy(), **params).reset_index(drop = True)
+    streamed = pd.concat(frames, ignore_index = True)
+
+    assert list(streamed.columns) == list(expected.columns)
+    assert streamed.shape == expected.shape
+    assert (streamed.to_numpy() == expected.to_numpy()).all()
+
+
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+#*****************************************************************************************************************
+
+
+@pytest.mark.parametrize('params', PARAMS)
+@pytest.mark.parametrize('seed', range(4))
+def test_in_order(seed, params) :
+
+    screen, heartbeats = user_history(seed)
+    aggregator = StreamingScreenAggregator(1, **params)
+
+    events = screen.sort_values('timestamp', kind = 'mergesort')
+    stamps = np.sort(heartbeats['timestamp'].to_numpy())
+
+    frames = []
+    for timestamp, screen_on in zip(events['timestamp'], events['screen_on']) :
+        for stamp in stamps[(stamps <= timestamp) & (stamps > aggregator.heartbeat_bound)] :
+            aggregator.add_heartbeat(stamp)
+        aggregator.add_screen_event(timestamp, screen_on)
+        aggregator.advance_watermark(timestamp)
+        frames.append(aggregator.emit())
+
+    frames.append(aggregator.update(heartbeats = stamps[stamps > aggregator.heartbeat_bound]))
+    frames.append(aggregator.flush())
+
+    assert_same(frames, screen, heartbeats, params)
+
+
+@pytest.mark.parametrize('params', PARAMS)
+@pytest.mark.parametrize('seed', range(4))
+def test_batched(seed, params) :
+
+    screen, heartbeats = user_history(seed)
+    aggregator = StreamingScreenAggregator(1, **params)
+    rng = np.random.default_rng(seed + 100)
+
+    events = screen.sort_values('timestamp', kind = 'mergesort')
+    stamps = np.sort(heartbeats['timestamp'].to_numpy())
+
+    frames = []
+    i = j = 0
+    while i < len(events) or j < len(stamps) :
+        n_events = int(rng.integers(0, 5))
+        n_stamps = int(rng.integers(0, 8))
+        batch = events.iloc[i : i + n_events]
+        i += n_events
+        j += n_stamps
+        watermark = min(events['timestamp'].iloc[i] if i < len(events) else np.inf,
+                        stamps[j] if j < len(stamps) else np.inf)
+        frames.append(aggregator.update(batch, stamps[j - n_stamps : j],
+                                        watermark if np.isfinite(watermark) and rng.random() < 0.5 else None))
+
+    frames.append(aggregator.flush())
+
+    assert_same(frames, screen, heartbeats, params)
+
+
+@pytest.mark.parametrize('lagging', ['screen', 'heartbeats'])
+@pytest.mark.parametrize('params', PARAMS)
+def test_lagging_stream(lagging, params) :
+
+    screen, heartbeats = user_history(0)
+    aggregator = StreamingScreenAggregator(1, **params)
+
+    events = screen.sort_values('timestamp', kind = 'mergesort')
+    stamps = np.sort(heartbeats['timestamp'].to_numpy())
+
+    if lagging == 'screen' :
+        frames = [aggregator.update(events.iloc[:0], stamps), aggregator.update(events, [])]
+    else :
+        frames = [aggregator.update(events, []), aggregator.update(events.iloc[:0], stamps)]
+
+    frames.append(aggregator.flush())
+
+    assert_same(frames, screen, heartbeats, params)
+
+
+def test_screen_event_before_heartbeats() :
+
+    aggregator = StreamingScreenAggregator(0, 900, 2700)
+    aggregator.add_screen_event(1380000000, 1)
+
+    assert len(aggregator.emit()) == 0